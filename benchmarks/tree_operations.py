@@ -0,0 +1,91 @@
+"""
+Micro-benchmark of tree bookkeeping on large collections
+
+Compares the tree queries used by every pipeline step (`active_leaves`,
+`max_depth`, `leaves`) and the tree traversals with reference
+implementations of the original recursive, uncached versions, on a
+collection of deep and wide trees.
+
+Usage:
+    python benchmarks/tree_operations.py [--pages 200] [--regions 20] [--lines 30] [--repeat 5]
+"""
+
+import argparse
+import timeit
+
+from htrflow.results import Segment
+from htrflow.volume.volume import Collection
+
+
+IMAGE = "examples/images/pages/A0068699_00021.jpg"
+
+
+def build_collection(n_pages: int, n_regions: int, n_lines: int) -> Collection:
+    collection = Collection([IMAGE] * n_pages)
+    for page in collection:
+        page.create_segments([Segment(bbox=(0, 10 * i, 100, 10 * i + 10)) for i in range(n_regions)])
+        for region in page.children:
+            region.create_segments([Segment(bbox=(0, i, 100, i + 1)) for i in range(n_lines)])
+    return collection
+
+
+def reference_traverse(node, filter=None):
+    nodes = [node] if (filter is None or filter(node)) else []
+    for child in node.children:
+        nodes.extend(reference_traverse(child, filter))
+    return nodes
+
+
+def reference_active_leaves(collection):
+    max_depth = max(max(leaf.depth for leaf in reference_traverse(page, lambda n: n.is_leaf())) for page in collection)
+    leaves = [leaf for page in collection for leaf in reference_traverse(page, lambda n: n.is_leaf())]
+    return [leaf for leaf in leaves if leaf.depth == max_depth]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--regions", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    collection = build_collection(args.pages, args.regions, args.lines)
+    n_nodes = sum(len(page.traverse()) for page in collection)
+    print(f"{args.pages} pages, {n_nodes} nodes")
+
+    assert reference_active_leaves(collection) == list(collection.active_leaves())
+
+    def modify_one_page():
+        page = collection.pages[0]
+        page.add_data(touched=True)
+        return list(collection.active_leaves())
+
+    benchmarks = {
+        "active_leaves (reference)": lambda: reference_active_leaves(collection),
+        "active_leaves (cached)": lambda: list(collection.active_leaves()),
+        "active_leaves (after a change)": modify_one_page,
+        "max_depth per page (reference)": lambda: [
+            max(leaf.depth for leaf in reference_traverse(page, lambda n: n.is_leaf())) for page in collection
+        ],
+        "max_depth per page (cached)": lambda: [page.max_depth() for page in collection],
+        "traverse (reference)": lambda: [reference_traverse(page) for page in collection],
+        "traverse (iterative)": lambda: [page.traverse() for page in collection],
+        "count lines (reference)": lambda: sum(
+            len(reference_traverse(page, lambda n: n.depth == 2)) for page in collection
+        ),
+        "count lines (preorder)": lambda: sum(
+            sum(1 for _ in page.preorder(lambda n: n.depth == 2)) for page in collection
+        ),
+        "contains a line (reference)": lambda: [
+            any(reference_traverse(page, lambda n: n.depth == 2)) for page in collection
+        ],
+        "contains a line (any)": lambda: [page.any(lambda n: n.depth == 2) for page in collection],
+    }
+    for name, func in benchmarks.items():
+        seconds = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f"{name:<35} {seconds * 1000:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -63,11 +63,24 @@ def run_pipeline(
         typer.Option(help="Where to write logs to. If not provided, logs will be printed to the standard output."),
     ] = None,
     loglevel: Annotated[LogLevel, typer.Option(help="Loglevel", case_sensitive=False)] = LogLevel.info,
-    backup: Annotated[bool, typer.Option(help="Save a pickled backup after each pipeline step.")] = False,
+    backup: Annotated[bool, typer.Option(help="Save a checkpoint of each page after each pipeline step.")] = False,
     batch_output: Annotated[
         int | None,
         typer.Option(help="Write continuous output in batches of this size (number of images)."),
     ] = 1,
+    pool_pages: Annotated[
+        int,
+        typer.Option(
+            help=(
+                "Pool consecutive output batches (see --batch-output) until they hold at least this many images, and "
+                "run each inference step on the entire pool at once. This fills the models' batches with segments "
+                "from several pages. The output is still written batch by batch, but only once the entire pool has "
+                "passed through the pipeline: if a step fails, none of the pool's pages are exported (use --backup to "
+                "keep their checkpoints). With --stream, each queue between two steps holds a pool, so memory use "
+                "grows with the pool size. Defaults to 1 (no pooling)."
+            )
+        ),
+    ] = 1,
     label: Annotated[
         str | None,
         typer.Option(help="Collection label"),
@@ -78,6 +91,41 @@ def run_pipeline(
             help="A text file containing newline-separated paths to input images. Requires INPUTS to be empty."
         ),
     ] = None,
+    stream: Annotated[
+        bool,
+        typer.Option(
+            help=(
+                "Run the pipeline steps concurrently. Each pool of images (see --pool-pages) is passed from step to "
+                "step through bounded queues, so that different pools can be processed by different steps at the same "
+                "time."
+            )
+        ),
+    ] = False,
+    prefetch: Annotated[
+        int,
+        typer.Option(
+            help="Number of threads used to decode upcoming images in the background. 0 disables prefetching."
+        ),
+    ] = 0,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            help=(
+                "Resume an interrupted run from the checkpoints saved by --backup. Pages that already have passed "
+                "through the entire pipeline are skipped. Implies --backup."
+            )
+        ),
+    ] = False,
+    profile: Annotated[
+        str | None,
+        typer.Option(
+            help=(
+                "Write a profiling report to this path. The report holds the wall time, throughput and peak memory "
+                "usage of each pipeline step, and the time split of each model batch. Written as CSV if the path ends "
+                "with .csv, otherwise as JSON."
+            )
+        ),
+    ] = None,
 ):
     """Run a HTRflow pipeline"""
 
@@ -87,6 +135,7 @@ def run_pipeline(
     # Slow imports! Only import after all CLI arguments have been resolved.
     from htrflow.pipeline.pipeline import Pipeline
     from htrflow.pipeline.steps import auto_import
+    from htrflow.utils.profiling import profiler
 
     if isinstance(pipeline, Pipeline):
         pipe = pipeline
@@ -96,17 +145,28 @@ def run_pipeline(
             config = yaml.safe_load(file)
         pipe = Pipeline.from_config(config)
 
-    pipe.do_backup = backup
+    pipe.do_backup = backup or resume
+    pipe.resume = resume
+    pipe.streaming = stream
+    pipe.pool_pages = pool_pages
+
+    def prepare(collections):
+        for collection in collections:
+            if "labels" in config:
+                collection.set_label_format(**config["labels"])
+            if label:
+                collection.label = label
+            yield collection
+
+    if profile:
+        profiler.enable()
 
     tic = time.time()
-    collections = auto_import(inputs, max_size=batch_output)
+    collections = prepare(auto_import(inputs, max_size=batch_output, prefetch=prefetch))
+    processed = pipe.run_many(collections)
+
     n_pages = 0
-    for collection in collections:
-        if "labels" in config:
-            collection.set_label_format(**config["labels"])
-        if label:
-            collection.label = label
-        collection = pipe.run(collection)
+    for collection in processed:
         n_pages += len(collection.pages)
     toc = time.time()
 
@@ -118,6 +178,10 @@ def run_pipeline(
         total_time / n_pages if n_pages > 0 else -1.0,
     )
 
+    if profile:
+        profiler.log_summary()
+        profiler.save(profile)
+
 
 @app.command("evaluate")
 def run_evaluation(
@@ -1,13 +1,17 @@
+import contextlib
 import logging
+import time
 from abc import ABC, abstractmethod
 from itertools import islice
-from typing import Any, Collection, Generator, Iterable, TypeVar
+from typing import Any, Collection, Generator, Iterable, Literal, Sequence, TypeVar
 
 import torch
 from tqdm import tqdm
 
+from htrflow.models.cache import ResultCache
 from htrflow.results import Result
-from htrflow.utils.imgproc import NumpyImage, rescale_linear
+from htrflow.utils.imgproc import NumpyImage, rescale_cached
+from htrflow.utils.profiling import profiler
 
 
 logger = logging.getLogger(__name__)
@@ -25,7 +29,14 @@ class BaseModel(ABC):
     prediction method in `_predict()`.
     """
 
-    def __init__(self, device: str | None = None, allow_tf32: bool = True, allow_cudnn_benchmark: bool = False):
+    def __init__(
+        self,
+        device: str | None = None,
+        allow_tf32: bool = True,
+        allow_cudnn_benchmark: bool = False,
+        precision: Literal["fp32", "bf16", "int8"] | None = None,
+        num_threads: int | None = None,
+    ):
         """
         Arguments:
             device: Model device as a string, recognizable by torch. Defaults
@@ -43,8 +54,21 @@ class BaseModel(ABC):
                 nondeterminism. Defaults to False.
                 Read more here:
                 https://huggingface.co/docs/transformers/en/perf_train_gpu_one#tf32
+            precision: Inference precision. Three modes:
+                    - 'fp32': run the model in float32
+                    - 'bf16': run the model under bfloat16 autocast, which
+                        is faster on CPUs with native bfloat16 support
+                    - 'int8': quantize the weights of all linear layers to
+                        int8 (dynamic quantization, CPU only)
+                Defaults to None, which runs the model in the precision it
+                was loaded in. Reduced precision may affect the results;
+                the chosen precision is recorded in the model metadata.
+            num_threads: Number of threads torch uses for intra-op
+                parallelism on CPU. Note that this is a process-wide
+                setting. Defaults to None, which keeps torch's default.
         """
         self.metadata = {"model_class": self.__class__.__name__}
+        self.cache: ResultCache | None = None
         if device is None:
             device = "cuda" if torch.cuda.is_available() else "cpu"
         self.device = torch.device(device)
@@ -55,12 +79,52 @@ class BaseModel(ABC):
             torch.backends.cudnn.allow_tf32 = allow_tf32
             torch.backends.cudnn.benchmark = allow_cudnn_benchmark
 
+        if precision not in (None, "fp32", "bf16", "int8"):
+            raise ValueError(f"Unknown precision '{precision}'. Expected 'fp32', 'bf16' or 'int8'.")
+        if precision == "int8" and self.device.type != "cpu":
+            raise ValueError(f"Precision 'int8' is only supported on CPU, not on device '{self.device}'.")
+        self.precision = precision
+        if precision is not None:
+            self.metadata["precision"] = precision
+
+        self.num_threads = num_threads
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+    def _apply_precision(self, model: torch.nn.Module) -> torch.nn.Module:
+        """Prepare `model` for inference in the selected precision
+
+        Concrete models call this on their torch model after moving it to
+        `self.device`. Quantization happens in place.
+
+        Arguments:
+            model: The model.
+
+        Returns:
+            The prepared model.
+        """
+        if self.precision == "fp32":
+            model.float()
+        elif self.precision == "int8":
+            model.float()
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        logger.info("Running %s in precision %s", self.__class__.__name__, self.precision or "as loaded")
+        return model
+
+    def _autocast(self) -> contextlib.AbstractContextManager:
+        """Context in which `_predict()` runs, bfloat16 autocast if enabled"""
+        if self.precision == "bf16":
+            return torch.autocast(self.device.type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
     def predict(
         self,
         images: Collection[NumpyImage],
         batch_size: int = 1,
         image_scaling_factor: float = 1.0,
         tqdm_kwargs: dict[str, Any] | None = None,
+        batch_order: Literal["input", "width", "aspect_ratio"] = "input",
+        max_batch_pixels: int | None = None,
         **kwargs,
     ) -> list[Result]:
         """Perform inference on images
@@ -81,14 +145,65 @@ class BaseModel(ABC):
                 with respect to the original resolution.
             tqdm_kwargs: Optional keyword arguments to control the
                 progress bar.
+            batch_order: How the images are grouped into batches. Three
+                modes:
+                    - 'input': batch the images in input order (default)
+                    - 'width': sort the images by width before batching
+                    - 'aspect_ratio': sort the images by width-to-height
+                        ratio before batching
+                Sorting puts images of similar size in the same batch,
+                which reduces padding and, for text recognition models,
+                makes the generated sequences of a batch similar in
+                length. The results are always returned in input order.
+            max_batch_pixels: Optional pixel budget per batch. If given, a
+                batch is closed when adding another image would make its
+                padded size (number of images x largest height x largest
+                width) exceed this budget. `batch_size` is still the
+                maximum number of images per batch.
             **kwargs: Optional keyword arguments that are forwarded to
                 the model specific prediction method `_predict(...)`.
+
+        If `self.cache` is set to a `ResultCache`, only the images whose
+        results are not found in the cache are passed to the model.
         """
+        kwargs = kwargs | {
+            "batch_size": batch_size,
+            "image_scaling_factor": image_scaling_factor,
+            "tqdm_kwargs": tqdm_kwargs,
+            "batch_order": batch_order,
+            "max_batch_pixels": max_batch_pixels,
+        }
+        if self.cache is not None:
+            return self.cache.predict(self._predict_batches, self.metadata, images, **kwargs)
+        return self._predict_batches(images, **kwargs)
 
+    def _predict_batches(
+        self,
+        images: Collection[NumpyImage],
+        batch_size: int,
+        image_scaling_factor: float,
+        tqdm_kwargs: dict[str, Any] | None,
+        batch_order: Literal["input", "width", "aspect_ratio"],
+        max_batch_pixels: int | None,
+        **kwargs,
+    ) -> list[Result]:
+        """Run batched inference on images, see `BaseModel.predict()`"""
         batch_size = max(batch_size, 1)  # make sure batch size is at least 1
         image_scaling_factor = max(10e-10, min(image_scaling_factor, 1))  # clip scaling factor to (0, 1]
 
-        n_batches = (len(images) + batch_size - 1) // batch_size
+        if batch_order == "input" and max_batch_pixels is None:
+            index_batches = None
+            n_batches = (len(images) + batch_size - 1) // batch_size
+            batches = _batch(images, batch_size)
+        else:
+            if not hasattr(images, "__getitem__"):
+                images = list(images)
+            if max_batch_pixels is not None:
+                max_batch_pixels = max_batch_pixels / image_scaling_factor**2
+            index_batches = plan_batches(_image_shapes(images), batch_size, batch_order, max_batch_pixels)
+            n_batches = len(index_batches)
+            batches = ([images[i] for i in index_batch] for index_batch in index_batches)
+
         model_name = self.__class__.__name__
         logger.info(
             "Model '%s' on device '%s' received %d images in batches of %d images per batch (%d batches)",
@@ -100,16 +215,36 @@ class BaseModel(ABC):
         )
 
         results = []
-        batches = _batch(images, batch_size)
         desc = f"{model_name}: Running inference (batch size {batch_size})"
+        tic = time.perf_counter()
         for i, batch in enumerate(tqdm(batches, desc, n_batches, **(tqdm_kwargs or {}))):
-            msg = "%s: Running inference on %d images (batch %d of %d)"
-            logger.info(msg, model_name, len(batch), i + 1, n_batches)
-            scaled_batch = [rescale_linear(image, image_scaling_factor) for image in batch]
-            batch_results = self._predict(scaled_batch, **kwargs)
-            for result in batch_results:
-                result.rescale(1 / image_scaling_factor)
-                results.append(result)
+            with profiler.batch(model_name, len(batch)) as timings:
+                timings["load"] = time.perf_counter() - tic
+                msg = "%s: Running inference on %d images (batch %d of %d)"
+                logger.info(msg, model_name, len(batch), i + 1, n_batches)
+
+                t0 = time.perf_counter()
+                scaled_batch = [rescale_cached(image, image_scaling_factor) for image in batch]
+                t1 = time.perf_counter()
+                with self._autocast():
+                    batch_results = self._predict(scaled_batch, **kwargs)
+                t2 = time.perf_counter()
+                for result in batch_results:
+                    result.rescale(1 / image_scaling_factor)
+                    results.append(result)
+
+                timings["preprocess"] = t1 - t0
+                timings["forward"] = t2 - t1
+                timings["postprocess"] = time.perf_counter() - t2
+            tic = time.perf_counter()
+
+        if index_batches is not None:
+            # Restore input order
+            order = [i for index_batch in index_batches for i in index_batch]
+            ordered_results = [None] * len(order)
+            for i, result in zip(order, results):
+                ordered_results[i] = result
+            results = ordered_results
         return results
 
     @abstractmethod
@@ -121,6 +256,65 @@ class BaseModel(ABC):
         return self.predict(images, **kwargs)
 
 
+def plan_batches(
+    shapes: Sequence[tuple[int, int]],
+    batch_size: int,
+    batch_order: Literal["input", "width", "aspect_ratio"] = "input",
+    max_batch_pixels: float | None = None,
+) -> list[list[int]]:
+    """Group images into batches based on their shapes
+
+    Arguments:
+        shapes: The images' shapes as (height, width) tuples.
+        batch_size: Maximum number of images per batch.
+        batch_order: Sort order, see `BaseModel.predict`.
+        max_batch_pixels: Optional pixel budget per batch, see
+            `BaseModel.predict`.
+
+    Returns:
+        A list of batches, where each batch is a list of indices into
+        `shapes`. Each index occurs exactly once.
+    """
+    if batch_order == "input":
+        order = list(range(len(shapes)))
+    elif batch_order == "width":
+        order = sorted(range(len(shapes)), key=lambda i: shapes[i][1])
+    elif batch_order == "aspect_ratio":
+        order = sorted(range(len(shapes)), key=lambda i: shapes[i][1] / max(shapes[i][0], 1))
+    else:
+        raise ValueError(f"Unknown batch order '{batch_order}'. Expected 'input', 'width' or 'aspect_ratio'.")
+
+    batches = []
+    batch = []
+    max_height = max_width = 0
+    for i in order:
+        height, width = shapes[i][:2]
+        new_height, new_width = max(max_height, height), max(max_width, width)
+        is_full = len(batch) >= batch_size
+        over_budget = max_batch_pixels is not None and (len(batch) + 1) * new_height * new_width > max_batch_pixels
+        if batch and (is_full or over_budget):
+            batches.append(batch)
+            batch = []
+            new_height, new_width = height, width
+        batch.append(i)
+        max_height, max_width = new_height, new_width
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _image_shapes(images: Collection[NumpyImage]) -> list[tuple[int, int]]:
+    """Get the (height, width) shapes of `images`
+
+    Uses the `shapes()` method of the input if available (see
+    `volume.ImageGenerator`), which avoids loading the images.
+    """
+    if hasattr(images, "shapes"):
+        return images.shapes()
+    return [image.shape[:2] for image in images]
+
+
 def _batch(iterable: Iterable[_T], batch_size: int) -> Generator[list[_T], None, None]:
     """Yield fixed-size batches from `iterable`"""
     # TODO: Replace this routine with itertools.batch in Python 3.12
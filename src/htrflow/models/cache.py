@@ -0,0 +1,229 @@
+"""
+On-disk cache of model results
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+from typing import Any, Callable, Sequence
+
+import numpy as np
+
+from htrflow.results import Result
+from htrflow.utils.imgproc import NumpyImage
+
+
+logger = logging.getLogger(__name__)
+
+# Arguments of `BaseModel.predict()` that don't affect the results, and
+# therefore are not part of the cache keys.
+_IGNORED_KWARGS = {"batch_size", "tqdm_kwargs", "batch_order", "max_batch_pixels"}
+
+
+class ResultCache:
+    """Content-addressed on-disk cache of model results
+
+    Each result is stored under a key computed from the pixels of its
+    input image, the model's metadata (which includes the model id and
+    revision) and the prediction arguments. Re-running a model on the
+    same images with the same settings therefore returns the cached
+    results without running the model, regardless of where the images
+    come from.
+
+    The cache is bounded by size. When it grows beyond `max_bytes`, the
+    least recently used results are evicted.
+
+    Attributes:
+        hits: Number of results found in the cache.
+        misses: Number of results not found in the cache.
+    """
+
+    def __init__(self, directory: str = os.path.join(".cache", "results"), max_bytes: int = 2**30):
+        """
+        Arguments:
+            directory: Directory of the cache.
+            max_bytes: Maximum total size of the cache in bytes. Defaults
+                to 1 GiB.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = sum(os.path.getsize(path) for path, _ in self._entries())
+
+    def predict(
+        self,
+        predict: Callable[..., list[Result]],
+        metadata: dict[str, Any],
+        images: Sequence[NumpyImage],
+        **kwargs,
+    ) -> list[Result]:
+        """Run `predict` on the images that are not in the cache
+
+        Arguments:
+            predict: The uncached prediction function, called as
+                `predict(images, **kwargs)`.
+            metadata: The model's metadata.
+            images: Input images.
+            **kwargs: Prediction arguments.
+
+        Returns:
+            A list of results, in the same order as the input images.
+        """
+        if not hasattr(images, "__getitem__"):
+            images = list(images)
+
+        model_key = _model_key(metadata, kwargs)
+        keys = [_image_key(image, model_key) for image in images]
+        results = [self.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+
+        n_hits = len(results) - len(misses)
+        self.hits += n_hits
+        self.misses += len(misses)
+        logger.info(
+            "Found %d of %d results in cache %s (%d hits, %d misses in total)",
+            n_hits,
+            len(results),
+            self.directory,
+            self.hits,
+            self.misses,
+        )
+
+        if misses:
+            # Identical images are only passed to the model once
+            unique = list({keys[i]: i for i in reversed(misses)}.values())[::-1]
+            new_results = predict(_Subset(images, unique), **kwargs)
+            computed = {}
+            for i, result in zip(unique, new_results):
+                self.put(keys[i], result)
+                results[i] = computed[keys[i]] = result
+            for i in misses:
+                if results[i] is None:
+                    # Duplicates get their own copy, since results may be modified downstream
+                    results[i] = copy.deepcopy(computed[keys[i]])
+        return results
+
+    def get(self, key: str) -> Result | None:
+        """Get the result stored under `key`, or None if there is no such result"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            logger.warning("Removing unreadable cache entry %s", path)
+            self._remove(path)
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path)
+        return result
+
+    def put(self, key: str, result: Result) -> None:
+        """Store `result` under `key`"""
+        path = self._path(key)
+        if os.path.exists(path):
+            self._size -= os.path.getsize(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def clear(self) -> None:
+        """Remove all entries from the cache"""
+        for path, _ in self._entries():
+            self._remove(path)
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until the cache is below 90% of its maximum size"""
+        target = 0.9 * self.max_bytes
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        n_evicted = 0
+        for path, _ in entries:
+            if self._size <= target:
+                break
+            self._remove(path)
+            n_evicted += 1
+        logger.info("Evicted %d entries from cache %s", n_evicted, self.directory)
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            # Removed by another process sharing the cache
+            return
+        self._size -= size
+
+    def _entries(self) -> list[tuple[str, float]]:
+        """All entries of the cache as (path, last access time) tuples"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".pickle"):
+                    path = os.path.join(root, file)
+                    try:
+                        entries.append((path, os.path.getmtime(path)))
+                    except FileNotFoundError:
+                        continue
+        return entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pickle")
+
+
+def _model_key(metadata: dict[str, Any], kwargs: dict[str, Any]) -> str:
+    """Hash of the model metadata and the prediction arguments that affect the results"""
+    kwargs = {key: value for key, value in kwargs.items() if key not in _IGNORED_KWARGS}
+    serialized = json.dumps({"metadata": metadata, "kwargs": kwargs}, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _image_key(image: NumpyImage, model_key: str) -> str:
+    """Cache key of `image` given `model_key`"""
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha256(model_key.encode("utf-8"))
+    digest.update(f"{image.shape}{image.dtype}".encode("utf-8"))
+    digest.update(image.data)
+    return digest.hexdigest()
+
+
+class _Subset:
+    """A lazy subset of a sequence of images"""
+
+    def __init__(self, images: Sequence[NumpyImage], indices: list[int]):
+        self._images = images
+        self._indices = indices
+
+    def __iter__(self):
+        for i in self._indices:
+            yield self._images[i]
+
+    def __getitem__(self, idx: int) -> NumpyImage:
+        return self._images[self._indices[idx]]
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def shapes(self) -> list[tuple[int, int]]:
+        if hasattr(self._images, "shapes"):
+            shapes = self._images.shapes()
+            return [shapes[i] for i in self._indices]
+        return [image.shape[:2] for image in self]
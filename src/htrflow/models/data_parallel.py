@@ -0,0 +1,277 @@
+"""
+Data-parallel inference with one model replica per worker process
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import traceback
+from collections import Counter
+from typing import Any, Collection, Sequence
+
+from htrflow.models.base_model import BaseModel, _batch
+from htrflow.models.cache import ResultCache
+from htrflow.results import Result
+from htrflow.utils.imgproc import NumpyImage
+from htrflow.utils.shared_memory import ImageArena, SharedImage, attach
+
+
+logger = logging.getLogger(__name__)
+
+
+class DataParallelModel:
+    """
+    Data-parallel wrapper around a model class
+
+    Starts one worker process per device. Each worker holds its own
+    replica of the model, pinned to its device. The inputs are split
+    into chunks which are distributed to the workers as they become
+    idle, and the results are merged back into input order.
+
+    Workers on the same CPU device ('cpu') are given disjoint sets of
+    the available CPU cores, so that the replicas don't compete for
+    the same cores.
+
+    With `shared_memory=True`, the images are passed to the workers
+    through shared memory instead of being pickled (see
+    `<utils.shared_memory.ImageArena>`). Images that are already in
+    the wrapper's `arena`, or are views into such images, are sent
+    without copying any pixel data. Other images are copied to shared
+    memory once, which is still cheaper than pickling them.
+
+    The wrapper supports the same prediction interface as `BaseModel`,
+    and can be used in place of a model instance. Like a model, the
+    wrapper loads its replicas on initialization. The worker processes
+    are kept alive until `close()` is called or the interpreter exits.
+    """
+
+    def __init__(
+        self,
+        model_class: type[BaseModel],
+        model_kwargs: dict[str, Any],
+        devices: Sequence[str],
+        chunk_size: int | None = None,
+        shared_memory: bool = False,
+    ):
+        """
+        Arguments:
+            model_class: The model class to instantiate in each worker.
+                It must be importable by the worker processes.
+            model_kwargs: Keyword arguments used to initialize the model
+                replicas. The `device` argument is set per worker.
+            devices: One device per worker, for example ["cuda:0", "cuda:1"]
+                or ["cpu", "cpu", "cpu", "cpu"].
+            chunk_size: Number of images sent to a worker at a time.
+                Defaults to four times the batch size passed to `predict()`.
+            shared_memory: Whether to pass the images to the workers
+                through shared memory.
+        """
+        if not devices:
+            raise ValueError("DataParallelModel needs at least one device.")
+        self.model_class = model_class
+        self.model_kwargs = {key: value for key, value in model_kwargs.items() if key != "device"}
+        self.devices = list(devices)
+        self.chunk_size = chunk_size
+        self.metadata = {"model_class": model_class.__name__, "devices": self.devices}
+        self.cache: ResultCache | None = None
+        self.arena = ImageArena() if shared_memory else None
+        self._workers = []
+        self._tasks = None
+        self._results = None
+        self._start()
+
+    def predict(self, images: Collection[NumpyImage], batch_size: int = 1, **kwargs) -> list[Result]:
+        """Perform inference on images
+
+        Arguments:
+            images: Input images
+            batch_size: Inference batch size of each worker, defaults to 1
+            **kwargs: Optional keyword arguments that are forwarded to
+                `BaseModel.predict()` in the workers.
+
+        Returns:
+            A list of results, in the same order as the input images.
+        """
+        if self.cache is not None:
+            # The devices don't affect the results
+            metadata = {key: value for key, value in self.metadata.items() if key != "devices"}
+            return self.cache.predict(self._predict_chunks, metadata, images, batch_size=batch_size, **kwargs)
+        return self._predict_chunks(images, batch_size=batch_size, **kwargs)
+
+    def _predict_chunks(self, images: Collection[NumpyImage], batch_size: int, **kwargs) -> list[Result]:
+        """Distribute the images to the workers and gather the results"""
+        if not self._workers:
+            raise RuntimeError("The worker processes have been stopped.")
+
+        chunk_size = self.chunk_size or 4 * max(batch_size, 1)
+        chunks = enumerate(_batch(images, chunk_size))
+        n_chunks = (len(images) + chunk_size - 1) // chunk_size
+        logger.info(
+            "Distributing %d images in %d chunks over %d workers (%s)",
+            len(images),
+            n_chunks,
+            len(self._workers),
+            ", ".join(self.devices),
+        )
+
+        kwargs = kwargs | {"batch_size": batch_size, "tqdm_kwargs": {"disable": True}}
+        chunk_results = [None] * n_chunks
+        chunk_handles = {}
+        n_in_flight = 0
+        max_in_flight = 2 * len(self._workers)
+
+        try:
+            for chunk_index, chunk in chunks:
+                if n_in_flight >= max_in_flight:
+                    self._collect(chunk_results, chunk_handles)
+                    n_in_flight -= 1
+                if self.arena is not None:
+                    chunk = chunk_handles[chunk_index] = [self._share(image) for image in chunk]
+                self._tasks.put((chunk_index, chunk, kwargs))
+                n_in_flight += 1
+
+            while n_in_flight:
+                self._collect(chunk_results, chunk_handles)
+                n_in_flight -= 1
+        finally:
+            for handles in chunk_handles.values():
+                for handle in handles:
+                    self.arena.release(handle)
+
+        return [result for results in chunk_results for result in results]
+
+    def __call__(self, images: Collection[NumpyImage], **kwargs) -> list[Result]:
+        """Alias for DataParallelModel.predict(...)"""
+        return self.predict(images, **kwargs)
+
+    def close(self) -> None:
+        """Stop the worker processes"""
+        if not self._workers:
+            return
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        if self.arena is not None:
+            self.arena.close()
+        atexit.unregister(self.close)
+
+    def _start(self) -> None:
+        """Start one worker process per device and wait until all models are loaded"""
+        # CUDA cannot be re-initialized in forked processes, so the
+        # workers are always spawned.
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+
+        cores = _split_cores(self.devices)
+        for rank, device in enumerate(self.devices):
+            args = (rank, self.model_class, self.model_kwargs | {"device": device}, cores[rank])
+            args += (self._tasks, self._results)
+            worker = context.Process(target=_work, args=args, name=f"htrflow-worker-{rank}")
+            worker.start()
+            self._workers.append(worker)
+        atexit.register(self.close)
+
+        for _ in self._workers:
+            rank, metadata = self._get()
+            logger.info("Worker %d loaded model on device '%s'", rank, self.devices[rank])
+        self.metadata = metadata | {"devices": self.devices}
+
+    def _share(self, image: NumpyImage) -> SharedImage:
+        """Return a shared memory handle of `image`, copying it to the arena if needed"""
+        if (handle := self.arena.handle(image)) is None:
+            # The copy is released when its chunk is done, since the handle holds the only reference
+            handle = self.arena.handle(self.arena.share(image))
+        return handle
+
+    def _collect(self, chunk_results: list[list[Result] | None], chunk_handles: dict[int, list[SharedImage]]) -> None:
+        """Wait for one chunk of results and put it in its place in `chunk_results`
+
+        The shared memory handles of the chunk, if any, are released.
+        """
+        chunk_index, results = self._get()
+        chunk_results[chunk_index] = results
+        for handle in chunk_handles.pop(chunk_index, []):
+            self.arena.release(handle)
+
+    def _get(self) -> tuple[int, Any]:
+        """Get the next message from the workers
+
+        Raises:
+            RuntimeError: If a worker failed or died.
+        """
+        while True:
+            try:
+                key, value = self._results.get(timeout=1)
+            except queue.Empty:
+                if dead := [worker.name for worker in self._workers if not worker.is_alive()]:
+                    self.close()
+                    raise RuntimeError(f"Worker process(es) {', '.join(dead)} died unexpectedly.")
+                continue
+            if isinstance(value, _WorkerError):
+                self.close()
+                raise RuntimeError(f"Inference failed in worker process:\n{value.traceback}")
+            return key, value
+
+
+class _WorkerError:
+    """Wrapper used to pass a formatted exception from a worker to the main process"""
+
+    def __init__(self, traceback: str):
+        self.traceback = traceback
+
+
+def _split_cores(devices: Sequence[str]) -> list[set[int] | None]:
+    """Split the available CPU cores evenly between the CPU devices
+
+    Returns one set of cores per device. Non-CPU devices, and all
+    devices on platforms that don't support CPU affinity, get None.
+    """
+    n_cpu_workers = Counter(device.split(":")[0] for device in devices)["cpu"]
+    if not n_cpu_workers or not hasattr(os, "sched_getaffinity"):
+        return [None] * len(devices)
+
+    available = sorted(os.sched_getaffinity(0))
+    per_worker = max(len(available) // n_cpu_workers, 1)
+    cores = []
+    cpu_rank = 0
+    for device in devices:
+        if device.split(":")[0] == "cpu":
+            start = (cpu_rank * per_worker) % len(available)
+            cores.append(set(available[start : start + per_worker]))
+            cpu_rank += 1
+        else:
+            cores.append(None)
+    return cores
+
+
+def _work(rank, model_class, model_kwargs, cores, tasks, results):
+    """Worker process main loop"""
+    try:
+        if cores:
+            import torch
+
+            os.sched_setaffinity(0, cores)
+            torch.set_num_threads(len(cores))
+        model = model_class(**model_kwargs)
+    except BaseException:
+        results.put((rank, _WorkerError(traceback.format_exc())))
+        return
+    results.put((rank, model.metadata))
+
+    while (task := tasks.get()) is not None:
+        chunk_index, images, kwargs = task
+        try:
+            if images and isinstance(images[0], SharedImage):
+                images = attach(images)
+            results.put((chunk_index, model.predict(images, **kwargs)))
+        except BaseException:
+            results.put((chunk_index, _WorkerError(traceback.format_exc())))
+        # Unmap the shared images before waiting for the next chunk
+        del images
@@ -8,6 +8,7 @@ from transformers import AutoImageProcessor, AutoModelForImageClassification
 from htrflow.models.base_model import BaseModel
 from htrflow.models.download import get_model_info
 from htrflow.results import Result
+from htrflow.utils import profiling
 
 
 logger = logging.getLogger(__name__)
@@ -29,6 +30,7 @@ class DiT(BaseModel):
         model_kwargs: dict | None = None,
         processor_kwargs: dict | None = None,
         device: str | None = None,
+        **kwargs,
     ):
         """Initialize a DiT model
 
@@ -40,14 +42,16 @@ class DiT(BaseModel):
                 AutoModelForImageClassification.from_pretrained().
             processor_kwargs: Processor initialization kwargs that are forwarded
                 to AutoImageProcessor.from_pretrained().
-            kwargs: Additional kwargs that are forwarded to BaseModel's __init__.
+            kwargs: Additional kwargs that are forwarded to BaseModel's __init__,
+                for example `precision` and `num_threads`.
         """
-        super().__init__(device)
+        super().__init__(device, **kwargs)
 
         # Initialize model
         model_kwargs = model_kwargs or {}
         self.model = AutoModelForImageClassification.from_pretrained(model, **model_kwargs)
         self.model.to(self.device)
+        self.model = self._apply_precision(self.model)
         logger.info("Initialized DiT model from %s on device %s.", model, self.device)
 
         # Initialize processor
@@ -84,7 +88,8 @@ class DiT(BaseModel):
                 - "argmax": returns the most probable class label for each
                     image.
         """
-        inputs = self.processor(images, return_tensors="pt").pixel_values
+        with profiling.phase("preprocess"):
+            inputs = self.processor(images, return_tensors="pt").pixel_values
 
         with torch.no_grad():
             batch_logits = self.model(inputs.to(self.model.device)).logits
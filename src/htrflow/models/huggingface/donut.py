@@ -36,7 +36,8 @@ class Donut(BaseModel):
                 VisionEncoderDecoderModel.from_pretrained.
             processor_kwargs: Processor initialization kwargs which are forwarded to DonutProcessor.from_pretrained.
             prompt: Task prompt to use for all decoding tasks. Defaults to '<s>'.
-            kwargs: Additional kwargs which are forwarded to BaseModel's __init__.
+            kwargs: Additional kwargs which are forwarded to BaseModel's __init__, for example `precision` and
+                `num_threads`.
         """
         super().__init__(**kwargs)
 
@@ -44,6 +45,7 @@ class Donut(BaseModel):
         model_kwargs = model_kwargs or {}
         self.model = VisionEncoderDecoderModel.from_pretrained(model, **model_kwargs)
         self.model.to(self.device)
+        self.model = self._apply_precision(self.model)
         logger.info("Initialized Donut model from %s on device %s.", model, self.model.device)
 
         # Initialize processor
@@ -21,6 +21,14 @@ from htrflow.utils import imgproc
 
 logger = logging.getLogger(__name__)
 
+# The weights are loaded in half precision unless another precision is requested
+_PRECISION_DTYPES = {
+    None: torch.float16,
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+    "int8": torch.float32,
+}
+
 
 class LLavaNext(BaseModel):
     default_generation_kwargs = {"num_beams": 1, "max_new_tokens": 200}
@@ -32,8 +40,9 @@ class LLavaNext(BaseModel):
         prompt: str = "[INST] <image> Please transcribe the handwritten English text displayed in the image [/INST]",
         device: str | None = None,
         *model_args,
+        **kwargs,
     ):
-        super().__init__(device)
+        super().__init__(device, **kwargs)
 
         # nf4_config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_quant_type="nf4")
 
@@ -42,12 +51,13 @@ class LLavaNext(BaseModel):
             cache_dir=self.cache_dir,
             token=True,
             # quantization_config=nf4_config,
-            torch_dtype=torch.float16,
+            torch_dtype=_PRECISION_DTYPES[self.precision],
             low_cpu_mem_usage=True,
             *model_args,
         )
 
         self.model.to(self.device)
+        self.model = self._apply_precision(self.model)
 
         processor = processor or model
 
@@ -1,5 +1,6 @@
 import logging
-from typing import Any
+import os
+from typing import Any, Literal
 
 import numpy as np
 import torch
@@ -8,11 +9,26 @@ from transformers.utils import ModelOutput
 
 from htrflow.models.base_model import BaseModel
 from htrflow.models.download import get_model_info
+from htrflow.models.huggingface.trocr_onnx import OnnxGenerationOutput, OnnxTrOCR
 from htrflow.results import Result
+from htrflow.utils import profiling
 
 
 logger = logging.getLogger(__name__)
 
+# Generation settings that the ONNX backend implements (or, like
+# `return_dict_in_generate`, always behaves as if they were set)
+_ONNX_GENERATION_KWARGS = {
+    "num_beams",
+    "max_new_tokens",
+    "length_penalty",
+    "output_attentions",
+    "output_scores",
+    "return_dict_in_generate",
+    "num_return_sequences",
+    "early_stopping",
+}
+
 
 class TrOCR(BaseModel):
     """
@@ -36,6 +52,24 @@ class TrOCR(BaseModel):
           batch_size: 8
           num_beams: 1
     ```
+
+    With `backend: onnx`, the model runs on ONNX Runtime instead of
+    PyTorch (see `<models.huggingface.trocr_onnx.OnnxTrOCR>`). The model
+    is exported to ONNX on first use, or loaded from `onnx_dir` if it
+    has already been exported there. Greedy decoding and beam search
+    are supported, but not sampling. This is typically considerably
+    faster on CPU.
+
+    Example:
+    ```yaml
+    - step: TextRecognition
+      settings:
+        model: TrOCR
+        model_settings:
+          model: Riksarkivet/trocr-base-handwritten-hist-swe-2
+          backend: onnx
+          onnx_dir: models/trocr-onnx
+    ```
     """
 
     def __init__(
@@ -44,6 +78,8 @@ class TrOCR(BaseModel):
         processor: str | None = None,
         model_kwargs: dict[str, Any] | None = None,
         processor_kwargs: dict[str, Any] | None = None,
+        backend: Literal["torch", "onnx"] = "torch",
+        onnx_dir: str | None = None,
         **kwargs,
     ):
         """
@@ -55,18 +91,41 @@ class TrOCR(BaseModel):
                 VisionEncoderDecoderModel.from_pretrained.
             processor_kwargs: Processor initialization kwargs which are
                 forwarded to TrOCRProcessor.from_pretrained.
+            backend: Inference backend, "torch" or "onnx".
+            onnx_dir: Directory of the ONNX export, used with the "onnx"
+                backend. Defaults to a directory under .cache/onnx named
+                after the model.
             kwargs: Additional kwargs which are forwarded to BaseModel's
-                __init__.
+                __init__, for example `precision` and `num_threads`. With
+                the "onnx" backend, `num_threads` sets the number of threads
+                of the ONNX Runtime sessions.
         """
         super().__init__(**kwargs)
 
         # Initialize model
         model_kwargs = model_kwargs or {}
         self.decoding = model_kwargs.pop("decoding", None)
+        if backend == "onnx":
+            # The exported graphs output attention weights, which needs eager attention
+            model_kwargs.setdefault("attn_implementation", "eager")
         self.model = VisionEncoderDecoderModel.from_pretrained(model, **model_kwargs)
         self.model.to(self.device)
         logger.info("Initialized TrOCR model from %s on device %s.", model, self.model.device)
 
+        self.onnx = None
+        if backend == "onnx":
+            if self.precision not in (None, "fp32"):
+                raise ValueError(f"The ONNX backend does not support precision '{self.precision}'.")
+            onnx_dir = onnx_dir or _default_onnx_dir(model, model_kwargs.get("revision"))
+            if not OnnxTrOCR.exists(onnx_dir):
+                OnnxTrOCR.export(self.model, onnx_dir)
+                self.model.to(self.device)
+            self.onnx = OnnxTrOCR.from_directory(onnx_dir, self.num_threads)
+        elif backend == "torch":
+            self.model = self._apply_precision(self.model)
+        else:
+            raise ValueError(f"Unknown TrOCR backend '{backend}'. Expected 'torch' or 'onnx'.")
+
         # Initialize processor
         processor = processor or model
         processor_kwargs = processor_kwargs or {}
@@ -79,6 +138,7 @@ class TrOCR(BaseModel):
                 "model_version": get_model_info(model, model_kwargs.get("revision", None)),
                 "processor": processor,
                 "processor_version": get_model_info(processor, processor_kwargs.get("revision", None)),
+                "backend": backend,
             }
         )
 
@@ -108,11 +168,13 @@ class TrOCR(BaseModel):
 
         # Do inference
         with torch.no_grad():
-            model_inputs = self.processor(images, return_tensors="pt").pixel_values
-            model_outputs = self.model.generate(model_inputs.to(self.model.device), **generation_kwargs)
+            with profiling.phase("preprocess"):
+                model_inputs = self.processor(images, return_tensors="pt").pixel_values
+            model_outputs = self._generate(model_inputs, **generation_kwargs)
 
-            texts = self.processor.batch_decode(model_outputs.sequences, skip_special_tokens=True)
-            scores = self._compute_sequence_scores(model_outputs)
+            with profiling.phase("postprocess"):
+                texts = self.processor.batch_decode(model_outputs.sequences, skip_special_tokens=True)
+                scores = self._compute_sequence_scores(model_outputs)
 
         # Assemble and return a list of Result objects from the prediction outputs.
         # `texts` and `scores` are flattened lists so we need to iterate over them in steps.
@@ -141,7 +203,35 @@ class TrOCR(BaseModel):
             results.append(result)
         return results
 
-    def _compute_sequence_scores(self, outputs: ModelOutput):
+    def _generate(self, pixel_values: torch.Tensor, **generation_kwargs) -> ModelOutput | OnnxGenerationOutput:
+        """Generate token sequences with the selected backend"""
+        if self.onnx is None:
+            return self.model.generate(pixel_values.to(self.model.device), **generation_kwargs)
+
+        if unsupported := sorted(set(generation_kwargs) - _ONNX_GENERATION_KWARGS):
+            logger.warning("The ONNX backend ignores the generation settings %s.", ", ".join(unsupported))
+
+        config = self.model.generation_config
+        max_new_tokens = generation_kwargs.get("max_new_tokens") or config.max_new_tokens or config.max_length - 1
+        length_penalty = generation_kwargs.get("length_penalty")
+        if length_penalty is None:
+            length_penalty = 1.0 if config.length_penalty is None else config.length_penalty
+        early_stopping = generation_kwargs.get("early_stopping")
+        if early_stopping is None:
+            early_stopping = config.early_stopping or False
+        return self.onnx.generate(
+            pixel_values.numpy(),
+            decoder_start_token_id=config.decoder_start_token_id or self.model.config.decoder_start_token_id,
+            eos_token_id=config.eos_token_id,
+            pad_token_id=config.pad_token_id,
+            max_new_tokens=max_new_tokens,
+            num_beams=generation_kwargs.get("num_beams") or 1,
+            length_penalty=length_penalty,
+            early_stopping=early_stopping,
+            output_attentions=generation_kwargs.get("output_attentions", False),
+        )
+
+    def _compute_sequence_scores(self, outputs: ModelOutput | OnnxGenerationOutput):
         """Compute normalized prediction score for each output sequence
 
         This function computes the normalized sequence scores from the output.
@@ -149,6 +239,9 @@ class TrOCR(BaseModel):
         It follows example #1 found here:
         https://discuss.huggingface.co/t/announcement-generation-get-probabilities-for-generated-output/30075
         """
+        if isinstance(outputs, OnnxGenerationOutput):
+            # Computed the same way during decoding
+            return outputs.sequence_scores
         beam_indices = getattr(outputs, "beam_indices", None)
         transition_scores = self.compute_transition_scores(
             outputs.sequences,
@@ -213,10 +306,7 @@ class WordLevelTrOCR(TrOCR):
                 )
 
         inputs = self.processor(images, return_tensors="pt").pixel_values
-        outputs = self.model.generate(
-            inputs.to(self.model.device),
-            **(generation_kwargs | config_overrides),
-        )
+        outputs = self._generate(inputs, **(generation_kwargs | config_overrides))
 
         # Warn if `max_new_tokens` was given and the limit was reached
         n_tokens = outputs.sequences.shape[1] - 1   # -1 to ignore BOS token
@@ -378,3 +468,11 @@ def _find_intersections(columns):
             intersection = int((lo + hi) / 2)
         result.append(int(intersection + lo))
     return [x / columns.shape[1] for x in result]
+
+
+def _default_onnx_dir(model: str, revision: str | None) -> str:
+    """Default directory of the ONNX export of `model`"""
+    name = model.strip("/").replace("/", "--")
+    if revision:
+        name += f"--{revision}"
+    return os.path.join(".cache", "onnx", name)
@@ -0,0 +1,583 @@
+"""
+ONNX Runtime backend for TrOCR
+
+The model is split into three ONNX graphs, with the same file names and
+input/output names as Hugging Face Optimum's seq2seq exports:
+
+    - encoder_model.onnx: pixel_values -> last_hidden_state
+    - decoder_model.onnx: the first decoding step, which computes the
+      cross-attention keys and values from the encoder output
+    - decoder_with_past_model.onnx: all following decoding steps, which
+      take the keys and values of the previous steps as input
+
+Graphs exported by `OnnxTrOCR.export()` additionally output the cross-
+attention weights of each step (`cross_attentions.{i}`), which are
+needed by `WordLevelTrOCR`.
+
+Decoding (greedy or beam search) runs in NumPy around the decoder
+sessions. The keys and values are kept in ONNX Runtime's own buffers
+(`OrtValue`s) and bound as inputs of the next step with IO binding, so
+they are never copied to NumPy; only the logits and attention weights
+are. Beam search copies the rows of the self-attention cache when the
+beams are reordered.
+"""
+
+import ctypes
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+import numpy as np
+import torch
+from transformers import VisionEncoderDecoderModel
+from transformers.cache_utils import EncoderDecoderCache
+
+
+logger = logging.getLogger(__name__)
+
+
+ENCODER_FILE = "encoder_model.onnx"
+DECODER_FILE = "decoder_model.onnx"
+DECODER_WITH_PAST_FILE = "decoder_with_past_model.onnx"
+
+
+@dataclass
+class OnnxGenerationOutput:
+    """Output of `OnnxTrOCR.generate()`
+
+    Mirrors the parts of transformers' generation output that are used
+    by the TrOCR wrappers.
+
+    Attributes:
+        sequences: Generated token ids of shape (batch_size * num_beams,
+            sequence_length), starting with the decoder start token and
+            padded with the pad token after the end-of-sequence token.
+        sequence_scores: Length-normalized sequence probabilities, one
+            per sequence, computed like `TrOCR._compute_sequence_scores`.
+        cross_attentions: Cross-attention weights if requested, in the
+            same format as `generate(output_attentions=True)`: one tuple
+            per generated token of one (batch_size, num_heads, 1,
+            encoder_sequence_length) tensor per decoder layer.
+    """
+
+    sequences: torch.Tensor
+    sequence_scores: list[float]
+    cross_attentions: tuple[tuple[torch.Tensor, ...], ...] | None = None
+
+
+class OnnxTrOCR:
+    """TrOCR inference with ONNX Runtime
+
+    Example:
+    ```python
+    model = VisionEncoderDecoderModel.from_pretrained(name, attn_implementation="eager")
+    OnnxTrOCR.export(model, "trocr-onnx")
+    onnx_model = OnnxTrOCR.from_directory("trocr-onnx")
+    outputs = onnx_model.generate(pixel_values, decoder_start_token_id=2, eos_token_id=2, pad_token_id=1)
+    ```
+    """
+
+    def __init__(self, encoder, decoder, decoder_with_past):
+        """
+        Arguments:
+            encoder: Inference session of the encoder graph.
+            decoder: Inference session of the first decoder step.
+            decoder_with_past: Inference session of the following decoder steps.
+        """
+        self.encoder = encoder
+        self.decoder = decoder
+        self.decoder_with_past = decoder_with_past
+        self.n_layers = sum(output.name.startswith("present.") for output in decoder.get_outputs()) // 4
+
+    @classmethod
+    def from_directory(cls, directory: str, num_threads: int | None = None) -> "OnnxTrOCR":
+        """Load an exported model
+
+        Arguments:
+            directory: A directory with the three ONNX graphs, created by
+                `export()` or by Optimum.
+            num_threads: Number of intra-op threads of each session.
+                Defaults to ONNX Runtime's default (all physical cores).
+        """
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        sessions = [
+            onnxruntime.InferenceSession(
+                os.path.join(directory, filename), options, providers=["CPUExecutionProvider"]
+            )
+            for filename in (ENCODER_FILE, DECODER_FILE, DECODER_WITH_PAST_FILE)
+        ]
+        logger.info("Loaded ONNX TrOCR model from %s", directory)
+        return cls(*sessions)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """True if `directory` holds an exported model"""
+        return all(
+            os.path.isfile(os.path.join(directory, filename))
+            for filename in (ENCODER_FILE, DECODER_FILE, DECODER_WITH_PAST_FILE)
+        )
+
+    @staticmethod
+    def export(model: VisionEncoderDecoderModel, directory: str, opset: int = 17) -> None:
+        """Export a TrOCR model to ONNX
+
+        The model should use eager attention (`attn_implementation="eager"`),
+        since the other implementations don't return attention weights.
+
+        Arguments:
+            model: The model to export.
+            directory: Output directory. It is created if it doesn't exist.
+            opset: ONNX opset version.
+        """
+        os.makedirs(directory, exist_ok=True)
+        model = model.eval().to("cpu")
+        n_layers = model.decoder.config.decoder_layers
+        image_size = model.config.encoder.image_size
+        pixel_values = torch.zeros(2, model.config.encoder.num_channels, image_size, image_size)
+        input_ids = torch.full((2, 1), model.config.decoder_start_token_id or 0, dtype=torch.long)
+
+        encoder = _EncoderGraph(model)
+        decoder = _DecoderGraph(model)
+        past_names = [f"past_key_values.{i}.{attention}.{kv}" for i, attention, kv in _cache_entries(n_layers)]
+        present_names = [f"present.{i}.{attention}.{kv}" for i, attention, kv in _cache_entries(n_layers)]
+        attention_names = [f"cross_attentions.{i}" for i in range(n_layers)]
+
+        with torch.no_grad():
+            encoder_hidden_states = encoder(pixel_values)
+            logits, *outputs = decoder(input_ids, encoder_hidden_states)
+            past = outputs[: 4 * n_layers]
+
+            _export(
+                encoder,
+                (pixel_values,),
+                os.path.join(directory, ENCODER_FILE),
+                ["pixel_values"],
+                ["last_hidden_state"],
+                {"pixel_values": {0: "batch_size"}, "last_hidden_state": {0: "batch_size"}},
+                opset,
+            )
+
+            dynamic_axes = {"input_ids": {0: "batch_size"}, "encoder_hidden_states": {0: "batch_size"}}
+            dynamic_axes |= {"logits": {0: "batch_size"}}
+            dynamic_axes |= {name: {0: "batch_size"} for name in attention_names}
+            dynamic_axes |= {name: _cache_axes(name, "present_length") for name in present_names}
+            _export(
+                decoder,
+                (input_ids, encoder_hidden_states),
+                os.path.join(directory, DECODER_FILE),
+                ["input_ids", "encoder_hidden_states"],
+                ["logits", *present_names, *attention_names],
+                dynamic_axes,
+                opset,
+            )
+
+            # The step with past only outputs the self-attention keys and values,
+            # the cross-attention keys and values stay the same.
+            self_present_names = [name for name in present_names if ".decoder." in name]
+            dynamic_axes = {"input_ids": {0: "batch_size"}, "encoder_hidden_states": {0: "batch_size"}}
+            dynamic_axes |= {"logits": {0: "batch_size"}}
+            dynamic_axes |= {name: _cache_axes(name, "past_length") for name in past_names}
+            dynamic_axes |= {name: _cache_axes(name, "present_length") for name in self_present_names}
+            dynamic_axes |= {name: {0: "batch_size"} for name in attention_names}
+            _export(
+                _DecoderWithPastGraph(model),
+                (input_ids, encoder_hidden_states, *past),
+                os.path.join(directory, DECODER_WITH_PAST_FILE),
+                ["input_ids", "encoder_hidden_states", *past_names],
+                ["logits", *self_present_names, *attention_names],
+                dynamic_axes,
+                opset,
+            )
+        logger.info("Exported TrOCR model to ONNX in %s", directory)
+
+    @property
+    def has_attentions(self) -> bool:
+        """True if the decoder graphs output cross-attention weights"""
+        return any(output.name == "cross_attentions.0" for output in self.decoder.get_outputs())
+
+    def generate(
+        self,
+        pixel_values: np.ndarray,
+        decoder_start_token_id: int,
+        eos_token_id: int | Sequence[int],
+        pad_token_id: int,
+        max_new_tokens: int = 128,
+        num_beams: int = 1,
+        length_penalty: float = 1.0,
+        early_stopping: bool | str = False,
+        output_attentions: bool = False,
+    ) -> OnnxGenerationOutput:
+        """Generate text from preprocessed images
+
+        Arguments:
+            pixel_values: The processor's output, of shape (batch_size,
+                channels, height, width).
+            decoder_start_token_id: First token of each sequence.
+            eos_token_id: End-of-sequence token id(s).
+            pad_token_id: Token used to pad finished sequences.
+            max_new_tokens: Maximum number of generated tokens.
+            num_beams: Number of beams. 1 means greedy decoding. With
+                beam search, all beams of each input are returned, best
+                first.
+            length_penalty: Exponent of the length normalization of the
+                beam scores.
+            early_stopping: When beam search stops, as in transformers:
+                True stops as soon as `num_beams` hypotheses are
+                finished, False when no running beam is likely to beat
+                them, and "never" when no running beam can beat them.
+            output_attentions: Whether to return the cross-attention
+                weights (greedy decoding only).
+        """
+        if output_attentions and not self.has_attentions:
+            raise ValueError("The ONNX model was exported without cross-attention outputs.")
+        if output_attentions and num_beams > 1:
+            raise ValueError("Cross-attention weights are only available with greedy decoding.")
+
+        eos = np.atleast_1d(np.asarray(eos_token_id, dtype=np.int64))
+        pixel_values = np.asarray(pixel_values, dtype=np.float32)
+        encoder_hidden_states = _run(self.encoder, {"pixel_values": pixel_values})["last_hidden_state"]
+        if num_beams > 1:
+            return self._beam_search(
+                encoder_hidden_states,
+                decoder_start_token_id,
+                eos,
+                pad_token_id,
+                max_new_tokens,
+                num_beams,
+                length_penalty,
+                early_stopping,
+            )
+        return self._greedy_search(
+            encoder_hidden_states, decoder_start_token_id, eos, pad_token_id, max_new_tokens, output_attentions
+        )
+
+    def _step(
+        self, input_ids: np.ndarray, encoder_hidden_states: np.ndarray, past: dict[str, Any] | None
+    ) -> tuple[np.ndarray, dict[str, Any], list[np.ndarray]]:
+        """Run one decoding step
+
+        Returns:
+            A tuple (log_probs, past, cross_attentions) with the log
+            probabilities of the next token, the keys and values of all
+            steps so far (as OrtValues), and the cross-attention weights
+            of the step.
+        """
+        if past is None:
+            outputs = _run(self.decoder, {"input_ids": input_ids, "encoder_hidden_states": encoder_hidden_states})
+            past = {}
+        else:
+            feeds = {"input_ids": input_ids, "encoder_hidden_states": encoder_hidden_states}
+            feeds |= {name.replace("present.", "past_key_values."): value for name, value in past.items()}
+            outputs = _run(self.decoder_with_past, feeds)
+
+        for name, value in outputs.items():
+            if name.startswith("present."):
+                past[name] = value
+        attentions = [
+            outputs[f"cross_attentions.{i}"] for i in range(self.n_layers) if f"cross_attentions.{i}" in outputs
+        ]
+        logits = outputs["logits"]
+        if logits.ndim == 3:
+            # Optimum's graphs output the logits of all input positions
+            logits = logits[:, -1]
+        return _log_softmax(logits), past, attentions
+
+    def _greedy_search(
+        self,
+        encoder_hidden_states: np.ndarray,
+        decoder_start_token_id: int,
+        eos: np.ndarray,
+        pad_token_id: int,
+        max_new_tokens: int,
+        output_attentions: bool,
+    ) -> OnnxGenerationOutput:
+        batch_size = len(encoder_hidden_states)
+        sequences = np.full((batch_size, 1), decoder_start_token_id, dtype=np.int64)
+        logprobs = np.zeros(batch_size)
+        lengths = np.zeros(batch_size, dtype=np.int64)
+        finished = np.zeros(batch_size, dtype=bool)
+        cross_attentions = []
+        past = None
+
+        for _ in range(max_new_tokens):
+            log_probs, past, attentions = self._step(sequences[:, -1:], encoder_hidden_states, past)
+            tokens = log_probs.argmax(axis=1)
+            tokens[finished] = pad_token_id
+            logprobs[~finished] += log_probs[~finished, tokens[~finished]]
+            lengths[~finished] += 1
+            sequences = np.concatenate([sequences, tokens[:, None]], axis=1)
+            if output_attentions:
+                cross_attentions.append(tuple(torch.from_numpy(a[:, :, None, :]) for a in _squeeze_query(attentions)))
+            finished |= np.isin(tokens, eos)
+            if finished.all():
+                break
+
+        scores = np.exp(logprobs / np.maximum(lengths, 1))
+        return OnnxGenerationOutput(
+            torch.from_numpy(sequences),
+            scores.tolist(),
+            tuple(cross_attentions) if output_attentions else None,
+        )
+
+    def _beam_search(
+        self,
+        encoder_hidden_states: np.ndarray,
+        decoder_start_token_id: int,
+        eos: np.ndarray,
+        pad_token_id: int,
+        max_new_tokens: int,
+        num_beams: int,
+        length_penalty: float,
+        early_stopping: bool | str,
+    ) -> OnnxGenerationOutput:
+        batch_size = len(encoder_hidden_states)
+        encoder_hidden_states = np.repeat(encoder_hidden_states, num_beams, axis=0)
+        sequences = np.full((batch_size * num_beams, 1), decoder_start_token_id, dtype=np.int64)
+
+        # Only the first beam of each input is live in the first step, the
+        # others are identical copies of it.
+        beam_scores = np.zeros((batch_size, num_beams))
+        beam_scores[:, 1:] = -np.inf
+        hypotheses = [
+            _Hypotheses(num_beams, length_penalty, early_stopping, max_new_tokens) for _ in range(batch_size)
+        ]
+        past = None
+
+        for step in range(1, max_new_tokens + 1):
+            log_probs, past, _ = self._step(sequences[:, -1:], encoder_hidden_states, past)
+            vocab_size = log_probs.shape[1]
+            candidates = (beam_scores.reshape(-1, 1) + log_probs).reshape(batch_size, -1)
+
+            # As in transformers, 2 * num_beams candidates guarantee num_beams
+            # candidates that don't end the sequence.
+            top = np.argsort(-candidates, axis=1, kind="stable")[:, : 2 * num_beams]
+            next_beams = np.zeros((batch_size, num_beams), dtype=np.int64)
+            next_tokens = np.full((batch_size, num_beams), pad_token_id, dtype=np.int64)
+            next_scores = np.full((batch_size, num_beams), -np.inf)
+            for i in range(batch_size):
+                if hypotheses[i].done:
+                    continue
+                n = 0
+                for rank, candidate in enumerate(top[i]):
+                    beam, token = divmod(int(candidate), vocab_size)
+                    score = candidates[i, candidate]
+                    if token in eos:
+                        if rank < num_beams:
+                            row = sequences[i * num_beams + beam]
+                            hypotheses[i].add(np.append(row, token), score, step)
+                        continue
+                    next_beams[i, n], next_tokens[i, n], next_scores[i, n] = beam, token, score
+                    n += 1
+                    if n == num_beams:
+                        break
+                hypotheses[i].update_done(next_scores[i].max(), step)
+
+            if all(h.done for h in hypotheses):
+                break
+            rows = (np.arange(batch_size)[:, None] * num_beams + next_beams).reshape(-1)
+            sequences = np.concatenate([sequences[rows], next_tokens.reshape(-1, 1)], axis=1)
+            if not np.array_equal(rows, np.arange(len(rows))):
+                past = {name: value if ".encoder." in name else _gather(value, rows) for name, value in past.items()}
+            beam_scores = next_scores
+        else:
+            # Unfinished beams at the maximum length are hypotheses too
+            for i in range(batch_size):
+                for beam in range(num_beams):
+                    hypotheses[i].add(sequences[i * num_beams + beam], beam_scores[i, beam], max_new_tokens)
+
+        length = max((len(tokens) for h in hypotheses for _, tokens in h.hypotheses), default=1)
+        sequences = np.full((batch_size * num_beams, length), pad_token_id, dtype=np.int64)
+        sequences[:, 0] = decoder_start_token_id
+        scores = np.zeros(batch_size * num_beams)
+        for i, h in enumerate(hypotheses):
+            for j, (score, tokens) in enumerate(h.hypotheses):
+                sequences[i * num_beams + j, : len(tokens)] = tokens
+                scores[i * num_beams + j] = np.exp(score)
+        return OnnxGenerationOutput(torch.from_numpy(sequences), scores.tolist())
+
+
+class _Hypotheses:
+    """The finished beams of one input, see transformers' `BeamHypotheses`"""
+
+    def __init__(self, num_beams: int, length_penalty: float, early_stopping: bool | str, max_length: int):
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+        self.early_stopping = early_stopping
+        self.max_length = max_length
+        self.hypotheses: list[tuple[float, np.ndarray]] = []
+        self.done = False
+
+    def add(self, tokens: np.ndarray, logprob: float, length: int) -> None:
+        if not np.isfinite(logprob):
+            return
+        self.hypotheses.append((logprob / length**self.length_penalty, tokens))
+        self.hypotheses.sort(key=lambda hypothesis: -hypothesis[0])
+        del self.hypotheses[self.num_beams :]
+
+    def update_done(self, best_running_logprob: float, length: int) -> None:
+        """Check if no running beam can beat the finished ones"""
+        if len(self.hypotheses) < self.num_beams:
+            return
+        if self.early_stopping is True:
+            self.done = True
+            return
+        if self.early_stopping == "never" and self.length_penalty > 0:
+            # The running beams can still grow to the maximum length
+            length = self.max_length
+        worst = self.hypotheses[-1][0]
+        self.done = best_running_logprob / length**self.length_penalty <= worst
+
+
+class _EncoderGraph(torch.nn.Module):
+    """The encoder part of a VisionEncoderDecoderModel, including the projection to the decoder's size"""
+
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.encoder = model.encoder
+        self.projection = getattr(model, "enc_to_dec_proj", None)
+
+    def forward(self, pixel_values):
+        hidden_states = self.encoder(pixel_values=pixel_values).last_hidden_state
+        if self.projection is not None:
+            hidden_states = self.projection(hidden_states)
+        return hidden_states
+
+
+class _DecoderGraph(torch.nn.Module):
+    """First decoding step: logits, keys and values, and cross-attention weights"""
+
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.decoder = model.decoder
+
+    def forward(self, input_ids, encoder_hidden_states):
+        outputs = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            use_cache=True,
+            output_attentions=True,
+            return_dict=True,
+        )
+        return outputs.logits[:, -1], *_flatten_cache(outputs.past_key_values), *_last_query(outputs.cross_attentions)
+
+
+class _DecoderWithPastGraph(torch.nn.Module):
+    """Following decoding steps: takes the keys and values of the previous steps as input"""
+
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.decoder = model.decoder
+
+    def forward(self, input_ids, encoder_hidden_states, *past):
+        # The encoder output is only used to enable cross-attention, the
+        # cached cross-attention keys and values are not recomputed.
+        layers = [tuple(past[i : i + 4]) for i in range(0, len(past), 4)]
+        outputs = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            past_key_values=EncoderDecoderCache(layers),
+            use_cache=True,
+            output_attentions=True,
+            return_dict=True,
+        )
+        present = _flatten_cache(outputs.past_key_values)
+        self_present = [tensor for i, tensor in enumerate(present) if i % 4 < 2]
+        return outputs.logits[:, -1], *self_present, *_last_query(outputs.cross_attentions)
+
+
+def _cache_entries(n_layers: int) -> list[tuple[int, str, str]]:
+    """The (layer, attention, key/value) entries of the cache, in graph input/output order"""
+    return [
+        (i, attention, kv) for i in range(n_layers) for attention in ("decoder", "encoder") for kv in ("key", "value")
+    ]
+
+
+def _cache_axes(name: str, length: str) -> dict[int, str]:
+    """Dynamic axes of a key or value tensor of shape (batch, heads, length, head_size)"""
+    if ".encoder." in name:
+        return {0: "batch_size", 2: "encoder_sequence_length"}
+    return {0: "batch_size", 2: length}
+
+
+def _flatten_cache(cache: EncoderDecoderCache) -> list[torch.Tensor]:
+    """Flatten the cache to [self key, self value, cross key, cross value] per layer"""
+    tensors = []
+    for layer in cache:
+        half = len(layer) // 2
+        tensors.extend([layer[0], layer[1], layer[half], layer[half + 1]])
+    return tensors
+
+
+def _last_query(attentions: Sequence[torch.Tensor]) -> list[torch.Tensor]:
+    """Keep the attention weights of the last query position, (batch, heads, encoder_length)"""
+    return [attention[:, :, -1] for attention in attentions]
+
+
+def _squeeze_query(attentions: list[np.ndarray]) -> list[np.ndarray]:
+    return [attention[:, :, -1] if attention.ndim == 4 else attention for attention in attentions]
+
+
+def _export(module, args, path, input_names, output_names, dynamic_axes, opset) -> None:
+    torch.onnx.export(
+        module,
+        args,
+        path,
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        dynamo=False,
+    )
+
+
+def _run(session, feeds: dict[str, Any]) -> dict[str, Any]:
+    """Run `session` with IO binding
+
+    Inputs that the graph doesn't take are ignored. The keys and values
+    (`present.*`) are returned as OrtValues, which can be bound as
+    inputs of the next step as they are, and all other outputs as NumPy
+    arrays.
+    """
+    binding = session.io_binding()
+    for node in session.get_inputs():
+        value = feeds[node.name]
+        if isinstance(value, np.ndarray):
+            binding.bind_cpu_input(node.name, np.ascontiguousarray(value))
+        else:
+            binding.bind_ortvalue_input(node.name, value)
+    names = [node.name for node in session.get_outputs()]
+    for name in names:
+        binding.bind_output(name, "cpu")
+    session.run_with_iobinding(binding)
+    return {
+        name: value if name.startswith("present.") else value.numpy()
+        for name, value in zip(names, binding.get_outputs())
+    }
+
+
+_ORT_DTYPES = {"tensor(float)": np.float32, "tensor(float16)": np.float16}
+
+
+def _gather(value, rows: np.ndarray) -> np.ndarray:
+    """Select `rows` of a CPU OrtValue
+
+    The OrtValue's buffer is viewed in place, so that only the selected
+    rows are copied.
+    """
+    dtype = np.dtype(_ORT_DTYPES[value.data_type()])
+    shape = tuple(value.shape())
+    buffer = (ctypes.c_byte * (int(np.prod(shape)) * dtype.itemsize)).from_address(value.data_ptr())
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)[rows]
+
+
+def _log_softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits.astype(np.float64)
+    logits -= logits.max(axis=1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
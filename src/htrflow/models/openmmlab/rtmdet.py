@@ -4,13 +4,14 @@ import torch
 import torch.nn.functional as F
 from mmdet.apis import DetInferencer
 from mmdet.models.layers.matrix_nms import mask_matrix_nms
-from mmdet.structures import DetDataSample
 from mmengine.structures import InstanceData
 
 from htrflow.models.base_model import BaseModel
 from htrflow.models.download import commit_hash_from_path, load_mmlabs
 from htrflow.models.openmmlab.utils import SuppressOutput
+from htrflow.postprocess.torch_mask_nms import batched_multiclass_mask_nms
 from htrflow.results import Result
+from htrflow.utils import profiling
 from htrflow.utils.imgproc import NumpyImage, resize
 
 
@@ -85,6 +86,7 @@ class RTMDet(BaseModel):
         nms_downscale: float = 1.0,
         nms_threshold: float = 0.4,
         nms_sigma: float = 2.0,
+        containment_threshold: float | None = None,
         **kwargs,
     ) -> list[Result]:
         """
@@ -100,6 +102,11 @@ class RTMDet(BaseModel):
                 accuracy.
             nms_threshold: Score threshold for segments to keep after NMS.
             nms_sigma: NMS parameter that affects the score calculation.
+            containment_threshold: If given, masks that are contained in a
+                larger mask of the same class by more than this fraction of
+                their area are removed after NMS. This containment NMS is
+                applied to the mask tensors of the entire batch at once,
+                see `torch_mask_nms.batched_multiclass_mask_nms`.
             **kwargs: Additional arguments that are passed to DetInferencer.__call__.
         """
         batch_size = max(1, len(images))
@@ -110,21 +117,36 @@ class RTMDet(BaseModel):
             return_datasample=True,
             **kwargs,
         )
-        results = []
-        for image, output in zip(images, outputs["predictions"]):
-            results.append(self._create_segmentation_result(image, output, nms_downscale, nms_threshold, nms_sigma))
+
+        with profiling.phase("postprocess"):
+            samples = [
+                self._matrix_nms(output.pred_instances, nms_downscale, nms_threshold, nms_sigma)
+                for output in outputs["predictions"]
+            ]
+
+            if containment_threshold is not None:
+                remove = batched_multiclass_mask_nms(
+                    [sample.masks for sample in samples],
+                    [sample.labels for sample in samples],
+                    containment_threshold,
+                    nms_downscale,
+                )
+                for i, indices in enumerate(remove):
+                    keep = torch.ones(len(samples[i]), dtype=torch.bool)
+                    keep[indices] = False
+                    samples[i] = samples[i][keep.to(samples[i].masks.device)]
+
+            results = [self._create_segmentation_result(image, sample) for image, sample in zip(images, samples)]
         return results
 
-    def _create_segmentation_result(
+    def _matrix_nms(
         self,
-        image: NumpyImage,
-        output: DetDataSample,
+        sample: InstanceData,
         nms_downscale: float,
         nms_threshold: float,
         nms_sigma: float,
-    ) -> Result:
-        sample: InstanceData = output.pred_instances
-
+    ) -> InstanceData:
+        """Apply matrix NMS to `sample` and return the kept instances with updated scores"""
         # Cast masks to uint8 (needed for F.interpolate and Result obj)
         masks = sample.masks.to(torch.uint8)
 
@@ -138,20 +160,26 @@ class RTMDet(BaseModel):
             filter_thr=nms_threshold,
         )
 
+        kept = InstanceData()
+        kept.masks = masks[keep_inds]
+        kept.bboxes = sample.bboxes[keep_inds]
+        kept.scores = scores
+        kept.labels = labels
+        logger.info("Found %d segments, kept %d after NMS", len(sample.scores), len(keep_inds))
+        return kept
+
+    def _create_segmentation_result(self, image: NumpyImage, sample: InstanceData) -> Result:
         # RTMDet sometimes return masks of slightly different shape (+- a few pixels)
         # than the input image. To avoid alignment problems later on, all masks are
         # resized to the original image shape.
         orig_shape = image.shape[:2]
-        masks = [resize(mask, orig_shape) for mask in masks[keep_inds].cpu().numpy()]
+        masks = [resize(mask, orig_shape) for mask in sample.masks.cpu().numpy()]
 
-        result = Result.segmentation_result(
+        return Result.segmentation_result(
             orig_shape,
-            bboxes=sample.bboxes[keep_inds].int().tolist(),
+            bboxes=sample.bboxes.int().tolist(),
             masks=masks,
-            scores=scores.tolist(),
-            labels=labels.tolist(),
+            scores=sample.scores.tolist(),
+            labels=sample.labels.tolist(),
             metadata=self.metadata,
         )
-
-        logger.info("Found %d segments, kept %d after NMS", len(sample.scores), len(result.segments))
-        return result
@@ -1,18 +1,15 @@
 import logging
-import multiprocessing
-import re
-import sys
-from contextlib import redirect_stdout
 from pathlib import Path
-from tempfile import NamedTemporaryFile, mkdtemp
-from uuid import uuid4
 
 import cv2
 import numpy as np
 import pydantic
+import torch
 from huggingface_hub import model_info, snapshot_download
-from laia.common.arguments import CommonArgs, DataArgs, DecodeArgs, TrainerArgs
-from laia.scripts.htr.decode_ctc import run as decode
+from laia.common.loader import ModelLoader
+from laia.data.padding_collater import PaddedTensor
+from laia.decoders import CTCGreedyDecoder, CTCLanguageDecoder
+from laia.utils import SymbolsTable
 
 from htrflow.models.base_model import BaseModel
 from htrflow.results import Result
@@ -30,6 +27,11 @@ class PyLaia(BaseModel):
     information, see:
     https://atr.pages.teklia.com/pylaia/usage/prediction/#decode-arguments
 
+    The model and the (optional) language model decoder are loaded
+    once, when the wrapper is initialized. The images are decoded in
+    memory, in batches, without going through PyLaia's command line
+    interface.
+
     Example usage with the `TextRecognition` step:
     ```yaml
     - step: TextRecognition
@@ -45,10 +47,9 @@ class PyLaia(BaseModel):
     ```
     """
 
-    IMAGE_ID_PATTERN = r"(?P<image_id>[-a-z0-9]{36})"
-    CONFIDENCE_PATTERN = r"(?P<confidence>[0-9.]+)"
-    TEXT_PATTERN = r"\s*(?P<text>.*)\s*"
-    LINE_PREDICTION = re.compile(rf"{IMAGE_ID_PATTERN} {CONFIDENCE_PATTERN} {TEXT_PATTERN}")
+    BLANK_TOKEN = "<ctc>"
+    SPACE_TOKEN = "<space>"
+    UNK_TOKEN = "<unk>"
 
     def __init__(
         self,
@@ -73,12 +74,31 @@ class PyLaia(BaseModel):
         super().__init__(**kwargs)
 
         model_info_dict: PyLaiaModelInfo = get_pylaia_model(model, revision=revision, use_binary_lm=use_binary_lm)
-        self.model = model_info_dict
         self.model_dir = model_info_dict.model_dir
         model_version = model_info_dict.model_version
         self.use_language_model = model_info_dict.use_language_model
         self.language_model_params = model_info_dict.language_model_params
 
+        loader = ModelLoader(str(self.model_dir), device="cpu")
+        checkpoint = loader.prepare_checkpoint("weights.ckpt", str(self.model_dir), None)
+        self.model = loader.load_by(checkpoint).to(self.device).eval()
+        self.min_width = _min_valid_width(self.model)
+        self.symbols = SymbolsTable(str(self.model_dir / "syms.txt"))
+
+        if self.use_language_model:
+            lm_params = self.language_model_params
+            self.decoder = CTCLanguageDecoder(
+                language_model_path=lm_params.language_model_path,
+                lexicon_path=lm_params.lexicon_path,
+                tokens_path=lm_params.tokens_path,
+                language_model_weight=lm_params.language_model_weight,
+                blank_token=self.BLANK_TOKEN,
+                unk_token=self.UNK_TOKEN,
+                sil_token=self.SPACE_TOKEN,
+            )
+        else:
+            self.decoder = CTCGreedyDecoder()
+
         self.metadata.update(
             {
                 "model": model,
@@ -87,113 +107,91 @@ class PyLaia(BaseModel):
             }
         )
 
-        logger.info(f"Initialized PyLaiaModel from '{model}' on device '{self.device}'.")
+        logger.info(
+            "Loaded PyLaia model '%s' from %s on device '%s' (language model: %s)",
+            model,
+            self.model_dir,
+            self.device,
+            self.use_language_model,
+        )
 
-    def _predict(self, images: list[np.ndarray], **decode_kwargs) -> list[Result]:
+    def _predict(
+        self,
+        images: list[np.ndarray],
+        temperature: float = 1.0,
+        reading_order: str = "LTR",
+        resize_input_height: int = 128,
+        num_workers: int | None = None,
+        **decode_kwargs,
+    ) -> list[Result]:
         """
         PyLaia-specific prediction method: runs text recognition.
 
         Args:
             images (list[np.ndarray]):
                 List of images as NumPy arrays (e.g., shape [H, W, C]).
-            batch_size (int, optional):
-                Batch size for decoding. Defaults to 1.
+            temperature (float, optional):
+                Temperature applied to the model's output before decoding.
+                Defaults to 1.0.
             reading_order (str, optional):
-                Reading order for text recognition. Defaults to "LTR".
+                Reading order for text recognition, "LTR" or "RTL". Defaults
+                to "LTR".
             resize_input_height (int, optional):
                 If set, resizes input images to the specified height,
                 while maintaining aspect ratio. If `-1`, resizing is skipped. Defaults to 128.
             num_workers (int, optional):
-                Number of workers for parallel processing. Defaults to `multiprocessing.cpu_count()`.
+                Ignored. Accepted for compatibility with configurations
+                written for PyLaia's command line decoding, which loaded
+                the images from disk with this many workers.
+            decode_kwargs:
+                Other decoding arguments are not supported. They are
+                ignored with a warning.
 
         Returns:
             list[Result]:
                 A list of Result objects containing recognized text and
                 optionally confidence scores.
         """
-
-        temperature = decode_kwargs.get("temperature", 1.0)
-        batch_size = decode_kwargs.get("batch_size", 1)
-        reading_order = decode_kwargs.get("reading_order", "LTR")
-        resize_input_height = decode_kwargs.get("resize_input_height", 128)
-        num_workers = decode_kwargs.get("num_workers", multiprocessing.cpu_count())
-
-        common_args = CommonArgs(
-            checkpoint="weights.ckpt",
-            train_path=str(self.model_dir),
-            experiment_dirname="",
-        )
-
-        data_args = DataArgs(
-            batch_size=batch_size, color_mode="L", reading_order=reading_order, num_workers=num_workers
-        )
-
-        gpus_flag = 1 if self.device.type == "cuda" else 0
-        trainer_args = TrainerArgs(gpus=gpus_flag)
-
-        decode_args = DecodeArgs(
-            include_img_ids=True,
-            join_string="",
-            convert_spaces=True,
-            print_line_confidence_scores=True,
-            print_word_confidence_scores=False,
-            temperature=temperature,
-            use_language_model=self.use_language_model,
-            **self.language_model_params.model_dump(),
-        )
-
-        # Note: PyLaia's 'decode' function expects disk-based file paths rather than in-memory data.
-        # Because it is tightly integrated as a CLI tool, we must create temporary image files
-        # and pass their paths to the PyLaia decoder. Otherwise, PyLaia cannot process these images.
-        tmp_images_dir = Path(mkdtemp())
-        logger.debug(f"Created temp folder for images: {tmp_images_dir}")
-
-        image_ids = [str(uuid4()) for _ in images]
-
-        for img_id, np_img in zip(image_ids, images):
-            rezied_img = _ensure_fixed_height(np_img, resize_input_height)
-            cv2.imwrite(str(tmp_images_dir / f"{img_id}.jpg"), rezied_img)
-
-        with NamedTemporaryFile() as pred_stdout, NamedTemporaryFile() as img_list:
-            Path(img_list.name).write_text("\n".join(image_ids))
-
-            with redirect_stdout(open(pred_stdout.name, mode="w")):
-                decode(
-                    syms=str(self.model_dir / "syms.txt"),
-                    img_list=img_list.name,
-                    img_dirs=[str(tmp_images_dir)],
-                    common=common_args,
-                    data=data_args,
-                    trainer=trainer_args,
-                    decode=decode_args,
-                    num_workers=num_workers,
-                )
-                sys.stdout.flush()
-
-            decode_output_lines = Path(pred_stdout.name).read_text().strip().splitlines()
-
-        results = []
-        metadata = self.metadata | {"decode_kwargs": decode_kwargs}
-
-        for line in decode_output_lines:
-            match = self.LINE_PREDICTION.match(line)
-            if not match:
-                logger.warning("Could not parse line: %s", line)
-                continue
-            _, score_str, text = match.groups()  # _ = image_id
-
-            try:
-                score_val = float(score_str)
-            except ValueError:
-                score_val = 0.0
-
-            result = Result.text_recognition_result(metadata, [text], [score_val])
-            results.append(result)
-
-        logger.debug(f"PyLaia recognized {len(results)} lines of text.")
-
+        if decode_kwargs:
+            logger.warning("PyLaia ignores the unsupported decoding settings %s.", ", ".join(sorted(decode_kwargs)))
+        if not images:
+            return []
+
+        images = [_ensure_fixed_height(image, resize_input_height) for image in images]
+        # PyLaia packs the output sequences of a batch, which requires the
+        # images to be sorted by decreasing width, like its data loader does
+        order = sorted(range(len(images)), key=lambda i: -images[i].shape[1])
+        batch = _to_padded_tensor([images[i] for i in order], self.min_width)
+        self.decoder.temperature = temperature
+        with torch.inference_mode():
+            output = self.model(PaddedTensor.build(batch.data.to(self.device), batch.sizes))
+            decoded = self.decoder(output)
+
+        # Only the settings that were applied are recorded
+        metadata = self.metadata | {
+            "decode_kwargs": {
+                "temperature": temperature,
+                "reading_order": reading_order,
+                "resize_input_height": resize_input_height,
+            }
+        }
+        results = [None] * len(images)
+        # "prob-htr" is the line confidence score, which both the greedy and the language model decoder output
+        for i, hyp, score in zip(order, decoded["hyp"], decoded["prob-htr"]):
+            text = self._to_text(hyp)
+            if reading_order == "RTL":
+                # PyLaia reads the image left to right, RTL models are trained on reversed transcriptions
+                text = text[::-1]
+            results[i] = Result.text_recognition_result(metadata, [text], [float(score)])
+
+        logger.debug("PyLaia recognized %d lines of text.", len(results))
         return results
 
+    def _to_text(self, hyp: list[int]) -> str:
+        """Convert a sequence of symbol indices to text"""
+        symbols = (self.symbols[int(index)] for index in hyp)
+        return "".join(" " if symbol == self.SPACE_TOKEN else symbol for symbol in symbols)
+
 
 class LanguageModelParams(pydantic.BaseModel):
     """Pydantic model for language model parameters."""
@@ -345,6 +343,43 @@ def _detect_language_model(model_dir: Path, use_binary_lm: bool) -> tuple[bool,
     return use_language_model, language_model_params
 
 
+def _to_padded_tensor(images: list[np.ndarray], min_width: int | None = None) -> "PaddedTensor":
+    """Convert images to a batch of PyLaia input tensors
+
+    The images are converted the same way as PyLaia's `ToImageTensor`
+    transform does it: to grayscale, inverted, scaled to [0, 1], and
+    padded with background to at least `min_width` pixels. They are
+    then zero-padded (that is, padded with background) to the size of
+    the largest image, like PyLaia's `PaddingCollater`.
+
+    Arguments:
+        images: The input images.
+        min_width: The model's minimum valid image width, see
+            `_min_valid_width`. Narrower images are padded to this
+            width, and their size in the batch is the padded size.
+    """
+    images = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image for image in images]
+    sizes = [(image.shape[0], max(image.shape[1], min_width or 0)) for image in images]
+    height = max(size[0] for size in sizes)
+    width = max(size[1] for size in sizes)
+    batch = np.zeros((len(images), 1, height, width), dtype=np.float32)
+    for i, image in enumerate(images):
+        batch[i, 0, : image.shape[0], : image.shape[1]] = (255 - image) / 255
+    return PaddedTensor.build(torch.from_numpy(batch), torch.tensor(sizes, dtype=torch.long))
+
+
+def _min_valid_width(model: torch.nn.Module) -> int | None:
+    """The smallest image width that `model` can process
+
+    Uses the model's `get_min_valid_image_size` method if it has one,
+    which is how PyLaia's decoding script sets the `min_valid_size` of
+    its `DataModule`.
+    """
+    if hasattr(model, "get_min_valid_image_size"):
+        return model.get_min_valid_image_size(128)
+    return None
+
+
 def _ensure_fixed_height(img: np.ndarray, target_height: int = 128) -> np.ndarray:
     """Ensures an image is always resized to a fixed height, maintaining aspect ratio.
 
@@ -6,7 +6,9 @@ from ultralytics import YOLO as UltralyticsYOLO
 
 from htrflow.models.base_model import BaseModel
 from htrflow.models.download import commit_hash_from_path, load_ultralytics
+from htrflow.postprocess.torch_mask_nms import batched_multiclass_mask_nms
 from htrflow.results import Result
+from htrflow.utils import profiling
 
 
 logger = logging.getLogger(__name__)
@@ -58,7 +60,12 @@ class YOLO(BaseModel):
         self.metadata.update({"model": model, "model_version": commit_hash_from_path(model_file)})
 
     def _predict(
-        self, images: list[np.ndarray], use_polygons: bool = True, polygon_approx_level: float = 0.005, **kwargs
+        self,
+        images: list[np.ndarray],
+        use_polygons: bool = True,
+        polygon_approx_level: float = 0.005,
+        containment_threshold: float | None = None,
+        **kwargs,
     ) -> list[Result]:
         """
         Run inference.
@@ -70,10 +77,19 @@ class YOLO(BaseModel):
                 and the approximated low-resolution polygon, as a fraction of the original polygon arc length.
                 Example: With `polygon_approx_level=0.005` and a generated polygon with arc length 100, the
                 approximated polygon will not differ more than 0.5 units from the original.
+            containment_threshold: If given, segments whose masks are contained in a larger mask of the same
+                class by more than this fraction of their area are removed. The containment NMS runs on the
+                model's mask tensors for the entire batch at once, see
+                `torch_mask_nms.batched_multiclass_mask_nms`. Requires a segmentation model.
             **kwargs: Keyword arguments forwarded to the inner YOLO model instance.
         """
         outputs = self.model(images, stream=True, verbose=False, **kwargs)
 
+        if containment_threshold is not None:
+            outputs = list(outputs)
+            with profiling.phase("postprocess"):
+                outputs = _containment_nms(outputs, containment_threshold)
+
         results = []
         for image, output in zip(images, outputs):
             polygons = bboxes = scores = class_labels = None
@@ -100,6 +116,26 @@ class YOLO(BaseModel):
         return results
 
 
+def _containment_nms(outputs: list, containment_threshold: float) -> list:
+    """Remove contained segments from a batch of ultralytics results"""
+    with_masks = [i for i, output in enumerate(outputs) if output.masks is not None and len(output.masks)]
+    if len(with_masks) < len(outputs):
+        logger.warning("`containment_threshold` was set but the model did not return masks for all images.")
+
+    remove = batched_multiclass_mask_nms(
+        [outputs[i].masks.data for i in with_masks],
+        [outputs[i].boxes.cls for i in with_masks],
+        containment_threshold,
+    )
+    for i, indices in zip(with_masks, remove):
+        if indices:
+            removed = set(indices)
+            keep = [j for j in range(len(outputs[i])) if j not in removed]
+            logger.info("Removed %d contained segments", len(indices))
+            outputs[i] = outputs[i][keep]
+    return outputs
+
+
 def _simplify_polygons(polygons, approx_level):
     result = []
 
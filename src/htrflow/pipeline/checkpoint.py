@@ -0,0 +1,147 @@
+"""
+Per-page checkpoints of pipeline runs
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from htrflow.volume.volume import Collection, PageNode, without_images
+
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """Checkpoint store keyed by page and pipeline step
+
+    After each pipeline step, the store saves one checkpoint per page.
+    A checkpoint holds the page's document tree (segments, geometries,
+    texts and other data) but no pixel data, since the images can be
+    regenerated from the page's image file. Because each page is saved
+    separately, a crash only loses the work on the pages that were in
+    progress, and an interrupted run can be resumed page by page.
+
+    The checkpoints are saved as `<directory>/<namespace>/<page>/stepN.pickle`,
+    where N is the zero-based index of the step. Once a page has passed
+    through all steps, only its last checkpoint is kept.
+    """
+
+    def __init__(self, directory: str = os.path.join(".cache", "checkpoints"), namespace: str = "default"):
+        """
+        Arguments:
+            directory: Root directory of the checkpoint store.
+            namespace: Name of the subdirectory to use. Runs of different
+                pipelines should use different namespaces, see
+                `Pipeline.fingerprint`.
+        """
+        self.directory = os.path.join(directory, namespace)
+
+    def save(self, collection: Collection, step_index: int, n_steps: int | None = None) -> None:
+        """Save checkpoints of the collection's pages
+
+        Arguments:
+            collection: The collection, as it is after step `step_index`.
+            step_index: Index of the step that was just completed.
+            n_steps: Total number of steps in the pipeline. If given, the
+                older checkpoints of pages that have completed the last
+                step are removed.
+        """
+        for page in collection:
+            directory = self._page_directory(page)
+            os.makedirs(directory, exist_ok=True)
+            with without_images(page):
+                _atomic_dump(page, os.path.join(directory, f"step{step_index}.pickle"))
+
+            if n_steps is not None and step_index == n_steps - 1:
+                for i in range(step_index):
+                    path = os.path.join(directory, f"step{i}.pickle")
+                    if os.path.exists(path):
+                        os.remove(path)
+        logger.info(
+            "Saved checkpoints of %d pages after step %d to %s", len(collection.pages), step_index + 1, self.directory
+        )
+
+    def completed_steps(self, page: PageNode) -> int:
+        """The number of steps that `page` has completed according to the store"""
+        directory = self._page_directory(page)
+        if not os.path.isdir(directory):
+            return 0
+        steps = [_step_index(filename) for filename in os.listdir(directory)]
+        steps = [step for step in steps if step is not None]
+        return max(steps) + 1 if steps else 0
+
+    def load(self, page: PageNode, step_index: int) -> PageNode:
+        """Load the checkpoint of `page` saved after step `step_index`"""
+        path = os.path.join(self._page_directory(page), f"step{step_index}.pickle")
+        with open(path, "rb") as f:
+            restored = pickle.load(f)
+        if not isinstance(restored, PageNode):
+            raise pickle.UnpicklingError(f"Unpickling {path} did not return a PageNode instance.")
+        return restored
+
+    def restore(self, collection: Collection, n_steps: int) -> int:
+        """Restore the collection's pages from their checkpoints
+
+        Pages that have completed all `n_steps` steps are removed from
+        the collection. The remaining pages are replaced by their saved
+        state after the last step that all of them have completed.
+
+        Arguments:
+            collection: The collection to restore. It is modified in place.
+            n_steps: Total number of steps in the pipeline.
+
+        Returns:
+            The index of the step to resume the collection from.
+        """
+        completed = [(page, self.completed_steps(page)) for page in collection]
+        remaining = [(page, n) for page, n in completed if n < n_steps]
+
+        if n_skipped := len(completed) - len(remaining):
+            logger.info("Skipping %d already processed pages of collection '%s'", n_skipped, collection.label)
+
+        if not remaining:
+            collection.pages = []
+            return n_steps
+
+        start = min(n for _, n in remaining)
+        if start > 0:
+            collection.pages = [self.load(page, start - 1) for page, _ in remaining]
+            logger.info(
+                "Restored %d pages of collection '%s' from checkpoints, resuming from step %d",
+                len(remaining),
+                collection.label,
+                start + 1,
+            )
+        else:
+            collection.pages = [page for page, _ in remaining]
+        return start
+
+    def _page_directory(self, page: PageNode) -> str:
+        # The image path is used as key since page labels are not
+        # necessarily unique across input directories.
+        image_path = os.path.abspath(page.get("image_path", page.label))
+        digest = hashlib.sha1(image_path.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{page.get('image_name', page.label)}-{digest}")
+
+
+def _step_index(filename: str) -> int | None:
+    """Parse the step index from a checkpoint filename"""
+    name, ext = os.path.splitext(filename)
+    if ext != ".pickle" or not name.startswith("step") or not name[4:].isdigit():
+        return None
+    return int(name[4:])
+
+
+def _atomic_dump(obj, path: str) -> None:
+    """Pickle `obj` to `path` via a temporary file, so that a crash never leaves a partial checkpoint"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -1,47 +1,276 @@
+import hashlib
+import json
 import logging
-from typing import Sequence
+import queue
+import threading
+from typing import Any, Iterable, Iterator, Sequence
 
+from htrflow.pipeline.checkpoint import CheckpointStore
 from htrflow.pipeline.steps import PipelineStep, init_step
-from htrflow.serialization import pickle_collection
+from htrflow.utils.profiling import profiler
+from htrflow.volume.volume import Collection
 
 
 logger = logging.getLogger(__name__)
 
 
 class Pipeline:
-    def __init__(self, steps: Sequence[PipelineStep]):
+    def __init__(self, steps: Sequence[PipelineStep], fingerprint: str | None = None):
         self.steps = steps
-        self.pickle_path = None
+        self.fingerprint = fingerprint or _fingerprint([str(step) for step in steps])
+        self.checkpoints = CheckpointStore(namespace=self.fingerprint)
         self.do_backup = False
+        self.resume = False
+        self.streaming = False
+        self.queue_size = 2
+        self.pool_pages = 1
         for step in self.steps:
             step.parent_pipeline = self
 
     @classmethod
     def from_config(self, config: dict[str, str]):
         """Init pipeline from config"""
-        return Pipeline([init_step(step["step"], step.get("settings", {})) for step in config["steps"]])
+        # The fingerprint must be computed before the steps are
+        # initialized, since the initialization may modify the config.
+        fingerprint = _fingerprint(config["steps"])
+        steps = [init_step(step["step"], step.get("settings", {})) for step in config["steps"]]
+        return Pipeline(steps, fingerprint)
 
     def run(self, collection, start=0):
-        """Run pipeline on collection"""
+        """Run pipeline on collection
+
+        The steps run one after the other on the entire collection, also
+        when `self.streaming` is True: splitting the collection would
+        change the result of steps that work on the whole collection,
+        such as reading order and export. Use `Pipeline.run_many()` to
+        stream many collections.
+
+        If `self.resume` is True, the collection is first restored from
+        the pipeline's checkpoints (see `CheckpointStore.restore()`).
+        Pages that already have passed through the entire pipeline are
+        then removed from the collection.
+        """
+        if self.resume:
+            start = self._restore(collection, start)
+
         for i, step in enumerate(self.steps[start:]):
-            step_name = f"{step} (step {start + i + 1} / {len(self.steps)})"
-            logger.info("Running step %s", step_name)
+            (collection,) = self._run_step(step, [collection], start + i)
+        return collection
+
+    def run_many(self, collections: Iterable[Collection], start: int = 0) -> Iterator[Collection]:
+        """Run pipeline on a stream of collections
+
+        Consecutive collections are pooled until the pool holds at least
+        `self.pool_pages` pages, and each step then runs once on the
+        entire pool (see `PipelineStep.run_many()`). This way, inference
+        steps can fill their model's batches with segments from many
+        small collections. The collections are still updated and
+        exported one by one, so the pool size only decides how many
+        pages are processed at once, not how the output is written.
+        A larger pool has two costs: a collection is only yielded once
+        its entire pool has passed through the pipeline, so a failing
+        step loses the output of the whole pool, and the pages of a
+        pool (or, when streaming, of one pool per queue) are held in
+        memory at the same time.
+
+        If `self.streaming` is True, the pools are passed through the
+        pipeline with `Pipeline.stream()`.
+
+        Arguments:
+            collections: The input collections. May be a lazy iterable,
+                such as the generator returned by `steps.auto_import()`.
+            start: Index of the first step to run. Defaults to 0.
+
+        Yields:
+            The processed collections, in the same order as the input.
+            Collections without pages are skipped.
+        """
+        if self.streaming:
+            yield from self.stream(collections, start)
+            return
+
+        for pool, starts in self._pools(collections, start):
+            for i, step in enumerate(self.steps[start:]):
+                self._run_pool_step(step, pool, starts, start + i)
+            yield from pool
+
+    def stream(self, collections: Iterable[Collection], start: int = 0) -> Iterator[Collection]:
+        """Run pipeline on a stream of collections
+
+        Each pipeline step runs in a separate worker thread, and the
+        collections are passed from one step to the next through bounded
+        queues of size `self.queue_size`. This way, the steps run
+        concurrently on different collections: while one collection is
+        being segmented, the previous one can be passed through text
+        recognition, and so on.
+
+        The input iterable is consumed in a separate thread as well, which
+        means that image loading also overlaps with inference.
+
+        The collections are pooled as in `Pipeline.run_many()`, and the
+        pools are passed between the steps.
+
+        Arguments:
+            collections: The input collections. May be a lazy iterable,
+                such as the generator returned by `steps.auto_import()`.
+            start: Index of the first step to run. Defaults to 0.
+
+        Yields:
+            The processed collections, in the same order as the input.
+
+        Raises:
+            Any exception raised by a pipeline step (or by the input
+            iterable) is re-raised here, after all workers have stopped.
+        """
+        steps = self.steps[start:]
+        queues = [queue.Queue(maxsize=max(self.queue_size, 1)) for _ in range(len(steps) + 1)]
+        stop = threading.Event()
+
+        # The collections are passed between the workers as pools of
+        # (collections, starts), since resumed collections may start at
+        # different steps.
+        def feed():
             try:
-                collection = step.run(collection)
-            except Exception:
-                if self.pickle_path:
-                    logger.exception(
-                        "Pipeline failed on step %s. A backup collection is saved at %s",
-                        step_name,
-                        self.pickle_path,
-                    )
-                else:
-                    logger.exception("Pipeline failed on step %s", step_name)
-                raise
+                for pool in self._pools(collections, start):
+                    if not _put(queues[0], pool, stop):
+                        return
+            except BaseException as e:
+                _put(queues[0], _Failure(e), stop)
+                return
+            _put(queues[0], _DONE, stop)
 
-            if self.do_backup:
-                self.pickle_path = pickle_collection(collection)
-        return collection
+        def work(step_index, step, inbox, outbox):
+            while True:
+                item = _get(inbox, stop)
+                if item is _DONE or isinstance(item, _Failure):
+                    _put(outbox, item, stop)
+                    return
+                try:
+                    self._run_pool_step(step, *item, step_index)
+                except BaseException as e:
+                    _put(outbox, _Failure(e), stop)
+                    return
+                if not _put(outbox, item, stop):
+                    return
+
+        threads = [threading.Thread(target=feed, name="htrflow-feed", daemon=True)]
+        for i, step in enumerate(steps):
+            args = (start + i, step, queues[i], queues[i + 1])
+            threads.append(threading.Thread(target=work, args=args, name=f"htrflow-{step}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while (item := _get(queues[-1], stop)) is not _DONE:
+                if isinstance(item, _Failure):
+                    raise item.exception
+                pool, _ = item
+                yield from pool
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
 
     def metadata(self):
         return [step.metadata for step in self.steps if step.metadata]
+
+    def _pools(self, collections: Iterable[Collection], start: int) -> Iterator[tuple[list[Collection], list[int]]]:
+        """Group `collections` into pools of at least `self.pool_pages` pages
+
+        Yields:
+            (collections, starts) tuples, where starts are the indices
+            of the steps to start the collections from.
+        """
+        pool, starts = [], []
+        n_pages = 0
+        for collection in collections:
+            collection_start = self._restore(collection, start) if self.resume else start
+            if not collection.pages:
+                continue
+            pool.append(collection)
+            starts.append(collection_start)
+            n_pages += len(collection.pages)
+            if n_pages >= self.pool_pages:
+                yield pool, starts
+                pool, starts = [], []
+                n_pages = 0
+        if pool:
+            yield pool, starts
+
+    def _run_pool_step(self, step: PipelineStep, pool: list[Collection], starts: list[int], step_index: int) -> None:
+        """Run a single step on the collections of `pool` that have reached it
+
+        The collections are replaced in place by the step's output.
+        """
+        indices = [i for i, collection_start in enumerate(starts) if collection_start <= step_index]
+        if not indices:
+            return
+        outputs = self._run_step(step, [pool[i] for i in indices], step_index)
+        for i, collection in zip(indices, outputs):
+            pool[i] = collection
+
+    def _run_step(self, step: PipelineStep, collections: list[Collection], step_index: int) -> list[Collection]:
+        """Run a single step on `collections` and optionally save a backup"""
+        step_name = f"{step} (step {step_index + 1} / {len(self.steps)})"
+        logger.info("Running step %s", step_name)
+        try:
+            with profiler.step(str(step), step_index, sum(len(collection.pages) for collection in collections)):
+                collections = step.run_many(collections)
+        except Exception:
+            if self.do_backup:
+                logger.exception(
+                    "Pipeline failed on step %s. Checkpoints of the completed steps are saved in %s",
+                    step_name,
+                    self.checkpoints.directory,
+                )
+            else:
+                logger.exception("Pipeline failed on step %s", step_name)
+            raise
+
+        if self.do_backup:
+            for collection in collections:
+                self.checkpoints.save(collection, step_index, len(self.steps))
+        return collections
+
+    def _restore(self, collection: Collection, start: int) -> int:
+        """Restore `collection` from checkpoints and return the step to resume from"""
+        return max(start, self.checkpoints.restore(collection, len(self.steps)))
+
+
+def _fingerprint(config: Any) -> str:
+    """A short hash identifying a pipeline configuration"""
+    serialized = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()[:12]
+
+
+class _Failure:
+    """Wrapper used to pass an exception from a worker thread to the consumer"""
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+# Sentinel marking the end of a stream
+_DONE = object()
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put `item` on `q`, returns False if `stop` was set before the item could be put"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event) -> Any:
+    """Get an item from `q`, returns _DONE if `stop` was set before an item was available"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
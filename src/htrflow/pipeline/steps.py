@@ -7,16 +7,18 @@ from typing import Any, Callable, Generator, Literal
 from pagexml.parser import parse_pagexml_file
 
 from htrflow.models.base_model import BaseModel
+from htrflow.models.cache import ResultCache
+from htrflow.models.data_parallel import DataParallelModel
 from htrflow.models.importer import all_models
 from htrflow.postprocess import metrics
 from htrflow.postprocess.reading_order import order_regions, top_down
 from htrflow.postprocess.word_segmentation import simple_word_segmentation
-from htrflow.results import Result
+from htrflow.results import TEXT_RESULT_KEY, Result
 from htrflow.serialization import get_serializer, save_collection
 from htrflow.utils.imgproc import NumpyImage, binarize, write
 from htrflow.utils.layout import estimate_printspace, is_twopage
 from htrflow.volume.node import Node
-from htrflow.volume.volume import Collection
+from htrflow.volume.volume import Collection, ImageGenerator, prefetch_images
 
 
 logger = logging.getLogger(__name__)
@@ -54,6 +56,23 @@ class PipelineStep:
             A new collection, updated with the results of the pipeline step.
         """
 
+    def run_many(self, collections: list[Collection]) -> list[Collection]:
+        """
+        Run the pipeline step on several collections.
+
+        The pipeline passes pooled collections to this method (see
+        `Pipeline.run_many()`). By default, the step runs on each
+        collection separately. Steps that benefit from processing
+        many pages at once, such as inference steps, override it.
+
+        Arguments:
+            collections: Input collections
+
+        Returns:
+            The collections, updated with the results of the pipeline step.
+        """
+        return [self.run(collection) for collection in collections]
+
     def __str__(self):
         return f"{self.__class__.__name__}"
 
@@ -74,16 +93,83 @@ class Inference(PipelineStep):
         model_settings:
           model: ...
     ```
+
+    The `devices` setting enables data-parallel inference. The step
+    then starts one worker process per listed device, each with its
+    own model replica, and distributes the segments between them (see
+    `<models.data_parallel.DataParallelModel>`). CPU workers are given
+    disjoint sets of CPU cores.
+
+    Example YAML:
+    ```yaml
+    - step: Inference
+      settings:
+        model: TrOCR
+        devices: [cuda:0, cuda:1]
+        model_settings:
+          model: ...
+    ```
+
+    With data-parallel inference, `shared_memory: true` moves the page
+    images to shared memory before inference. The workers then map the
+    segment images directly instead of receiving pickled copies, which
+    saves time and memory for large scans. The shared memory (typically
+    /dev/shm) must be large enough to hold the page images of the
+    collection.
+
+    The `cache` setting enables an on-disk cache of the model's
+    results (see `<models.cache.ResultCache>`). Segments whose pixels,
+    model and generation settings are unchanged since a previous run
+    are then not passed through the model again. The setting is either
+    `true`, a cache directory, or a mapping of `ResultCache` arguments.
+
+    Example YAML:
+    ```yaml
+    - step: Inference
+      settings:
+        model: TrOCR
+        cache:
+          directory: .cache/results
+          max_bytes: 10000000000
+        model_settings:
+          model: ...
+    ```
+
+    Segment images are views into the page images. The page images are
+    therefore kept in memory for as long as their pages are processed,
+    unless `evict_images` is set to true. The step then drops all pixel
+    data of the collection after inference, and the images are re-read
+    from disk if a later step needs them. This lowers the memory usage
+    of large batches at the cost of extra image decoding.
     """
 
-    def __init__(self, model_class, model_kwargs, generation_kwargs):
+    def __init__(
+        self,
+        model_class,
+        model_kwargs,
+        generation_kwargs,
+        devices=None,
+        cache=None,
+        evict_images: bool = False,
+        shared_memory: bool = False,
+    ):
         self.model_class = model_class
         self.model_kwargs = model_kwargs
         self.generation_kwargs = generation_kwargs
+        self.devices = devices
+        self.cache = _init_cache(cache)
+        self.evict_images = evict_images
+        self.shared_memory = shared_memory
         self.model = None
 
     def _init_model(self):
-        self.model = self.model_class(**self.model_kwargs)
+        if self.devices:
+            self.model = DataParallelModel(
+                self.model_class, self.model_kwargs, self.devices, shared_memory=self.shared_memory
+            )
+        else:
+            self.model = self.model_class(**self.model_kwargs)
+        self.model.cache = self.cache
         self.metadata = StepMetadata(str(self), self.model.metadata)
 
     @classmethod
@@ -96,15 +182,77 @@ class Inference(PipelineStep):
             raise NotImplementedError(msg)
         model = MODELS[name]
         generation_kwargs = config.pop("generation_settings", {})
+        devices = config.pop("devices", None)
+        cache = config.pop("cache", None)
+        evict_images = config.pop("evict_images", False)
+        shared_memory = config.pop("shared_memory", False)
         init_kwargs = config.pop("model_settings", {}) | config
-        return cls(model, init_kwargs, generation_kwargs)
+        return cls(model, init_kwargs, generation_kwargs, devices, cache, evict_images, shared_memory)
 
     def run(self, collection):
+        return self.run_many([collection])[0]
+
+    def run_many(self, collections):
+        """Run the model on the active segments of all `collections` at once
+
+        Each collection keeps its own active leaves (see
+        `Collection.active_leaves()`), but the segments of all
+        collections are passed to the model together, so that they fill
+        the model's batches. The results are then scattered back to
+        their collections.
+        """
+        self._prepare(collections)
+        leaves = [list(collection.active_leaves()) for collection in collections]
+        results = self._predict([leaf for part in leaves for leaf in part])
+        _scatter(collections, leaves, results, self.evict_images)
+        return collections
+
+    def _prepare(self, collections: list[Collection]) -> None:
+        """Initialize the model and prepare the collections' page images for it"""
         if self.model is None:
             self._init_model()
-        result = self.model(collection.segments(), **self.generation_kwargs)
-        collection.update(result)
-        return collection
+        for collection in collections:
+            if getattr(self.model, "arena", None) is not None:
+                collection.share_images(self.model.arena)
+            if self.generation_kwargs.get("image_scaling_factor", 1) != 1:
+                # Let the model take the downscaled page images from the pages' pyramids
+                for page in collection:
+                    page.pyramid
+
+    def _predict(self, nodes: list[Node]) -> list[Result]:
+        """Run the model on the images of `nodes`"""
+        return self.model(ImageGenerator(nodes), **self.generation_kwargs)
+
+
+def _scatter(
+    collections: list[Collection], leaves: list[list[Node]], results: list[Result], evict_images: bool
+) -> None:
+    """Update each collection with its share of `results`
+
+    Arguments:
+        collections: The collections.
+        leaves: The active leaves of each collection.
+        results: One result per leaf, in the order of `leaves`.
+        evict_images: Drop the collections' pixel data after the update.
+    """
+    offset = 0
+    for collection, part in zip(collections, leaves):
+        collection.update(results[offset : offset + len(part)])
+        offset += len(part)
+        if evict_images:
+            for page in collection:
+                page.clear_images()
+
+
+def _init_cache(config: bool | str | dict[str, Any] | None) -> ResultCache | None:
+    """Create a result cache from the `cache` setting of an inference step"""
+    if not config:
+        return None
+    if config is True:
+        return ResultCache()
+    if isinstance(config, str):
+        return ResultCache(config)
+    return ResultCache(**config)
 
 
 class ImportSegmentation(PipelineStep):
@@ -190,6 +338,111 @@ class TextRecognition(Inference):
     pass
 
 
+class CascadeRecognition(PipelineStep):
+    """
+    Run a cheap text recognition model, and an expensive one on the hard lines.
+
+    The cheap model, for example PyLaia or TrOCR with greedy decoding,
+    recognizes all segments. The segments whose top confidence score
+    is below `threshold` are then recognized again by the expensive
+    model, for example TrOCR with beam search, whose results replace
+    the cheap model's results. Segments without a text result count as
+    having score 0.
+
+    The `cheap` and `expensive` settings are configured like
+    `<pipeline.steps.TextRecognition>` steps, and accept the same
+    settings (except `evict_images`, which is a setting of this step).
+
+    Example YAML:
+    ```yaml
+    - step: CascadeRecognition
+      settings:
+        threshold: 0.9
+        cheap:
+          model: TrOCR
+          model_settings:
+            model: Riksarkivet/trocr-base-handwritten-hist-swe-2
+          generation_settings:
+            batch_size: 32
+            num_beams: 1
+        expensive:
+          model: TrOCR
+          model_settings:
+            model: Riksarkivet/trocr-base-handwritten-hist-swe-2
+          generation_settings:
+            batch_size: 8
+            num_beams: 4
+    ```
+    """
+
+    def __init__(self, cheap: Inference, expensive: Inference, threshold: float = 0.9, evict_images: bool = False):
+        """
+        Arguments:
+            cheap: Inference step of the model that recognizes all segments.
+            expensive: Inference step of the model that recognizes the
+                segments with low confidence scores.
+            threshold: Confidence score threshold. Segments whose top
+                score from the cheap model is below this value are passed
+                to the expensive model.
+            evict_images: Drop all pixel data of the collection after
+                inference, see `<pipeline.steps.Inference>`.
+        """
+        self.cheap = cheap
+        self.expensive = expensive
+        self.threshold = threshold
+        self.evict_images = evict_images
+
+    @classmethod
+    def from_config(cls, config):
+        cheap = TextRecognition.from_config(dict(config.pop("cheap")))
+        expensive = TextRecognition.from_config(dict(config.pop("expensive")))
+        return cls(cheap, expensive, **config)
+
+    def run(self, collection):
+        return self.run_many([collection])[0]
+
+    def run_many(self, collections):
+        for step in (self.cheap, self.expensive):
+            if step.model is None:
+                step._init_model()
+        self.metadata = StepMetadata(
+            str(self),
+            {
+                "threshold": self.threshold,
+                "cheap": self.cheap.metadata.settings,
+                "expensive": self.expensive.metadata.settings,
+            },
+        )
+
+        self.cheap._prepare(collections)
+        leaves = [list(collection.active_leaves()) for collection in collections]
+        nodes = [leaf for part in leaves for leaf in part]
+        results = self.cheap._predict(nodes)
+
+        hard = [i for i, result in enumerate(results) if _top_score(result) < self.threshold]
+        logger.info(
+            "%d of %d segments have a confidence score below %s and are passed to the expensive model",
+            len(hard),
+            len(results),
+            self.threshold,
+        )
+        if hard:
+            self.expensive._prepare(collections)
+            for i, result in zip(hard, self.expensive._predict([nodes[i] for i in hard])):
+                results[i] = result
+
+        _scatter(collections, leaves, results, self.evict_images)
+        return collections
+
+
+def _top_score(result: Result) -> float:
+    """The top text confidence score of `result`, 0 if it has no text"""
+    text_result = result.data.get(TEXT_RESULT_KEY)
+    if text_result is None or not text_result.scores:
+        return 0.0
+    return text_result.top_score()
+
+
 class WordSegmentation(PipelineStep):
     """
     Segment lines into words.
@@ -241,19 +494,30 @@ class Export(PipelineStep):
         self,
         dest: str,
         format: Literal["alto", "page", "txt", "json"],
+        workers: int = 1,
+        executor: Literal["thread", "process"] = "thread",
         **serializer_kwargs,
     ):
         """
         Arguments:
             dest: Output directory.
             format: Output format as a string.
+            workers: Number of workers used to serialize and write the
+                pages. Defaults to 1. The output does not depend on the
+                number of workers.
+            executor: Serialize the pages in worker threads ("thread")
+                or processes ("process"). Rendering and validating the
+                documents is pure Python, so only processes render
+                pages in parallel. Defaults to "thread".
         """
         self.serializer = get_serializer(format, **serializer_kwargs)
         self.dest = dest
+        self.workers = workers
+        self.executor = executor
 
     def run(self, collection):
         metadata = self.parent_pipeline.metadata() if self.parent_pipeline else None
-        save_collection(collection, self.serializer, self.dest, processing_steps=metadata)
+        save_collection(collection, self.serializer, self.dest, self.workers, self.executor, processing_steps=metadata)
         return collection
 
 
@@ -287,7 +551,8 @@ class ReadingOrderMarginalia(PipelineStep):
             if page.is_leaf():
                 continue
 
-            image = page.image
+            # The heuristics work on the grayscale image, which is cached by the page's pyramid
+            image = page.pyramid.gray
             printspace = estimate_printspace(image)
             page.children = order_regions(page.children, printspace, self.is_twopage(image))
 
@@ -311,7 +576,7 @@ class OrderLines(PipelineStep):
 
     def run(self, collection):
         for page in collection:
-            for node in page.traverse():
+            for node in page.preorder():
                 if node.is_region():
                     order = top_down([child.bbox for child in node])
                     node.children = [node.children[i] for i in order]
@@ -348,7 +613,7 @@ class ExportImages(PipelineStep):
             directory = os.path.join(self.dest, page.get("image_name"))
             extension = page.get("image_path").split(".")[-1]
             os.makedirs(directory, exist_ok=True)
-            for node in page.traverse():
+            for node in page.preorder():
                 if node.image is None:
                     continue
                 write(os.path.join(directory, f"{node.label}.{extension}"), node.image)
@@ -614,7 +879,9 @@ class Resize(PipelineStep):
         return collection
 
 
-def auto_import(source: list[str] | str, max_size: int | None = None) -> Generator[Collection, Any, Any]:
+def auto_import(
+    source: list[str] | str, max_size: int | None = None, prefetch: int = 0
+) -> Generator[Collection, Any, Any]:
     """Import collection(s) from `source`
 
     Arguments:
@@ -623,6 +890,9 @@ def auto_import(source: list[str] | str, max_size: int | None = None) -> Generat
                 - a directory of images
                 - an image
         max_size: The maximum number of pages in each new collection.
+        prefetch: Number of threads used to decode the images of upcoming
+            collections in the background, see `volume.prefetch_images`.
+            Defaults to 0, which disables prefetching.
 
     Yields:
         Collection instances created from the given source.
@@ -637,7 +907,10 @@ def auto_import(source: list[str] | str, max_size: int | None = None) -> Generat
         paths.append(path)
 
     logger.info("Importing %d input images with batch size %d", len(paths), max_size)
-    yield from _create_collection_batches(paths, max_size)
+    collections = _create_collection_batches(paths, max_size)
+    if prefetch > 0:
+        collections = prefetch_images(collections, max_workers=prefetch)
+    yield from collections
 
 
 def _create_collection_batches(paths: list[str], max_size: int | None) -> Generator[Collection, Any, Any]:
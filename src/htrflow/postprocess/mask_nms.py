@@ -4,7 +4,8 @@ from typing import Dict, List, Sequence
 import numpy as np
 
 from htrflow.results import Result
-from htrflow.utils.geometry import Mask
+from htrflow.utils import imgproc
+from htrflow.utils.geometry import Bbox, Mask
 
 
 def multiclass_mask_nms(result: Result, containments_threshold: float = 0.5, downscale: float = 0.25) -> List[int]:
@@ -18,6 +19,10 @@ def multiclass_mask_nms(result: Result, containments_threshold: float = 0.5, dow
     Masks that are significantly ontained within larger masks,
     as defined by the containment threshold, are marked for removal.
 
+    The masks are compared with `local_mask_nms`, which works on the segments' bounding box-local
+    masks and only compares masks whose bounding boxes overlap. Segments without a mask are treated
+    as filled bounding boxes.
+
     Args:
         result (Result): A Result object containing a sequence of masks and their associated class labels.
         containments_threshold (float): The threshold for deciding significant containment.
@@ -36,17 +41,105 @@ def multiclass_mask_nms(result: Result, containments_threshold: float = 0.5, dow
 
     remove_indices_global = []
 
-    masks_by_class: Dict[str, Sequence[Mask]] = defaultdict(list)
-    for segment in result.segments:
-        masks_by_class[segment.class_label].append(segment.approximate_mask(downscale))
-
-    for class_label, masks in masks_by_class.items():
-        remove_indices = mask_nms(masks, containments_threshold)
+    indices_by_class: Dict[str, List[int]] = defaultdict(list)
+    for i, segment in enumerate(result.segments):
+        indices_by_class[segment.class_label].append(i)
 
-        global_indices = [i for i, segment in enumerate(result.segments) if segment.class_label == class_label]
+    for global_indices in indices_by_class.values():
+        bboxes = []
+        masks = []
+        for i in global_indices:
+            segment = result.segments[i]
+            bbox, mask = segment.bbox, segment.mask
+            if downscale < 1:
+                # `downscale` is a ratio of areas, see `imgproc.rescale`
+                bbox = bbox.rescale(np.sqrt(downscale))
+                mask = None if mask is None else imgproc.rescale(mask, downscale)
+            bboxes.append(bbox)
+            masks.append(mask)
+
+        remove_indices = local_mask_nms(bboxes, masks, containments_threshold)
         remove_indices_global.extend([global_indices[i] for i in remove_indices])
 
-    return remove_indices_global
+    return sorted(remove_indices_global)
+
+
+def local_mask_nms(
+    bboxes: Sequence[Bbox | Sequence[int]],
+    masks: Sequence[Mask | None],
+    containments_threshold: float = 0.5,
+    tile_size: int = 256,
+) -> List[int]:
+    """
+    Identify masks that should be removed based on containment scores and area comparisons.
+
+    Gives the same result as `mask_nms`, but works on bounding box-local masks: Each mask covers
+    only its bounding box, and its top left corner is placed at the top left corner of the box.
+    Pairwise intersections are only computed for pairs of masks whose bounding boxes overlap
+    enough for the smaller mask to be significantly contained in the larger one. The candidate
+    pairs are found in tiles of `tile_size` masks at a time, which bounds the memory usage to
+    O(tile_size * N) plus the size of the masks themselves.
+
+    Args:
+        bboxes (Sequence[Bbox]): The masks' bounding boxes as (x1, y1, x2, y2) tuples.
+        masks (Sequence[Mask | None]): The bounding box-local masks. A mask of None is treated
+            as a filled bounding box.
+        containments_threshold (float): The threshold above which a mask is considered to be contained by another.
+        tile_size (int): Number of masks per tile when searching for candidate pairs.
+
+    Returns:
+        List[int]: Indices of masks to be removed.
+    """
+    n = len(bboxes)
+    if n < 2:
+        return []
+
+    # The extent of each mask is given by its shape, which may differ
+    # slightly from its bounding box after rescaling.
+    boxes = np.empty((n, 4), dtype=np.int64)
+    bool_masks = []
+    for i, (bbox, mask) in enumerate(zip(bboxes, masks)):
+        x1, y1, x2, y2 = (int(v) for v in bbox)
+        mask = np.ones((max(y2 - y1, 0), max(x2 - x1, 0)), dtype=bool) if mask is None else mask != 0
+        boxes[i] = x1, y1, x1 + mask.shape[1], y1 + mask.shape[0]
+        bool_masks.append(mask)
+
+    areas = np.array([np.count_nonzero(mask) for mask in bool_masks], dtype=np.int64)
+    to_remove = np.zeros(n, dtype=bool)
+
+    for start in range(0, n, max(tile_size, 1)):
+        tile = slice(start, min(start + tile_size, n))
+        ox1 = np.maximum(boxes[tile, None, 0], boxes[None, :, 0])
+        oy1 = np.maximum(boxes[tile, None, 1], boxes[None, :, 1])
+        ox2 = np.minimum(boxes[tile, None, 2], boxes[None, :, 2])
+        oy2 = np.minimum(boxes[tile, None, 3], boxes[None, :, 3])
+        overlap = np.clip(ox2 - ox1, 0, None) * np.clip(oy2 - oy1, 0, None)
+
+        # Only the smaller mask of a pair can be removed, and it can only be
+        # significantly contained if the bounding box overlap is large enough
+        tile_areas = areas[tile, None]
+        candidates = (tile_areas < areas[None, :]) & (overlap > containments_threshold * tile_areas)
+
+        for i, j in zip(*np.nonzero(candidates)):
+            i += start
+            if to_remove[i]:
+                continue
+            intersection = _intersection(boxes[i], bool_masks[i], boxes[j], bool_masks[j])
+            if intersection > containments_threshold * max(areas[i], 1):
+                to_remove[i] = True
+
+    return np.where(to_remove)[0].tolist()
+
+
+def _intersection(box_a: np.ndarray, mask_a: np.ndarray, box_b: np.ndarray, mask_b: np.ndarray) -> int:
+    """Number of pixels in the intersection of two bounding box-local masks"""
+    x1, y1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    x2, y2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    if x2 <= x1 or y2 <= y1:
+        return 0
+    a = mask_a[y1 - box_a[1] : y2 - box_a[1], x1 - box_a[0] : x2 - box_a[0]]
+    b = mask_b[y1 - box_b[1] : y2 - box_b[1], x1 - box_b[0] : x2 - box_b[0]]
+    return int(np.count_nonzero(a & b))
 
 
 def mask_nms(masks: Sequence[Mask], containments_threshold: float = 0.5) -> List[int]:
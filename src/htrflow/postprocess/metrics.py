@@ -18,10 +18,12 @@ def average_text_confidence(node: "volume.ImageNode") -> float:
         The node's average text confidence score, or 0.0 if it couldn't be
         computed (e.g., if the node didn't contain any text lines).
     """
-    nodes = node.traverse(lambda node: node.is_line())
-    if nodes:
-        return sum(line_text_confidence(node) for node in nodes) / len(nodes)
-    return 0.0
+    total = 0.0
+    n_lines = 0
+    for line in node.preorder(lambda node: node.is_line()):
+        total += line_text_confidence(line)
+        n_lines += 1
+    return total / n_lines if n_lines else 0.0
 
 
 def line_text_confidence(node: "volume.SegmentNode") -> float:
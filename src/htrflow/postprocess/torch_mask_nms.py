@@ -1,46 +1,168 @@
-from typing import List
+from contextlib import contextmanager
+from typing import Iterator, List, Sequence
 
 import torch
+import torch.nn.functional as F
 
 
-# TODO: torch_mask_nms
-def multiclass_mask_nms():
-    pass
+# Maximum number of elements of the float32 temporaries (64 MB)
+_MAX_CHUNK_ELEMENTS = 2**24
 
 
-def torch_mask_nms(masks: torch.Tensor, containments_threshold: float = 0.5) -> List[int]:
+def multiclass_mask_nms(
+    masks: torch.Tensor,
+    labels: torch.Tensor,
+    containments_threshold: float = 0.5,
+    downscale: float = 1.0,
+    num_threads: int | None = None,
+) -> List[int]:
     """
-    Identify masks that should be removed based on containment scores and area comparisons.
+    Perform containment-based Non-Maximum Suppression (NMS) on the masks of one image.
+
+    Torch version of `mask_nms.multiclass_mask_nms` which works directly on the mask tensors
+    of a segmentation model's output. See `batched_multiclass_mask_nms` for details.
 
     Args:
-        masks (torch.Tensor): A 3D Tensors [b,H,W].
+        masks (torch.Tensor): A 3D tensor [N, H, W] of binary masks.
+        labels (torch.Tensor): A 1D tensor [N] of class labels.
         containments_threshold (float): The threshold above which a mask is considered to be contained by another.
+        downscale (float): If < 1, the masks are downscaled by this factor (per side) before NMS.
+        num_threads (int | None): Number of intra-op threads to use. Defaults to torch's current setting.
 
     Returns:
         List[int]: Indices of masks to be removed.
     """
+    return batched_multiclass_mask_nms([masks], [labels], containments_threshold, downscale, num_threads)[0]
 
-    mask_areas = masks.sum(dim=(1, 2))
 
-    # expanded_masks = masks.unsqueeze(0)  # Shape [1, N, H, W]
-    # transposed_masks = masks.unsqueeze(1)  # Shape [N, 1, H, W]
-    # intersections = (expanded_masks & transposed_masks).sum(dim=(2, 3))  # Shape [N, N]
+def batched_multiclass_mask_nms(
+    masks: Sequence[torch.Tensor],
+    labels: Sequence[torch.Tensor],
+    containments_threshold: float = 0.5,
+    downscale: float = 1.0,
+    num_threads: int | None = None,
+) -> List[List[int]]:
+    """
+    Perform containment-based Non-Maximum Suppression (NMS) on the masks of a batch of images.
+
+    A mask is removed if it is significantly contained in a larger mask of the same class,
+    that is, if the intersection of the two masks divided by the area of the smaller mask
+    exceeds `containments_threshold`. This gives the same result as applying
+    `mask_nms.multiclass_mask_nms` to each image.
+
+    All images are processed in batched matrix multiplications: the masks are flattened
+    into a boolean [B, N, H*W] tensor (zero-padded to the largest number of masks and the
+    largest mask size of the batch), and the pairwise intersections are computed as the
+    product of the flattened masks with their transpose. The product is accumulated over
+    chunks of pixels, which are converted to float32 one at a time, so the masks are only
+    stored at one byte per pixel. The chunks are small enough for their float32 products to
+    be exact, and the counts are summed as integers, so the result is exact for any mask
+    size. This needs O(B*N*H*W + B*N^2) memory instead of the O(N^2*H*W) of an explicit
+    pairwise logical and. The computation runs on the device of the input masks.
 
-    intersections = (masks.unsqueeze(0) & masks.unsqueeze(1)).sum(dim=(2, 3))
+    Args:
+        masks (Sequence[torch.Tensor]): One 3D tensor [N_i, H_i, W_i] of binary masks per image.
+        labels (Sequence[torch.Tensor]): One 1D tensor [N_i] of class labels per image.
+        containments_threshold (float): The threshold above which a mask is considered to be contained by another.
+        downscale (float): If < 1, the masks are downscaled by this factor (per side) before NMS.
+            This speeds up NMS at the expense of accuracy.
+        num_threads (int | None): Number of intra-op threads to use on CPU. Defaults to torch's
+            current setting.
 
-    containments_score = intersections / mask_areas.unsqueeze(1)
+    Returns:
+        List[List[int]]: Indices of masks to be removed, one list per image.
+    """
+    if not masks:
+        return []
+
+    with _num_threads(num_threads), torch.no_grad():
+        device = masks[0].device
+        n_max = max(len(m) for m in masks)
+        if n_max < 2:
+            return [[] for _ in masks]
+
+        flat = []
+        for m in masks:
+            m = m.to(device)
+            if downscale < 1 and len(m):
+                m = _downscale(m, downscale)
+            flat.append(m.flatten(1) > 0)
+
+        size = max(f.shape[1] for f in flat)
+        stacked = torch.zeros((len(flat), n_max, size), dtype=torch.bool, device=device)
+        label_matrix = torch.full((len(flat), n_max), -1, dtype=torch.long, device=device)
+        valid = torch.zeros((len(flat), n_max), dtype=torch.bool, device=device)
+        for i, (f, image_labels) in enumerate(zip(flat, labels)):
+            stacked[i, : len(f), : f.shape[1]] = f
+            label_matrix[i, : len(f)] = torch.as_tensor(image_labels, device=device).long()
+            valid[i, : len(f)] = True
+
+        # [B, N, N] pairwise intersections. A chunk has fewer than 2**24 pixels,
+        # so its float32 product holds exact integer counts, which are summed as int64.
+        intersections = torch.zeros((len(flat), n_max, n_max), dtype=torch.long, device=device)
+        step = max(1, _MAX_CHUNK_ELEMENTS // (len(flat) * n_max))
+        for start in range(0, size, step):
+            chunk = stacked[:, :, start : start + step].float()
+            intersections += torch.bmm(chunk, chunk.transpose(1, 2)).long()
+        areas = stacked.sum(dim=2)
+
+        # The [B, N, N] comparisons are cheap, and are made on the CPU in float64
+        # because not all devices support it
+        intersections, areas = intersections.cpu(), areas.cpu()
+        label_matrix, valid = label_matrix.cpu(), valid.cpu()
+
+        significantly_contained = intersections > containments_threshold * areas.clamp(min=1).unsqueeze(2).double()
+        significantly_contained.diagonal(dim1=1, dim2=2).fill_(False)
+
+        same_class = label_matrix.unsqueeze(2) == label_matrix.unsqueeze(1)
+        pair_valid = valid.unsqueeze(2) & valid.unsqueeze(1)
+        is_smaller_than_others = areas.unsqueeze(2) < areas.unsqueeze(1)
+
+        to_remove = torch.any(significantly_contained & is_smaller_than_others & same_class & pair_valid, dim=2)
+
+        return [torch.where(row)[0].tolist() for row in to_remove]
+
+
+def _downscale(masks: torch.Tensor, downscale: float) -> torch.Tensor:
+    """Downscale [N, H, W] masks with nearest-neighbour interpolation, a few masks at a time"""
+    step = max(1, _MAX_CHUNK_ELEMENTS // masks[0].numel())
+    chunks = [
+        F.interpolate(masks[i : i + step].float().unsqueeze(1), scale_factor=downscale, mode="nearest").squeeze(1)
+        for i in range(0, len(masks), step)
+    ]
+    return torch.cat(chunks) > 0
 
-    torch.diagonal(containments_score).fill_(0)
 
-    significantly_contained = containments_score > containments_threshold
-    is_smaller_than_others = mask_areas.unsqueeze(0) < mask_areas.unsqueeze(1)
+def torch_mask_nms(masks: torch.Tensor, containments_threshold: float = 0.5) -> List[int]:
+    """
+    Identify masks that should be removed based on containment scores and area comparisons.
 
-    to_remove = torch.any(significantly_contained & is_smaller_than_others, dim=1)
+    Args:
+        masks (torch.Tensor): A 3D Tensors [b,H,W].
+        containments_threshold (float): The threshold above which a mask is considered to be contained by another.
 
-    return torch.where(to_remove)[0].tolist()
+    Returns:
+        List[int]: Indices of masks to be removed.
+    """
+    labels = torch.zeros(len(masks), dtype=torch.long, device=masks.device)
+    return multiclass_mask_nms(masks, labels, containments_threshold)
 
 
 def mask_drop_indices(masks: torch.Tensor, indices: torch.Tensor) -> torch.Tensor:
     indices_to_keep = torch.ones(masks.size(0), dtype=torch.bool, device=masks.device)
     indices_to_keep[indices] = 0
     return masks[indices_to_keep]
+
+
+@contextmanager
+def _num_threads(num_threads: int | None) -> Iterator[None]:
+    """Temporarily set the number of torch intra-op threads"""
+    if num_threads is None:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
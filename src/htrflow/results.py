@@ -19,6 +19,9 @@ class Segment:
         mask: The segment's mask, if available. The mask is stored
             relative to the bounding box. Use the `global_mask()`
             method to retrieve the mask relative to the original image.
+            Masks are stored bit-packed (see `geometry.PackedMask`),
+            and masks of segments created from a polygon are only
+            computed when first accessed.
         score: Segment confidence score, if available.
         class_label: Segment class label, if available.
         polygon: An approximation of the segment mask, relative to the
@@ -28,7 +31,6 @@ class Segment:
     """
 
     bbox: Bbox
-    mask: Mask | None
     score: float | None
     class_label: str | None
     polygon: Polygon | None
@@ -77,13 +79,12 @@ class Segment:
         elif polygon is not None:
             polygon = geometry.Polygon(polygon)
             bbox = polygon.bbox()
-            if orig_shape:
-                mask = geometry.polygon2mask(polygon, orig_shape)
-                mask = imgproc.crop(mask, Bbox(*bbox))
 
         self.bbox = geometry.Bbox(*bbox)
         self.polygon = polygon
         self.mask = mask
+        # The mask of a segment created from a polygon is computed lazily
+        self._mask_from_polygon = mask is None and polygon is not None and bool(orig_shape)
         self.score = score
         self.class_label = class_label
         self.orig_shape = orig_shape
@@ -92,6 +93,47 @@ class Segment:
     def __str__(self):
         return f"Segment(class_label={self.class_label}, score={self.score}, bbox={self.bbox}, polygon={self.polygon}, mask={self.mask})"  # noqa: E501
 
+    @property
+    def mask(self) -> Mask | None:
+        """The segment's mask relative to its bounding box"""
+        if self._mask_from_polygon:
+            self.mask = self._polygon_mask()
+        if self._mask is None:
+            return None
+        return self._mask.unpack()
+
+    @mask.setter
+    def mask(self, mask: Mask | None) -> None:
+        self._mask = None if mask is None else geometry.PackedMask(mask)
+        self._mask_from_polygon = False
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # Segments pickled before the masks were bit-packed
+        if "mask" in state:
+            mask = state.pop("mask")
+            state["_mask"] = None if mask is None else geometry.PackedMask(mask)
+            state["_mask_from_polygon"] = False
+        self.__dict__.update(state)
+
+    def _polygon_mask(self) -> Mask:
+        """Compute the mask from the polygon within the bounding box
+
+        Gives the same mask as cropping `polygon2mask(polygon, orig_shape)`
+        to the bounding box, without creating the full-size mask.
+        """
+        x1, y1, x2, y2 = self.bbox
+        # The polygon's max coordinates lie on the bounding box edge, which
+        # is outside the cropped mask. Rasterize it with a margin to avoid
+        # clipping, since clipping changes how OpenCV rasterizes the edges.
+        mask = geometry.polygon2mask(self.polygon.move((-x1, -y1)), (y2 - y1 + 1, x2 - x1 + 1))[:-1, :-1]
+        # Clear the parts of the bounding box that lie outside the original image
+        height, width = self.orig_shape
+        mask[max(0, height - y1) :] = 0
+        mask[:, max(0, width - x1) :] = 0
+        mask[: max(0, -y1)] = 0
+        mask[:, : max(0, -x1)] = 0
+        return mask
+
     @property
     def global_mask(self, orig_shape: tuple[int, int] | None = None) -> Mask | None:
         """
@@ -101,7 +143,8 @@ class Segment:
             orig_shape: Pass this argument to use another original shape
                 than the segment's `orig_shape` attribute. Defaults to None.
         """
-        if self.mask is None:
+        mask = self.mask
+        if mask is None:
             return None
 
         orig_shape = self.orig_shape if orig_shape is None else orig_shape
@@ -109,9 +152,9 @@ class Segment:
             raise ValueError("Cannot compute the global mask without knowing the original shape.")
 
         x1, y1, x2, y2 = self.bbox
-        mask = np.zeros(orig_shape, dtype=np.uint8)
-        mask[y1:y2, x1:x2] = self.mask
-        return mask
+        global_mask = np.zeros(orig_shape, dtype=np.uint8)
+        global_mask[y1:y2, x1:x2] = mask
+        return global_mask
 
     def approximate_mask(self, ratio: float) -> Mask | None:
         """A lower resolution version of the global mask
@@ -131,8 +174,9 @@ class Segment:
 
     def rescale(self, factor: float) -> None:
         """Rescale the segment's mask, bounding box and polygon by `factor`"""
-        if self.mask is not None:
-            self.mask = imgproc.rescale_linear(self.mask, factor)
+        mask = self.mask
+        if mask is not None:
+            self.mask = imgproc.rescale_linear(mask, factor)
         self.bbox = self.bbox.rescale(factor)
         if self.polygon is not None:
             self.polygon = self.polygon.rescale(factor)
@@ -244,14 +288,14 @@ class Result:
 
     @classmethod
     def segmentation_result(
-            cls,
-            orig_shape: tuple[int, int],
-            metadata: dict[str, Any],
-            bboxes: Sequence[Bbox | Iterable[int]] | None = None,
-            masks: Sequence[Mask] | None = None,
-            polygons: Sequence[Polygon] | None = None,
-            scores: Iterable[float] | None = None,
-            labels: Iterable[str] | None = None,
+        cls,
+        orig_shape: tuple[int, int],
+        metadata: dict[str, Any],
+        bboxes: Sequence[Bbox | Iterable[int]] | None = None,
+        masks: Sequence[Mask] | None = None,
+        polygons: Sequence[Polygon] | None = None,
+        scores: Iterable[float] | None = None,
+        labels: Iterable[str] | None = None,
     ) -> "Result":
         """Create a segmentation result
 
@@ -7,13 +7,16 @@ instance to different formats.
 
 from __future__ import annotations
 
+import functools
 import json
 import logging
 import os
 import pickle
+import threading
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import TYPE_CHECKING, Optional, Sequence
+from typing import TYPE_CHECKING, Callable, Iterable, Literal, Optional, Sequence, TypeVar
 
 import xmlschema
 from jinja2 import Environment, FileSystemLoader
@@ -21,6 +24,7 @@ from jinja2 import Environment, FileSystemLoader
 import htrflow
 from htrflow.postprocess.metrics import average_text_confidence
 from htrflow.results import TEXT_RESULT_KEY
+from htrflow.utils.geometry import Polygon
 from htrflow.utils.layout import REGION_KEY, RegionLocation
 
 
@@ -29,6 +33,8 @@ if TYPE_CHECKING:
 
 
 logger = logging.getLogger(__name__)
+_T = TypeVar("_T")
+_S = TypeVar("_S")
 
 _TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
 _SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
@@ -47,6 +53,7 @@ class Serializer:
 
     extension: str
     format_name: str
+    validation: Literal["off", "full", "lazy"] = "off"
 
     def serialize(self, page: PageNode, validate: bool = False, **metadata) -> str | None:
         """Serialize page
@@ -54,21 +61,48 @@ class Serializer:
         Arguments:
             page: Input page
             validate: If True, the generated document is passed through
-                valiadation before return.
+                valiadation before return. Documents are always validated
+                if the serializer's `validation` attribute is set to
+                'full' or 'lazy'.
 
         Returns:
             A string if the serialization was succesful, else None
         """
         doc = self._serialize(page, **metadata)
-        if validate:
-            self.validate(doc)
+        if doc is not None and (validate or self.validation != "off"):
+            self.validate(doc, lazy=self.validation == "lazy")
         return doc
 
-    def serialize_collection(self, collection: Collection, **metadata) -> Sequence[tuple[str, str]]:
+    def __getstate__(self) -> dict:
+        # Compiled templates can't be pickled, they are reloaded on unpickling
+        return {key: value for key, value in self.__dict__.items() if key != "template"}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if "_template_source" in state:
+            self.template = _load_template(*state["_template_source"])
+
+    def serialize_collection(
+        self,
+        collection: Collection,
+        workers: int = 1,
+        executor: Literal["thread", "process"] = "thread",
+        **metadata,
+    ) -> Sequence[tuple[str, str]]:
         """Serialize collection
 
         Arguments:
             collection: Input collection
+            workers: Number of threads or processes used to serialize
+                the pages. Defaults to 1, which serializes the pages one
+                by one on the calling thread.
+            executor: Whether the workers are threads or processes.
+                Template rendering and validation are pure Python and
+                hold the GIL, so only processes render pages in
+                parallel. With processes, each page is pickled (without
+                its images) and sent to a worker, which pays off for
+                larger pages and with validation enabled. Defaults to
+                "thread".
 
         Returns:
             A sequence of (document, filename) tuples where `document`
@@ -76,23 +110,36 @@ class Serializer:
             suggested filename to save `document` to. Note that this
             method may produce one file (which covers the entire
             collection) or several files (typically one file per page),
-            depending on the serialization method.
+            depending on the serialization method. The order of the
+            outputs follows the order of the pages, regardless of
+            `workers`.
         """
         for page in collection:
             page.prune(lambda node: node.is_leaf() and node.depth != page.max_depth())
         collection.relabel()
 
-        outputs = []
-        for page in collection:
+        def serialize_page(page: PageNode) -> tuple[str, str] | None:
             page.to_original_size()
             doc = self.serialize(page, **metadata)
             if doc is None:
-                continue
-            filename = os.path.join(collection.label, page.label + self.extension)
-            outputs.append((doc, filename))
-        return outputs
-
-    def validate(self, doc: str) -> None:
+                return None
+            return doc, os.path.join(collection.label, page.label + self.extension)
+
+        if executor == "process" and workers > 1:
+            from htrflow.volume.volume import without_images
+
+            tasks = []
+            for page in collection.pages:
+                page.to_original_size()
+                with without_images(page):
+                    data = pickle.dumps(page)
+                tasks.append((self, data, os.path.join(collection.label, page.label + self.extension), metadata))
+            outputs = _map(_serialize_pickled, tasks, workers, executor)
+        else:
+            outputs = _map(serialize_page, collection.pages, workers)
+        return [output for output in outputs if output is not None]
+
+    def validate(self, doc: str, lazy: bool = False) -> None:
         """Validate document"""
 
     def _serialize(self, page: PageNode, **metadata) -> str | None:
@@ -138,14 +185,24 @@ class AltoXML(Serializer):
     extension = ".xml"
     format_name = "alto"
 
-    def __init__(self, template_dir=_TEMPLATES_DIR, template_name="alto"):
+    def __init__(
+        self,
+        template_dir=_TEMPLATES_DIR,
+        template_name="alto",
+        validation: Literal["off", "full", "lazy"] = "off",
+    ):
         """
         Arguments:
             template_dir: Name of template directory.
             template_name: Name of template file in `template_dir`.
+            validation: Validate the generated documents against the
+                schema. 'full' parses the document into an element tree
+                before validating it, 'lazy' validates it in a single
+                streaming pass. Defaults to 'off'.
         """
-        env = Environment(loader=FileSystemLoader([template_dir, "."]))
-        self.template = env.get_template(template_name)
+        self.validation = validation
+        self._template_source = (template_dir, template_name)
+        self.template = _load_template(template_dir, template_name)
         self.schema = os.path.join(_SCHEMA_DIR, "alto-4-4.xsd")
 
     def _serialize(self, page: PageNode, **metadata) -> str:
@@ -156,7 +213,7 @@ class AltoXML(Serializer):
         # corresponding Alto group, otherwise it will be rendered in the
         # printspace group.
         text_blocks = defaultdict(list)
-        for node in page.traverse():
+        for node in page.preorder():
             if node.is_region() and all(child.text for child in node):
                 text_blocks[node.get(REGION_KEY, RegionLocation.PRINTSPACE)].append(node)
 
@@ -173,17 +230,19 @@ class AltoXML(Serializer):
             xmlescape=xmlescape,
         )
 
-    def validate(self, doc: str) -> None:
+    def validate(self, doc: str, lazy: bool = False) -> None:
         """Validate `doc` against the current schema
 
         Arguments:
             doc: Input document
+            lazy: If True, the document is validated in a single
+                streaming pass without building its full element tree.
 
         Raises:
             xmlschema.XMLSchemaValidationError if the document violates
             the current schema.
         """
-        xmlschema.validate(doc, self.schema)
+        validate_xml(doc, self.schema, lazy)
 
 
 class PageXML(Serializer):
@@ -215,14 +274,24 @@ class PageXML(Serializer):
     extension = ".xml"
     format_name = "page"
 
-    def __init__(self, template_dir=_TEMPLATES_DIR, template_name="page"):
+    def __init__(
+        self,
+        template_dir=_TEMPLATES_DIR,
+        template_name="page",
+        validation: Literal["off", "full", "lazy"] = "off",
+    ):
         """
         Arguments:
             template_dir: Name of template directory.
             template_name: Name of template file in `template_dir`.
+            validation: Validate the generated documents against the
+                schema. 'full' parses the document into an element tree
+                before validating it, 'lazy' validates it in a single
+                streaming pass. Defaults to 'off'.
         """
-        env = Environment(loader=FileSystemLoader([template_dir, "."]))
-        self.template = env.get_template(template_name)
+        self.validation = validation
+        self._template_source = (template_dir, template_name)
+        self.template = _load_template(template_dir, template_name)
         self.schema = os.path.join(_SCHEMA_DIR, "pagecontent.xsd")
 
     def _serialize(self, page: PageNode, **metadata):
@@ -237,17 +306,24 @@ class PageXML(Serializer):
             xmlescape=xmlescape,
         )
 
-    def validate(self, doc: str) -> None:
+    def validate(self, doc: str, lazy: bool = False) -> None:
         """Validate `doc` against the current schema
 
         Arguments:
             doc: Input document
+            lazy: If True, the document is validated in a single
+                streaming pass without building its full element tree.
 
         Raises:
             xmlschema.XMLSchemaValidationError if the document violates
             the current schema.
         """
-        xmlschema.validate(doc, self.schema)
+        validate_xml(doc, self.schema, lazy)
+
+
+# Attributes that are left out of the JSON output: masks (which are
+# large and possibly computed lazily), images and tree back-references
+_JSON_EXCLUDED_ATTRIBUTES = {"mask", "_mask", "_mask_from_polygon", "_image", "parent"}
 
 
 class Json(Serializer):
@@ -285,11 +361,19 @@ class Json(Serializer):
 
     def _serialize(self, page: PageNode, **metadata):
         def default(obj):
-            return {k: v for k, v in obj.__dict__.items() if k not in ["mask", "_image", "parent"]}
+            if isinstance(obj, Polygon):
+                return {"points": obj.points}
+            return {k: v for k, v in obj.__dict__.items() if k not in _JSON_EXCLUDED_ATTRIBUTES}
 
         return json.dumps(page.asdict() | metadata, default=default, indent=self.indent)
 
-    def serialize_collection(self, collection: Collection, **metadata):
+    def serialize_collection(
+        self,
+        collection: Collection,
+        workers: int = 1,
+        executor: Literal["thread", "process"] = "thread",
+        **metadata,
+    ):
         if self.one_file:
             pages = [json.loads(self._serialize(page, **metadata)) for page in collection]
             doc = json.dumps(
@@ -298,7 +382,7 @@ class Json(Serializer):
             )
             filename = collection.label + self.extension
             return [(doc, filename)]
-        return super().serialize_collection(collection, **metadata)
+        return super().serialize_collection(collection, workers, executor, **metadata)
 
 
 class PlainText(Serializer):
@@ -323,10 +407,22 @@ class PlainText(Serializer):
     format_name = "txt"
 
     def _serialize(self, page: PageNode, **metadata) -> str:
-        lines = page.traverse(lambda node: node.is_line())
+        lines = page.preorder(lambda node: node.is_line())
         return "\n".join(line.text.strip() for line in lines)
 
 
+def _load_template(template_dir: str, template_name: str):
+    env = Environment(loader=FileSystemLoader([template_dir, "."]))
+    return env.get_template(template_name)
+
+
+def _serialize_pickled(task: tuple[Serializer, bytes, str, dict]) -> tuple[str, str] | None:
+    """Serialize a pickled page in a worker process, see `Serializer.serialize_collection`"""
+    serializer, data, filename, metadata = task
+    doc = serializer.serialize(pickle.loads(data), **metadata)
+    return None if doc is None else (doc, filename)
+
+
 def get_metadata() -> dict:
     timestamp = datetime.utcnow().isoformat()
 
@@ -339,6 +435,45 @@ def get_metadata() -> dict:
     }
 
 
+def validate_xml(doc: str, schema: str, lazy: bool = False) -> None:
+    """Validate an XML document against an XSD schema
+
+    Arguments:
+        doc: The XML document as a string.
+        schema: Path to the XSD schema.
+        lazy: Validate the document in a single streaming pass.
+
+    Raises:
+        xmlschema.XMLSchemaValidationError if the document violates
+        the schema.
+    """
+    source = xmlschema.XMLResource(doc, lazy=True) if lazy else doc
+    load_schema(schema).validate(source)
+
+
+_schema_lock = threading.Lock()
+
+
+@functools.cache
+def _load_schema(path: str) -> xmlschema.XMLSchema:
+    logger.info("Compiling XML schema %s", path)
+    return xmlschema.XMLSchema(path)
+
+
+def load_schema(path: str) -> xmlschema.XMLSchema:
+    """Load and compile an XSD schema
+
+    Compiling a schema is slow (and may involve downloading imported
+    schemas), so each schema is only compiled once per process.
+
+    Arguments:
+        path: Path to the XSD schema.
+    """
+    path = os.path.abspath(path)
+    with _schema_lock:
+        return _load_schema(path)
+
+
 def supported_formats() -> list[str]:
     """The supported formats"""
     return [cls.format_name for cls in Serializer.__subclasses__()]
@@ -373,27 +508,80 @@ def pickle_collection(collection: Collection, directory: str = ".cache", filenam
     return path
 
 
-def save_collection(collection: Collection, serializer: str | Serializer, dest: str, **metadata):
+def save_collection(
+    collection: Collection,
+    serializer: str | Serializer,
+    dest: str,
+    workers: int = 1,
+    executor: Literal["thread", "process"] = "thread",
+    **metadata,
+):
     """Serialize and save collection
 
+    Each file is written atomically: the document is first written to
+    a temporary file in the destination directory, which then replaces
+    the destination file. An interrupted export therefore never leaves
+    partially written files behind.
+
     Arguments:
         collection: Input collection
         serializer: What serializer to use. Takes a Serializer instance
             or the name of the serializer as a string, see
             serialization.supported_formats() for supported formats.
         dest: Output directory
+        workers: Number of workers used to serialize and write the
+            pages. Defaults to 1.
+        executor: Whether the pages are serialized by threads or by
+            processes, see `Serializer.serialize_collection`. The files
+            are always written by threads. Defaults to "thread".
     """
 
     if isinstance(serializer, str):
         serializer = get_serializer(serializer)
         logger.info("Using %s serializer with default settings", serializer.__class__.__name__)
 
-    for doc, filename in serializer.serialize_collection(collection, **metadata):
-        filename = os.path.join(dest, filename)
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, "w", encoding="utf-8") as f:
+    # Pages with the same label are written to the same file. As in a
+    # serial export, the last page wins, also when the files are written
+    # in parallel.
+    outputs = {
+        os.path.join(dest, filename): doc
+        for doc, filename in serializer.serialize_collection(
+            collection, workers=workers, executor=executor, **metadata
+        )
+    }
+    outputs = [(doc, path) for path, doc in outputs.items()]
+    for directory in {os.path.dirname(path) for _, path in outputs}:
+        os.makedirs(directory, exist_ok=True)
+
+    _map(lambda output: _write(*output), outputs, workers)
+    for _, path in outputs:
+        logger.info("Wrote document to %s", path)
+
+
+def _write(doc: str, path: str) -> None:
+    """Write `doc` to `path` via a temporary file in the same directory"""
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
             f.write(doc)
-        logger.info("Wrote document to %s", filename)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _map(
+    fn: Callable[[_T], _S], items: Iterable[_T], workers: int, executor: Literal["thread", "process"] = "thread"
+) -> list[_S]:
+    """Apply `fn` to `items` on a pool of `workers` threads or processes, keeping the input order"""
+    if workers <= 1:
+        return [fn(item) for item in items]
+    if executor == "process":
+        with ProcessPoolExecutor(workers) as pool:
+            return list(pool.map(fn, items))
+    with ThreadPoolExecutor(workers, thread_name_prefix="htrflow-export") as pool:
+        return list(pool.map(fn, items))
 
 
 def xmlescape(s: str) -> str:
@@ -4,7 +4,7 @@ Geometry utilities
 
 import logging
 from dataclasses import astuple, dataclass
-from typing import Iterable, Iterator, Sequence, TypeAlias
+from typing import Iterable, Iterator, TypeAlias
 
 import cv2
 import numpy as np
@@ -198,19 +198,26 @@ class Bbox:
 class Polygon:
     """Polygon class
 
-    This class represents a polygon as a sequence of `Point` instances.
+    This class represents a polygon as a sequence of points. The points
+    are stored as a contiguous (n, 2) int32 numpy array, but iterating
+    over or indexing a polygon gives `Point` instances.
     """
 
-    points: Sequence[Point]
-
-    def __init__(self, points: Iterable[tuple[int, int] | Point]):
+    def __init__(self, points: "Iterable[tuple[int, int] | Point] | npt.NDArray[np.integer]"):
         """Create a Polygon
 
         Attributes:
-            points: The points defining the polygon, as either tuples
-                or `Point` instances.
+            points: The points defining the polygon, as either tuples,
+                `Point` instances or an (n, 2) array of [x, y] rows.
         """
-        self.points = [Point(*point) for point in points]
+        if not isinstance(points, np.ndarray):
+            points = [tuple(point) for point in points]
+        self._points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+
+    @property
+    def points(self) -> list[Point]:
+        """The points of the polygon as a list of `Point` instances"""
+        return list(self)
 
     def move(self, dest: tuple[int, int] | Point) -> "Polygon":
         """Move polygon to `dest`
@@ -222,30 +229,76 @@ class Polygon:
             A copy of the polygon with its coordinates shifted
             `dx` and `dy` in the x- and y-axis, respectively.
         """
-        return Polygon(point.move(dest) for point in self)
+        return Polygon(self._points + np.array(tuple(dest), dtype=np.int32))
 
     def bbox(self) -> Bbox:
         """The smallest bounding box that encloses the polygon"""
-        xs = [x for x, _ in self]
-        ys = [y for _, y in self]
-        return Bbox(min(xs), min(ys), max(xs), max(ys))
+        xmin, ymin = self._points.min(axis=0).tolist()
+        xmax, ymax = self._points.max(axis=0).tolist()
+        return Bbox(xmin, ymin, xmax, ymax)
 
     def as_nparray(self) -> npt.NDArray[np.int32]:
         """The polygon as a [[x1, y1], ..., [xn, yn]] numpy array"""
-        return np.array([[x, y] for x, y in self], dtype=np.int32)
+        return self._points.copy()
 
     def rescale(self, factor: float) -> "Polygon":
         """Rescale polygon by multiplying its points with `factor`"""
-        return Polygon([p.rescale(factor) for p in self])
+        # Casting truncates towards zero, like `Point.rescale`
+        return Polygon((self._points * factor).astype(np.int32))
 
     def __iter__(self) -> Iterator[Point]:
-        return iter(self.points)
+        return (Point(x, y) for x, y in self._points.tolist())
 
     def __getitem__(self, i: int) -> Point:
-        return self.points[i]
+        x, y = self._points[i].tolist()
+        return Point(x, y)
 
     def __len__(self) -> int:
-        return len(self.points)
+        return len(self._points)
+
+    def __repr__(self) -> str:
+        return f"Polygon({self._points.tolist()})"
+
+
+class PackedMask:
+    """Bit-packed binary mask
+
+    Stores a binary mask with one bit per pixel, which is 8 times
+    smaller than a uint8 mask. Use `unpack()` to get the mask back as
+    a uint8 array.
+
+    HTRflow's masks use either 1 (model outputs) or 255 (masks drawn
+    from polygons, see `polygon2mask`) as foreground value. The packed
+    mask remembers which, so that unpacking gives back the same values.
+
+    Attributes:
+        shape: Shape of the unpacked mask as a (height, width) tuple.
+        bits: The packed mask.
+        value: The foreground value of the unpacked mask.
+    """
+
+    def __init__(self, mask: Mask):
+        """Pack `mask`, any non-zero value is treated as True
+
+        The foreground value of the packed mask is the largest value of
+        `mask`, clipped to the range 1 to 255.
+        """
+        self.shape = mask.shape[:2]
+        self.bits = np.packbits(mask != 0, axis=None)
+        self.value = int(np.clip(mask.max(), 1, 255)) if mask.size else 1
+
+    def unpack(self) -> Mask:
+        """The mask as a uint8 array of zeros and `value`"""
+        height, width = self.shape
+        mask = np.unpackbits(self.bits, count=height * width).reshape(self.shape)
+        if self.value != 1:
+            mask *= np.uint8(self.value)
+        return mask
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the packed mask in bytes"""
+        return self.bits.nbytes
 
 
 def mask2polygon(mask: Mask, epsilon: float = 0.005) -> Polygon:
@@ -279,7 +332,7 @@ def mask2polygon(mask: Mask, epsilon: float = 0.005) -> Polygon:
         squeezed = np.squeeze(approx)
         if squeezed.ndim == 1:
             continue
-        polygons.append(Polygon(squeezed.tolist()))
+        polygons.append(Polygon(squeezed))
 
     if len(polygons) > 1:
         logger.warning("Mask is not connected. Using the largest connected component")
@@ -325,7 +378,7 @@ def polygon2mask(polygon: Polygon, shape: tuple[int, int] | None = None) -> Mask
         bbox = polygon.bbox()
         shape = bbox.ymax, bbox.xmax
 
-    mask = np.zeros(shape, dtype=np.int32)
+    mask = np.zeros(shape, dtype=np.uint8)
     if len(polygon) > 0:
         mask = cv2.fillPoly(mask, [polygon.as_nparray()], color=255)
     return mask
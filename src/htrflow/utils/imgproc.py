@@ -4,12 +4,16 @@ Image processing utilities
 
 import logging
 import re
+import warnings
+import weakref
+from collections import OrderedDict
 from typing import Any, TypeAlias
 
 import cv2
 import numpy as np
 import numpy.typing as npt
 import requests
+from PIL import Image
 
 from htrflow.utils.geometry import Bbox, Mask, Polygon, polygon2mask
 
@@ -18,7 +22,7 @@ NumpyImage: TypeAlias = np.ndarray  # TODO make non-generic
 logger = logging.getLogger(__name__)
 
 
-def crop(image: npt.NDArray[Any], bbox: Bbox, padding: int | None = 0) -> npt.NDArray[Any]:
+def crop(image: npt.NDArray[Any], bbox: Bbox, padding: int | None = 0, copy: bool = True) -> npt.NDArray[Any]:
     """Crop image
 
     Args:
@@ -28,9 +32,14 @@ def crop(image: npt.NDArray[Any], bbox: Bbox, padding: int | None = 0) -> npt.ND
             box overflows the input image. This ensures that the cropped image
             has the same size as the bounding box. If None, no padding is used,
             and the shape of the cropped image may not match the bounding box.
+        copy: If False, return a view into `image` instead of a copy, which
+            avoids copying any pixel data. Writing to the view modifies the
+            input image. Padded crops are always copies.
     """
     x1, y1, x2, y2 = bbox
-    cropped = image[y1:y2, x1:x2].copy()
+    cropped = image[y1:y2, x1:x2]
+    if copy:
+        cropped = cropped.copy()
     h, w = cropped.shape[:2]
     if padding is not None and (h < bbox.height or w < bbox.width):
         pad_y = bbox.height - h
@@ -137,6 +146,120 @@ def rescale_linear(image: npt.NDArray[Any], ratio: float) -> npt.NDArray[Any]:
     return resize(image, (int(h * ratio), int(w * ratio)))
 
 
+def rescale_cached(image: npt.NDArray[Any], ratio: float) -> npt.NDArray[Any]:
+    """Rescale image like `rescale_linear`, reusing the image's pyramid if it has one
+
+    If `image` is the base image of an `ImagePyramid`, the rescaled
+    image is taken from (or added to) the pyramid. The result may then
+    be shared with other users of the pyramid and must not be modified
+    in place.
+
+    Arguments:
+        image: Input image
+        ratio: Ratio of rescaled side length to original side length,
+            see `rescale_linear`.
+    """
+    if pyramid := ImagePyramid.of(image):
+        return pyramid.rescaled(ratio)
+    return rescale_linear(image, ratio)
+
+
+class ImagePyramid:
+    """Cache of grayscale and downscaled versions of an image
+
+    The versions ("levels") are computed on demand and kept until the
+    pyramid exceeds its memory cap, when the least recently used levels
+    are dropped. Each level is computed from the base image with the
+    same functions as elsewhere in this module (`resize` and BGR to
+    grayscale conversion), so a level is identical to the uncached
+    result.
+
+    The levels are shared between all users of the pyramid and must
+    not be modified in place.
+
+    Example:
+    ```python
+    pyramid = ImagePyramid(image)
+    pyramid.gray            # grayscale image, same size as `image`
+    pyramid.rescaled(0.5)   # == rescale_linear(image, 0.5)
+    ```
+    """
+
+    def __init__(self, image: npt.NDArray[Any], max_bytes: int | None = None):
+        """
+        Arguments:
+            image: The base image, in grayscale or BGR.
+            max_bytes: Maximum total size of the cached levels. Defaults
+                to the size of the base image, which means that the
+                pyramid at most doubles the memory used by the image.
+        """
+        self.image = image
+        self.max_bytes = image.nbytes if max_bytes is None else max_bytes
+        self._levels: OrderedDict[tuple[tuple[int, int], bool], npt.NDArray[Any]] = OrderedDict()
+        _pyramids[id(image)] = self
+
+    @classmethod
+    def of(cls, image: npt.NDArray[Any]) -> "ImagePyramid | None":
+        """Return the pyramid whose base image is `image`, if any"""
+        pyramid = _pyramids.get(id(image))
+        if pyramid is not None and pyramid.image is image:
+            return pyramid
+        return None
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the cached levels"""
+        return sum(level.nbytes for level in self._levels.values())
+
+    @property
+    def gray(self) -> npt.NDArray[Any]:
+        """The base image in grayscale"""
+        return self.resized(self.image.shape[:2], gray=True)
+
+    def rescaled(self, ratio: float, gray: bool = False) -> npt.NDArray[Any]:
+        """The base image rescaled by `ratio`, see `rescale_linear`
+
+        Arguments:
+            ratio: Ratio of rescaled side length to original side length.
+            gray: Whether to return the level in grayscale.
+        """
+        h, w = self.image.shape[:2]
+        return self.resized((int(h * ratio), int(w * ratio)), gray)
+
+    def resized(self, shape: tuple[int, int], gray: bool = False) -> npt.NDArray[Any]:
+        """The base image resized to `shape`, see `resize`
+
+        Arguments:
+            shape: Shape of the level as a (height, width) tuple.
+            gray: Whether to return the level in grayscale.
+        """
+        shape = tuple(shape)
+        gray = gray and self.image.ndim > 2
+        if not gray and shape == self.image.shape[:2]:
+            return self.image
+
+        key = (shape, gray)
+        if (level := self._levels.get(key)) is not None:
+            self._levels.move_to_end(key)
+            return level
+
+        if gray:
+            level = cv2.cvtColor(self.resized(shape), cv2.COLOR_BGR2GRAY)
+        else:
+            level = resize(self.image, shape)
+
+        if level.nbytes <= self.max_bytes:
+            self._levels[key] = level
+            while self.nbytes > self.max_bytes:
+                self._levels.popitem(last=False)
+        return level
+
+
+# Base image id -> pyramid. The pyramids hold on to their base images,
+# so the ids can't be reused by other images while the entries exist.
+_pyramids: "weakref.WeakValueDictionary[int, ImagePyramid]" = weakref.WeakValueDictionary()
+
+
 def binarize(image: npt.NDArray[Any]) -> npt.NDArray[Any]:
     """Binarize image"""
     img_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -234,6 +357,55 @@ def read(source: str | npt.NDArray[Any]) -> npt.NDArray[Any]:
     return img
 
 
+def read_shape(source: str) -> tuple[int, int]:
+    """Read the shape of an image without decoding it
+
+    Reads the image's width and height from the file header only, which
+    is much faster than decoding the entire image. The EXIF orientation
+    tag is taken into account, so that the returned shape matches the
+    shape of the image returned by `imgproc.read`. Falls back to decoding
+    the image if `source` is a URL, or if the header could not be read.
+
+    Args:
+        source: A URL or a local filesystem path.
+
+    Returns:
+        The image shape as a (height, width) tuple.
+
+    Raises:
+        ImageImportError: If the image cannot be loaded from the given source.
+    """
+    if isinstance(source, str) and not is_http_url(source):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                with Image.open(source) as img:
+                    width, height = img.size
+                    image_format = img.format
+                    orientation = img.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+        except Exception:
+            # Reading the header is only a shortcut, `read` below raises a
+            # proper ImageImportError if the image cannot be decoded. (PIL's
+            # opener may be patched by other packages, e.g. ultralytics, so
+            # any exception is possible here.)
+            pass
+        else:
+            if image_format in _HEADER_FORMATS:
+                # Orientations 5-8 mean that the image is rotated 90 or 270 degrees
+                if orientation in (5, 6, 7, 8):
+                    width, height = height, width
+                return height, width
+
+    return read(source).shape[:2]
+
+
+# Formats that are readable by both PIL and OpenCV. For other formats,
+# `read_shape` falls back to `read` to make sure that OpenCV can decode
+# the image.
+_HEADER_FORMATS = {"BMP", "JPEG", "JPEG2000", "PNG", "PPM", "TIFF", "WEBP"}
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
 def write(dest: str, image: npt.NDArray[Any]) -> str:
     cv2.imwrite(dest, image)
     logger.info("Wrote image to %s", dest)
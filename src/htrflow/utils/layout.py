@@ -45,11 +45,11 @@ def estimate_printspace(image: np.ndarray, window: int = 150) -> Bbox:
         The estimated printspace as a bounding box. If no printspace is
         detected, a bbox that covers the entire page is returned.
     """
-    image = image.copy()
     if image.ndim > 2:
         image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    # Binarize the image
+    # Binarize the image. The input image is not modified by this or
+    # any of the following steps.
     _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
     # Floodfill the image from the top-left corner. This removes (or
@@ -124,7 +124,6 @@ def is_twopage(img, strip_width=0.1, threshold=0.2):
        The location (y-coordinate in matrix notation) of the detected
        divider, if found, else None.
     """
-    img = img.copy()
     if len(img.shape) == 3:
         img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
@@ -196,7 +195,7 @@ def label_regions(collection: Collection):
     """
 
     for page in collection:
-        printspace = estimate_printspace(page.image)
+        printspace = estimate_printspace(page.pyramid.gray)
         for node in page:
             node.add_data(**{REGION_KEY: get_region_location(printspace, node.bbox)})
 
@@ -0,0 +1,236 @@
+"""
+Profiling of pipeline runs
+
+This module holds a process-wide profiler which records the wall time
+of every pipeline step and every model batch. It is disabled by
+default, and is enabled by the CLI's `--profile` option:
+
+```python
+from htrflow.utils.profiling import profiler
+
+profiler.enable()
+pipeline.run(collection)
+profiler.save("profile.json")
+```
+
+Models can attribute parts of their `_predict()` method to the
+preprocessing or postprocessing phases with `phase()`. The remaining
+time of `_predict()` is reported as forward pass time.
+"""
+
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Literal
+
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+Phase = Literal["preprocess", "postprocess"]
+
+
+class Profiler:
+    """Recorder of step and batch timings
+
+    Attributes:
+        steps: One record per pipeline step and collection.
+        batches: One record per model batch.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.steps: list[dict[str, Any]] = []
+        self.batches: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self) -> None:
+        """Enable the profiler and clear any earlier records"""
+        self.steps = []
+        self.batches = []
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    @contextmanager
+    def step(self, name: str, step_index: int, n_pages: int) -> Iterator[None]:
+        """Record the wall time of a pipeline step
+
+        Arguments:
+            name: Name of the step.
+            step_index: Index of the step in the pipeline.
+            n_pages: Number of pages passed to the step.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        tic = time.perf_counter()
+        yield
+        wall_time = time.perf_counter() - tic
+        record = {
+            "step": name,
+            "step_index": step_index,
+            "pages": n_pages,
+            "wall_time": wall_time,
+            "pages_per_second": n_pages / wall_time if wall_time > 0 else None,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        with self._lock:
+            self.steps.append(record)
+
+    @contextmanager
+    def phase(self, name: Phase) -> Iterator[None]:
+        """Attribute the time spent in this context to `name` in the current batch"""
+        phases = getattr(self._local, "phases", None)
+        if not self.enabled or phases is None:
+            yield
+            return
+
+        tic = time.perf_counter()
+        yield
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - tic
+
+    @contextmanager
+    def batch(self, model: str, n_items: int) -> Iterator[dict[str, float]]:
+        """Record a model batch
+
+        Yields a dictionary of phase timings to be filled in by the
+        caller. Phases recorded with `phase()` within the context are
+        added to the dictionary.
+
+        Arguments:
+            model: Name of the model.
+            n_items: Number of inputs in the batch.
+        """
+        timings = {"load": 0.0, "preprocess": 0.0, "forward": 0.0, "postprocess": 0.0}
+        if not self.enabled:
+            yield timings
+            return
+
+        self._local.phases = {}
+        tic = time.perf_counter()
+        try:
+            yield timings
+        finally:
+            phases = self._local.phases
+            self._local.phases = None
+
+        for name, duration in phases.items():
+            timings[name] += duration
+            # Phases recorded inside the model are part of the timed forward pass
+            timings["forward"] -= duration
+        record = {
+            "model": model,
+            "items": n_items,
+            "wall_time": timings["load"] + time.perf_counter() - tic,
+            **timings,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        with self._lock:
+            self.batches.append(record)
+
+    def summary(self) -> dict[str, Any]:
+        """Aggregate the records per step and per model"""
+        steps = {}
+        for record in self.steps:
+            key = f"{record['step_index'] + 1}: {record['step']}"
+            entry = steps.setdefault(key, {"calls": 0, "pages": 0, "wall_time": 0.0, "peak_rss_mb": 0.0})
+            entry["calls"] += 1
+            entry["pages"] += record["pages"]
+            entry["wall_time"] += record["wall_time"]
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], record["peak_rss_mb"] or 0.0)
+
+        for entry in steps.values():
+            entry["pages_per_second"] = entry["pages"] / entry["wall_time"] if entry["wall_time"] > 0 else None
+
+        models = {}
+        for record in self.batches:
+            entry = models.setdefault(record["model"], {"batches": 0, "items": 0, "wall_time": 0.0})
+            entry["batches"] += 1
+            entry["items"] += record["items"]
+            for key in ("wall_time", "load", "preprocess", "forward", "postprocess"):
+                entry[key] = entry.get(key, 0.0) + record[key]
+
+        for entry in models.values():
+            entry["items_per_batch"] = entry["items"] / entry["batches"]
+
+        return {"steps": steps, "models": models, "peak_rss_mb": peak_rss_mb()}
+
+    def save(self, path: str) -> None:
+        """Write the records to `path`
+
+        The output format is chosen from the file extension: '.csv' gives
+        one row per record, anything else gives JSON with the records
+        and a summary (see `Profiler.summary()`).
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if os.path.splitext(path)[1].lower() == ".csv":
+            records = [{"kind": "step"} | record for record in self.steps]
+            records += [{"kind": "batch"} | record for record in self.batches]
+            fieldnames = list({key: None for record in records for key in record})
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(path, "w") as f:
+                json.dump({"summary": self.summary(), "steps": self.steps, "batches": self.batches}, f, indent=2)
+        logger.info("Wrote profiling report to %s", path)
+
+    def log_summary(self) -> None:
+        """Log the summary at level INFO"""
+        summary = self.summary()
+        for name, entry in summary["steps"].items():
+            logger.info(
+                "Step %s: %d pages in %.2f s (%.2f pages/s)",
+                name,
+                entry["pages"],
+                entry["wall_time"],
+                entry["pages_per_second"] or 0.0,
+            )
+        for name, entry in summary["models"].items():
+            logger.info(
+                "Model %s: %d items in %d batches (%.1f items/batch), "
+                "load %.2f s, preprocess %.2f s, forward %.2f s, postprocess %.2f s",
+                name,
+                entry["items"],
+                entry["batches"],
+                entry["items_per_batch"],
+                entry["load"],
+                entry["preprocess"],
+                entry["forward"],
+                entry["postprocess"],
+            )
+        if summary["peak_rss_mb"] is not None:
+            logger.info("Peak RSS: %.0f MB", summary["peak_rss_mb"])
+
+
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of this process in MB, or None if unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+profiler = Profiler()
+phase = profiler.phase
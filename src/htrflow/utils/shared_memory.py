@@ -0,0 +1,232 @@
+"""
+Shared-memory transport of images between processes
+
+An `ImageArena` places images in shared memory blocks. Images in the
+arena, and all views into them (such as the segment images, which are
+views into their page image), can then be sent to another process as
+a small `SharedImage` handle instead of being pickled. The receiving
+process maps the same memory with `attach()`, which copies no pixel
+data.
+
+Each block is reference counted. The process that created an image
+holds one reference for as long as the image (or any view into it) is
+alive, and each handle holds one reference until it is released with
+`ImageArena.release()`. The block is freed when the last reference is
+dropped.
+"""
+
+import logging
+import threading
+import weakref
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Sequence
+
+import numpy as np
+
+from htrflow.utils.imgproc import NumpyImage
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SharedImage:
+    """Handle of an image in shared memory
+
+    Attributes:
+        name: Name of the shared memory block.
+        offset: Offset of the image's first pixel in the block, in bytes.
+        shape: Shape of the image.
+        strides: Strides of the image, in bytes.
+        dtype: Data type of the image, as a NumPy type string.
+    """
+
+    name: str
+    offset: int
+    shape: tuple[int, ...]
+    strides: tuple[int, ...]
+    dtype: str
+
+
+class ImageArena:
+    """Reference-counted shared memory blocks for images
+
+    Example:
+    ```python
+    arena = ImageArena()
+    image = arena.share(image)          # copy the image to shared memory
+    handle = arena.handle(image[:100])  # no copy, views work too
+    # ... send `handle` to a worker, which calls attach([handle]) ...
+    arena.release(handle)
+    ```
+    """
+
+    def __init__(self):
+        # Block name -> [shared memory block, address in this process or None, size, references]
+        self._blocks: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of live blocks"""
+        return len(self._blocks)
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the live blocks"""
+        return sum(block[2] for block in self._blocks.values())
+
+    def share(self, image: NumpyImage) -> NumpyImage:
+        """Copy `image` to a new shared memory block
+
+        Arguments:
+            image: The input image.
+
+        Returns:
+            A copy of `image` backed by shared memory. The block is kept
+            alive for as long as the copy, or any view into it, is alive.
+        """
+        image = np.asarray(image)
+        shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        buffer = _map(shm)
+        shared = np.ndarray(image.shape, dtype=image.dtype, buffer=buffer)
+        shared[...] = image
+        with self._lock:
+            self._blocks[shm.name] = [shm, buffer.ctypes.data, shm.size, 1]
+        weakref.finalize(buffer.base, self._unmap, shm.name)
+        logger.debug("Shared image of shape %s in block %s", image.shape, shm.name)
+        return shared
+
+    def handle(self, image: NumpyImage) -> SharedImage | None:
+        """Get a handle of an image in the arena
+
+        The handle holds a reference to the image's block, which must be
+        given back with `release()` when the handle is no longer used.
+
+        Arguments:
+            image: An image returned by `share()` or a view into one.
+
+        Returns:
+            A handle of the image, or None if the image isn't in the arena.
+        """
+        with self._lock:
+            if (name := self._find(image)) is None:
+                return None
+            block = self._blocks[name]
+            block[3] += 1
+            offset = image.__array_interface__["data"][0] - block[1]
+            return SharedImage(name, offset, image.shape, image.strides, image.dtype.str)
+
+    def __contains__(self, image: NumpyImage) -> bool:
+        """True if `image` is a shared image of this arena or a view into one"""
+        with self._lock:
+            return self._find(image) is not None
+
+    def release(self, handle: SharedImage) -> None:
+        """Give back the reference held by `handle`"""
+        self._unref(handle.name)
+
+    def close(self) -> None:
+        """Free all blocks
+
+        Images returned by `share()` stay valid in this process, but
+        handles can no longer be attached.
+        """
+        with self._lock:
+            blocks, self._blocks = self._blocks, {}
+        for shm, *_ in blocks.values():
+            _unlink(shm)
+
+    def _find(self, image: NumpyImage) -> str | None:
+        """Return the name of the block that holds all pixels of `image`"""
+        address = image.__array_interface__["data"][0]
+        low = address + sum(min(0, (n - 1) * s) for n, s in zip(image.shape, image.strides))
+        high = address + sum(max(0, (n - 1) * s) for n, s in zip(image.shape, image.strides)) + image.itemsize
+        for name, (_, start, size, _) in self._blocks.items():
+            if start is not None and start <= low and high <= start + size:
+                return name
+        return None
+
+    def _unmap(self, name: str) -> None:
+        """Drop the reference held by the shared image, which has been garbage collected"""
+        with self._lock:
+            if block := self._blocks.get(name):
+                # The address may be reused by another mapping
+                block[1] = None
+                block[0].close()
+        self._unref(name)
+
+    def _unref(self, name: str) -> None:
+        with self._lock:
+            block = self._blocks.get(name)
+            if block is None:
+                return
+            block[3] -= 1
+            if block[3] > 0:
+                return
+            del self._blocks[name]
+        _unlink(block[0])
+
+
+def attach(handles: Sequence[SharedImage]) -> list[NumpyImage]:
+    """Map shared images into this process
+
+    Each block is mapped once, however many of the images it holds.
+    The mappings are closed when the returned images (and all views
+    into them) have been garbage collected.
+
+    Arguments:
+        handles: Handles created by `ImageArena.handle()` in another process.
+
+    Returns:
+        The images, in the same order as `handles`.
+    """
+    buffers = {}
+    images = []
+    for handle in handles:
+        if handle.name not in buffers:
+            shm = shared_memory.SharedMemory(name=handle.name)
+            buffers[handle.name] = _map(shm)
+            weakref.finalize(buffers[handle.name].base, shm.close)
+        image = np.ndarray(
+            handle.shape,
+            dtype=np.dtype(handle.dtype),
+            buffer=buffers[handle.name],
+            offset=handle.offset,
+            strides=handle.strides,
+        )
+        images.append(image)
+    return images
+
+
+class _Mapping:
+    """Owner of a mapped shared memory block
+
+    NumPy doesn't hold on to the buffers it wraps, only to their owner,
+    so an array created directly from `SharedMemory.buf` doesn't prevent
+    the block from being unmapped. Arrays created from this object keep
+    it alive instead, and the block is unmapped (by a finalizer) when
+    the last array using it is gone.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        self.__array_interface__ = {
+            "data": (address, False),
+            "shape": (shm.size,),
+            "typestr": "|u1",
+            "version": 3,
+        }
+
+
+def _map(shm: shared_memory.SharedMemory) -> np.ndarray:
+    """Return the block as a flat uint8 array whose base is a `_Mapping`"""
+    return np.asarray(_Mapping(shm))
+
+
+def _unlink(shm: shared_memory.SharedMemory) -> None:
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,151 @@
+"""
+Columnar representation of node trees
+
+A `NodeTable` holds the structure and the most commonly queried
+attributes of one or more trees as NumPy columns, with one row per
+node. Queries such as "all leaves at the maximum depth" then become
+vectorized array operations instead of recursive tree walks.
+
+The table is a snapshot: it does not follow changes made to the trees
+after it was created. Use `ImageNode.table()` and `Collection.table()`,
+which cache the tables and rebuild them when the trees are modified.
+"""
+
+from typing import TYPE_CHECKING, Iterable, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+
+if TYPE_CHECKING:
+    from htrflow.volume.volume import ImageNode
+
+
+class NodeTable:
+    """Columnar snapshot of node trees
+
+    The nodes are stored in pre-order, tree by tree, which means that
+    the rows of a subtree are contiguous and that selecting rows with
+    a boolean mask preserves the order of `Node.traverse()`.
+
+    Attributes:
+        nodes: The nodes, one per row.
+        n_trees: Number of trees in the table.
+        tree: Index of the tree (for example the page) of each node.
+        parent: Row index of each node's parent, -1 for root nodes.
+        depth: Depth of each node.
+        n_children: Number of children of each node.
+        bbox: Bounding boxes as an (n, 4) array of (xmin, ymin, xmax,
+            ymax) rows.
+        text_score: Top text confidence score of each node, NaN for
+            nodes without text.
+    """
+
+    nodes: list["ImageNode"]
+    tree: npt.NDArray[np.int32]
+    parent: npt.NDArray[np.int32]
+    depth: npt.NDArray[np.int32]
+    n_children: npt.NDArray[np.int32]
+    bbox: npt.NDArray[np.int32]
+    text_score: npt.NDArray[np.float32]
+
+    def __init__(self, roots: Iterable["ImageNode"]):
+        """Create a table of all nodes of the given trees
+
+        Arguments:
+            roots: The root nodes of the trees.
+        """
+        roots = list(roots)
+        nodes = []
+        tree, parent = [], []
+        stack = []
+        for i, root in enumerate(roots):
+            stack.append((root, -1))
+            while stack:
+                node, parent_row = stack.pop()
+                row = len(nodes)
+                nodes.append(node)
+                tree.append(i)
+                parent.append(parent_row)
+                stack.extend((child, row) for child in reversed(node.children))
+
+        self.n_trees = len(roots)
+        self.nodes = nodes
+        self.tree = np.array(tree, dtype=np.int32)
+        self.parent = np.array(parent, dtype=np.int32)
+        self.depth = np.array([node.depth for node in nodes], dtype=np.int32)
+        self.n_children = np.array([len(node.children) for node in nodes], dtype=np.int32)
+        self.bbox = np.array([node.bbox.xyxy for node in nodes], dtype=np.int32).reshape(-1, 4)
+        self.text_score = np.array([_text_score(node) for node in nodes], dtype=np.float32)
+
+    @classmethod
+    def concatenate(cls, tables: Sequence["NodeTable"]) -> "NodeTable":
+        """Combine tables into one table
+
+        The trees of the combined table are the trees of `tables`, in
+        order. The input tables are not modified.
+        """
+        table = cls([])
+        if not tables:
+            return table
+
+        row_offsets = np.cumsum([0] + [len(t) for t in tables[:-1]])
+        tree_offsets = np.cumsum([0] + [t.n_trees for t in tables[:-1]])
+        table.n_trees = sum(t.n_trees for t in tables)
+        table.nodes = [node for t in tables for node in t.nodes]
+        table.tree = np.concatenate([t.tree + offset for t, offset in zip(tables, tree_offsets)]).astype(np.int32)
+        table.parent = np.concatenate(
+            [np.where(t.parent >= 0, t.parent + offset, -1) for t, offset in zip(tables, row_offsets)]
+        ).astype(np.int32)
+        for column in ("depth", "n_children", "bbox", "text_score"):
+            setattr(table, column, np.concatenate([getattr(t, column) for t in tables]))
+        return table
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def is_leaf(self) -> npt.NDArray[np.bool_]:
+        """Boolean column, True for leaf nodes"""
+        return self.n_children == 0
+
+    @property
+    def has_text(self) -> npt.NDArray[np.bool_]:
+        """Boolean column, True for nodes with a text result"""
+        return ~np.isnan(self.text_score)
+
+    def select(self, rows: npt.NDArray[np.bool_] | npt.NDArray[np.integer]) -> list["ImageNode"]:
+        """Return the nodes of the given rows
+
+        Arguments:
+            rows: A boolean mask or an array of row indices.
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        return [self.nodes[i] for i in rows.tolist()]
+
+    def max_depth(self) -> npt.NDArray[np.int32]:
+        """The maximum depth of each tree"""
+        max_depth = np.zeros(self.n_trees, dtype=np.int32)
+        np.maximum.at(max_depth, self.tree, self.depth)
+        return max_depth
+
+    def leaves(self) -> list["ImageNode"]:
+        """The leaf nodes, in pre-order"""
+        return self.select(self.is_leaf)
+
+    def active_leaves(self) -> list["ImageNode"]:
+        """The leaf nodes at the maximum depth of all trees
+
+        See `Collection.active_leaves()`.
+        """
+        if not len(self):
+            return []
+        return self.select(self.is_leaf & (self.depth == self.depth.max()))
+
+
+def _text_score(node: "ImageNode") -> float:
+    if text_result := node.text_result:
+        return text_result.top_score()
+    return np.nan
@@ -1,5 +1,5 @@
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
 from itertools import count
 from typing import Any, Callable, Iterable, Iterator, Sequence
 
@@ -9,6 +9,74 @@ from typing_extensions import Self
 logger = logging.getLogger(__name__)
 
 
+class _ChildList(list):
+    """The list of a node's children
+
+    A list which notifies its node when it is modified in place (e.g.
+    with `append` or `sort`), so that the node's cached results are
+    invalidated.
+    """
+
+    def __init__(self, node: "Node", children: Iterable["Node"] = ()):
+        super().__init__(children)
+        self._node = node
+
+    def __reduce__(self):
+        # Pickled as a plain list, which `Node.__setstate__` wraps again
+        return list, (list(self),)
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._node._modified()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._node._modified()
+
+    def __iadd__(self, children):
+        result = super().__iadd__(children)
+        self._node._modified()
+        return result
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._node._modified()
+        return result
+
+    def append(self, child):
+        super().append(child)
+        self._node._modified()
+
+    def extend(self, children):
+        super().extend(children)
+        self._node._modified()
+
+    def insert(self, index, child):
+        super().insert(index, child)
+        self._node._modified()
+
+    def remove(self, child):
+        super().remove(child)
+        self._node._modified()
+
+    def pop(self, index=-1):
+        result = super().pop(index)
+        self._node._modified()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._node._modified()
+
+    def sort(self, *, key=None, reverse=False):
+        super().sort(key=key, reverse=reverse)
+        self._node._modified()
+
+    def reverse(self):
+        super().reverse()
+        self._node._modified()
+
+
 class Node:
     """Node class
 
@@ -25,25 +93,84 @@ class Node:
             node. It can be seen as the actual content of the node, while
             the two former attributes define the node's position in the
             tree.
+
+    Each node has a revision number which is increased whenever the
+    node or any of its descendants is modified through the node API
+    (assigning or modifying `children`, `add_data`, `detach` or
+    `prune`). Results
+    that are expensive to compute, such as `leaves()` and `max_depth()`,
+    are cached per revision.
     """
 
     parent: Self | None
-    children: list[Self]
     data: dict[str, Any]
 
     def __init__(self, parent: Self | None = None, label: str | None = None):
         self.parent = parent
-        self.children = []
+        self._children = _ChildList(self)
+        self._revision = 0
+        self._cache = {}
         self.data = {}
         self.depth = 0 if parent is None else parent.depth + 1
 
         self._id = f"node{id(self)}"  # A unique ID to fall back on if labels are not set
         self._local_label = label  # A local label, may not be unique within the tree
         self._global_label: str | None = None  # A global label created by chaining the ancestors' local labels
+        self._label_state = None  # The relabeling settings and revision of the last relabeling of this subtree
+        self._pending_relabel = None  # Arguments of a deferred `relabel_levels` call, see `relabel_levels(lazy=True)`
+
+    @property
+    def children(self) -> list[Self]:
+        """A list of child nodes attached to this node"""
+        return self._children
+
+    @children.setter
+    def children(self, children: Iterable[Self]) -> None:
+        self._children = _ChildList(self, children)
+        self._modified()
+
+    @property
+    def revision(self) -> int:
+        """The node's revision number, see the class docstring"""
+        return self._revision
+
+    def _modified(self) -> None:
+        """Increase the revision number of this node and its ancestors"""
+        node = self
+        while node is not None:
+            node._revision += 1
+            node = node.parent
+
+    def _cached(self, key: str, func: Callable[[], Any]) -> Any:
+        """Return `func()`, cached until the next revision of this node"""
+        revision, value = self._cache.get(key, (None, None))
+        if revision != self._revision:
+            value = func()
+            self._cache[key] = (self._revision, value)
+        return value
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # Nodes pickled before the revision numbers were introduced
+        if "children" in state:
+            state["_children"] = state.pop("children")
+        state.setdefault("_revision", 0)
+        state.setdefault("_cache", {})
+        state.setdefault("_label_state", None)
+        state.setdefault("_pending_relabel", None)
+        state["_children"] = _ChildList(self, state["_children"])
+        self.__dict__.update(state)
+
+    def __getstate__(self) -> dict[str, Any]:
+        return self.__dict__ | {"_cache": {}}
 
     @property
     def label(self) -> str:
         """The node's label. May be altered with node.relabel()"""
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if root._pending_relabel is not None:
+            root._run_pending_relabel()
         return self._global_label or self._local_label or self._id
 
     def __getitem__(self, i: int | Iterable[int]):
@@ -70,6 +197,7 @@ class Node:
         sep: str = "_",
         prefix: str = "",
         _counter=None,
+        _key=None,
     ) -> None:
         """Relabel the children of this node
 
@@ -108,9 +236,16 @@ class Node:
                 function. Should always be None elsewise. It keeps
                 track of which labels exist and what numbers the next
                 labels should get.
+            _key: An optional hashable key that identifies the relabeling
+                settings. If given, subtrees that have not been modified
+                since they were last relabeled with the same key, and
+                whose root keeps its label, are not relabeled again.
         """
         if _counter is None:
             _counter = defaultdict(lambda: count(0))
+            self._pending_relabel = None
+            # Make sure that this subtree is revisited by relabelings started higher up
+            self._label_state = None
             if self._local_label:
                 prefix += self._local_label
 
@@ -119,11 +254,23 @@ class Node:
             label = label_func(child)
             unnumbered_label = long_template.format(label=label, number="X")
             number = next(_counter[unnumbered_label])
+            global_label = long_template.format(label=label, number=number)
+            state = (_key, child._revision, global_label)
+            if _key is not None and child._label_state == state:
+                # The subtree is unchanged, and so are its labels
+                continue
             child._local_label = template.format(label=label, number=number)
-            child._global_label = long_template.format(label=label, number=number)
-            child.relabel(label_func, template, sep, child._global_label, _counter)
+            child._global_label = global_label
+            child.relabel(label_func, template, sep, global_label, _counter, _key)
+            child._label_state = state
 
-    def relabel_levels(self, level_labels: list[str] | None = None, default: str = "node", **kwargs) -> None:
+    def relabel_levels(
+        self,
+        level_labels: list[str] | None = None,
+        default: str = "node",
+        lazy: bool = False,
+        **kwargs,
+    ) -> None:
         """Relabel nodes level-by-level
 
         A simple way to assign labels whenever all nodes at the same
@@ -145,12 +292,23 @@ class Node:
             default: A default label to assign whenever the tree is
                 deeper than the number of passed level_labels. Defaults
                 to "node".
+            lazy: If True, the relabeling is deferred until a label of
+                the tree is read. Defaults to False.
             **kwargs: Optional formatting keyword arguments that are
                 forwarded to node.relabel(). See node.relabel() for
                 details.
+
+        Only subtrees that have been modified since they were last
+        relabeled with the same arguments are relabeled, see the `_key`
+        argument of node.relabel().
         """
+        if lazy:
+            self._pending_relabel = (level_labels, default, kwargs)
+            return
+
+        key = ("levels", None if level_labels is None else tuple(level_labels), default, tuple(sorted(kwargs.items())))
         if level_labels is None:
-            self.relabel(lambda _: default)
+            self.relabel(lambda _: default, _key=key)
             return
 
         def label_func(node: "Node") -> str:
@@ -159,7 +317,13 @@ class Node:
                 return default
             return level_labels[depth - 1]
 
-        self.relabel(label_func, **kwargs)
+        self.relabel(label_func, **kwargs, _key=key)
+
+    def _run_pending_relabel(self) -> None:
+        """Run the relabeling deferred by `relabel_levels(lazy=True)`"""
+        level_labels, default, kwargs = self._pending_relabel
+        self._pending_relabel = None
+        self.relabel_levels(level_labels, default, **kwargs)
 
     def add_data(self, **data) -> None:
         """Add data to node
@@ -173,6 +337,7 @@ class Node:
                 the old value if the key is already present.
         """
         self.data |= data
+        self._modified()
 
     def get(self, key: str, default: Any = None) -> Any:
         """Get value from node
@@ -189,19 +354,89 @@ class Node:
 
     def leaves(self) -> Sequence[Self]:
         """Return the leaf nodes of the tree"""
-        return self.traverse(filter=lambda node: node.is_leaf())
+        return list(self._cached("leaves", lambda: self.traverse(filter=lambda node: node.is_leaf())))
 
     def traverse(self, filter: "Callable[[Node], bool] | None" = None) -> Sequence[Self]:
         """Return all nodes attached to this node, including self
 
+        The nodes are returned in pre-order. Use `preorder()` to iterate
+        over the nodes without collecting them in a list.
+
         Arguments:
             filter: An optional filtering function. If passed, only
                 nodes where `filter(node) == True` will be returned.
         """
-        nodes = [self] if (filter is None or filter(self)) else []
-        for child in self.children:
-            nodes.extend(child.traverse(filter=filter))
-        return nodes
+        return list(self.preorder(filter))
+
+    def preorder(self, filter: "Callable[[Node], bool] | None" = None) -> Iterator[Self]:
+        """Iterate over this node and its descendants in pre-order
+
+        Each node is yielded before its children. A node's children are
+        read after the node has been yielded, so the caller may reorder
+        or replace them while iterating.
+
+        Arguments:
+            filter: An optional filtering function. If passed, only
+                nodes where `filter(node) == True` will be yielded. The
+                children of filtered out nodes are still visited.
+        """
+        stack = [self]
+        pop, extend = stack.pop, stack.extend
+        if filter is None:
+            while stack:
+                node = pop()
+                yield node
+                extend(node._children[::-1])
+        else:
+            while stack:
+                node = pop()
+                if filter(node):
+                    yield node
+                extend(node._children[::-1])
+
+    def postorder(self, filter: "Callable[[Node], bool] | None" = None) -> Iterator[Self]:
+        """Iterate over this node and its descendants in post-order
+
+        Each node is yielded after all of its descendants.
+
+        Arguments:
+            filter: An optional filtering function, see `preorder()`.
+        """
+        stack = [(self, False)]
+        while stack:
+            node, children_visited = stack.pop()
+            if children_visited:
+                if filter is None or filter(node):
+                    yield node
+                continue
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+
+    def levelorder(self, filter: "Callable[[Node], bool] | None" = None) -> Iterator[Self]:
+        """Iterate over this node and its descendants level by level
+
+        All nodes at depth d are yielded before the nodes at depth d+1.
+
+        Arguments:
+            filter: An optional filtering function, see `preorder()`.
+        """
+        queue = deque([self])
+        while queue:
+            node = queue.popleft()
+            if filter is None or filter(node):
+                yield node
+            queue.extend(node.children)
+
+    def any(self, condition: "Callable[[Node], bool]") -> bool:
+        """True if this node or any of its descendants fulfils `condition`
+
+        Stops at the first match.
+        """
+        return self.first(condition) is not None
+
+    def first(self, condition: "Callable[[Node], bool]") -> Self | None:
+        """The first node in pre-order that fulfils `condition`, or None"""
+        return next(self.preorder(condition), None)
 
     def tree2str(self, sep: str = "", is_last: bool = True) -> str:
         """Return a string representation of this node and its decendents"""
@@ -232,6 +467,7 @@ class Node:
             siblings = self.parent.children
             self.parent.children = [child for child in siblings if child != self]
         self.parent = None
+        self._modified()
 
     def prune(self, condition: Callable[["Node"], bool], include_starting_node: bool = True) -> None:
         """Prune the tree
@@ -251,7 +487,8 @@ class Node:
         Example: To remove all nodes at depth 2, use
             node.prune(lambda node: node.depth == 2)
         """
-        nodes = self.traverse(filter=condition)
+        # Collect the nodes before detaching them, since detaching modifies the tree
+        nodes = list(self.preorder(condition))
         for node in nodes:
             if not include_starting_node and node == self:
                 continue
@@ -267,7 +504,7 @@ class Node:
 
     def max_depth(self) -> int:
         """Return the max depth of the tree starting at this node"""
-        return max(node.depth for node in self.leaves())
+        return self._cached("max_depth", lambda: max(node.depth for node in self.leaves()))
 
     def is_root(self) -> bool:
         """True if this node is a root node"""
@@ -0,0 +1,469 @@
+"""
+Binary collection snapshots
+
+A snapshot is a directory that stores a collection in a versioned,
+columnar format:
+
+    <snapshot>/
+        manifest.json       Format version, collection label and one
+                            entry per page (image path, shape, rows)
+        nodes/*.npy         One array per node attribute (tree structure,
+                            geometry, labels, texts and scores), with one
+                            row per node in pre-order, page by page
+        nodes/masks.bin     Bit-packed masks, see `geometry.PackedMask`
+        nodes/data.bin      Any remaining node data, pickled per page
+        images/<i>.npy      Pixel data of page i, if saved
+
+All arrays are memory-mapped when the snapshot is opened, which means
+that opening a snapshot only reads its manifest. A page's tree is built
+from the arrays when the page is requested, and page images are
+memory-mapped instead of decoded. Example:
+
+```python
+from htrflow.volume.snapshot import Snapshot
+
+Snapshot.write(collection, "run.snapshot")
+snapshot = Snapshot("run.snapshot")
+page = snapshot.page(12)  # Only reads the rows of page 12
+```
+"""
+
+import json
+import logging
+import os
+import pickle
+import shutil
+from typing import Any, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from htrflow.results import TEXT_RESULT_KEY, RecognizedText, Segment
+from htrflow.utils.geometry import Bbox, PackedMask, Point, Polygon
+from htrflow.volume.node import Node
+from htrflow.volume.volume import Collection, ImageNode, PageNode, SegmentNode
+
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "htrflow-snapshot"
+VERSION = 3
+
+# Codes of the segment_class_label_type column. The class labels are
+# stored as strings, and converted back to their original type on load.
+_NO_CLASS_LABEL, _STR_CLASS_LABEL, _INT_CLASS_LABEL = 0, 1, 2
+
+
+class SnapshotError(RuntimeError):
+    pass
+
+
+class Snapshot:
+    """A collection snapshot opened for reading
+
+    Attributes:
+        path: Path to the snapshot directory.
+        label: Label of the snapshotted collection.
+        label_format: Label format of the snapshotted collection.
+    """
+
+    def __init__(self, path: str):
+        """Open a snapshot
+
+        Only the manifest is read here. The node arrays are
+        memory-mapped when first needed.
+
+        Arguments:
+            path: Path to a snapshot directory created by `Snapshot.write`.
+
+        Raises:
+            SnapshotError: If `path` is not a snapshot, or if it was
+                written with an unsupported format version.
+        """
+        manifest_path = os.path.join(path, "manifest.json")
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise SnapshotError(f"Could not read a snapshot manifest from {manifest_path}: {e}") from e
+
+        if manifest.get("format") != FORMAT:
+            raise SnapshotError(f"{path} is not an htrflow snapshot")
+        if manifest.get("version") != VERSION:
+            raise SnapshotError(
+                f"Unsupported snapshot version {manifest.get('version')} in {path} (supported: {VERSION})"
+            )
+
+        self.path = path
+        self.label = manifest["label"]
+        self.label_format = manifest["label_format"]
+        self._pages = manifest["pages"]
+        self._columns: dict[str, npt.NDArray] = {}
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def _column(self, name: str) -> npt.NDArray:
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, "nodes", f"{name}.npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def page(self, index: int) -> PageNode:
+        """Build the tree of page `index`
+
+        Only the rows of the given page are read from the snapshot.
+        """
+        entry = self._pages[index]
+        start, end = entry["rows"]
+        rows = _Rows(self, start, end)
+
+        data_start, data_end = entry["data"]
+        with open(os.path.join(self.path, "nodes", "data.bin"), "rb") as f:
+            f.seek(data_start)
+            extra_data = pickle.loads(f.read(data_end - data_start))
+
+        nodes: list[ImageNode] = []
+        for i in range(end - start):
+            parent = nodes[rows.parent[i]] if rows.parent[i] >= 0 else None
+            node_data, segment_data = extra_data[i]
+            if parent is None:
+                node = _restore_page(entry, rows, i)
+            else:
+                node = _restore_segment_node(parent, rows, i, segment_data)
+                parent._children.append(node)
+            node.data = {key: node.data.get(key, value) for key, value in node_data.items()}
+            nodes.append(node)
+
+        page = nodes[0]
+        if entry["image"] is not None:
+            page._image = np.load(os.path.join(self.path, entry["image"]), mmap_mode="r")
+        return page
+
+    def pages(self, indices: Sequence[int] | None = None) -> list[PageNode]:
+        """Build the trees of the given pages (all pages by default)"""
+        indices = range(len(self)) if indices is None else indices
+        return [self.page(i) for i in indices]
+
+    def collection(self, pages: Sequence[int] | None = None) -> Collection:
+        """Build a collection of the given pages (all pages by default)"""
+        collection = Collection.from_pages(self.pages(pages), self.label, self.label_format)
+        logger.info(
+            "Loaded %d pages of collection '%s' from snapshot %s", len(collection.pages), self.label, self.path
+        )
+        return collection
+
+    @staticmethod
+    def write(collection: Collection, path: str, images: bool = True) -> str:
+        """Write a snapshot of `collection` to `path`
+
+        The snapshot is first written to a temporary directory next to
+        `path`, which then replaces `path`. An interrupted write thus
+        never leaves a partial snapshot behind.
+
+        Arguments:
+            collection: The collection to snapshot.
+            path: Path of the snapshot directory.
+            images: Whether to save the pixel data of pages whose image
+                is loaded. Pages without saved pixel data read their
+                image from the original image file when needed.
+
+        Returns:
+            The path to the snapshot.
+        """
+        path = os.path.normpath(path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(os.path.join(tmp_path, "nodes"))
+        try:
+            _write(collection, tmp_path, images)
+            if os.path.exists(path):
+                old_path = f"{path}.{os.getpid()}.old"
+                os.replace(path, old_path)
+                os.replace(tmp_path, path)
+                shutil.rmtree(old_path)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        logger.info("Wrote snapshot of collection '%s' to %s", collection.label, path)
+        return path
+
+
+class _Rows:
+    """The rows of one page
+
+    Each column is read once per page, when first used, and converted
+    to Python objects to make the per-node access cheap.
+    """
+
+    def __init__(self, snapshot: Snapshot, start: int, end: int):
+        self._snapshot = snapshot
+        self._start = start
+        self._end = end
+        self._ragged: dict[str, npt.NDArray] = {}
+        self._masks: bytes | None = None
+
+    def __getattr__(self, name: str) -> list:
+        column = self._snapshot._column(name)
+        end = self._end + 1 if name.endswith("_offsets") else self._end
+        rows = np.asarray(column[self._start : end]).tolist()
+        setattr(self, name, rows)
+        return rows
+
+    def ragged(self, name: str, i: int, offsets: str | None = None) -> npt.NDArray:
+        """Row `i` of the ragged column `name`, using the offsets of column `offsets` (default `name`)"""
+        offsets = getattr(self, f"{offsets or name}_offsets")
+        if name not in self._ragged:
+            self._ragged[name] = np.asarray(self._snapshot._column(name)[offsets[0] : offsets[-1]])
+        return self._ragged[name][offsets[i] - offsets[0] : offsets[i + 1] - offsets[0]]
+
+    def mask(self, i: int) -> PackedMask | None:
+        height, width = self.mask_shape[i]
+        if height < 0:
+            return None
+        offsets = self.mask_offsets
+        if self._masks is None:
+            with open(os.path.join(self._snapshot.path, "nodes", "masks.bin"), "rb") as f:
+                f.seek(offsets[0])
+                self._masks = f.read(offsets[-1] - offsets[0])
+        mask = PackedMask.__new__(PackedMask)
+        mask.shape = (height, width)
+        mask.value = self.mask_value[i]
+        mask.bits = np.frombuffer(
+            self._masks, dtype=np.uint8, count=offsets[i + 1] - offsets[i], offset=offsets[i] - offsets[0]
+        )
+        return mask
+
+
+def _restore_node(node: ImageNode, parent: ImageNode | None, rows: _Rows, i: int) -> None:
+    """Set the attributes shared by all image nodes"""
+    Node.__init__(node, parent)
+    x1, y1, x2, y2 = rows.bbox[i]
+    node.height = y2 - y1
+    node.width = x2 - x1
+    node.coord = Point(x1, y1)
+    node.bbox = Bbox(x1, y1, x2, y2)
+    node.polygon = Polygon(rows.ragged("polygon", i))
+    node._image = None
+    node._mask = None
+    node._local_label = rows.local_label[i] or None
+    node._global_label = rows.global_label[i] or None
+
+    if rows.text_offsets[i + 1] > rows.text_offsets[i]:
+        texts = rows.ragged("text", i).tolist()
+        scores = rows.ragged("text_score", i, offsets="text").tolist()
+        node.data[TEXT_RESULT_KEY] = RecognizedText(texts, scores)
+
+
+def _restore_page(entry: dict[str, Any], rows: _Rows, i: int) -> PageNode:
+    page = PageNode.__new__(PageNode)
+    page.path = entry["path"]
+    page.original_shape = tuple(entry["original_shape"])
+    page.ratio = entry["ratio"]
+    page._pyramid = None
+    _restore_node(page, None, rows, i)
+    page._mask = rows.mask(i)
+    return page
+
+
+def _restore_segment_node(parent: ImageNode, rows: _Rows, i: int, segment_data: dict[str, Any]) -> SegmentNode:
+    segment = Segment.__new__(Segment)
+    segment.bbox = Bbox(*rows.segment_bbox[i])
+    segment.polygon = Polygon(rows.ragged("segment_polygon", i)) if rows.segment_has_polygon[i] else None
+    segment._mask = rows.mask(i)
+    segment._mask_from_polygon = rows.mask_from_polygon[i]
+    score = rows.segment_score[i]
+    segment.score = None if np.isnan(score) else score
+    segment.class_label = _restore_class_label(rows.segment_class_label[i], rows.segment_class_label_type[i])
+    height, width = rows.segment_orig_shape[i]
+    segment.orig_shape = None if height < 0 else (height, width)
+    segment.data = segment_data
+
+    node = SegmentNode.__new__(SegmentNode)
+    node.segment = segment
+    _restore_node(node, parent, rows, i)
+    node.data["segment"] = segment
+    return node
+
+
+def _write(collection: Collection, path: str, images: bool) -> None:
+    columns: dict[str, list] = {
+        name: []
+        for name in (
+            "parent",
+            "bbox",
+            "local_label",
+            "global_label",
+            "polygon",
+            "text",
+            "text_score",
+            "segment_bbox",
+            "segment_polygon",
+            "segment_has_polygon",
+            "segment_score",
+            "segment_class_label",
+            "segment_class_label_type",
+            "segment_orig_shape",
+            "mask_shape",
+            "mask_value",
+            "mask_from_polygon",
+        )
+    }
+    offsets: dict[str, list[int]] = {name: [0] for name in ("polygon", "text", "segment_polygon", "mask")}
+
+    pages = []
+    with (
+        open(os.path.join(path, "nodes", "masks.bin"), "wb") as masks,
+        open(os.path.join(path, "nodes", "data.bin"), "wb") as data,
+    ):
+        for page_index, page in enumerate(collection):
+            start = len(columns["parent"])
+            if page._pending_relabel is not None:
+                # The labels are read directly below, so run any deferred relabeling first
+                page._run_pending_relabel()
+            nodes = page.traverse()
+            rows = {node: row for row, node in enumerate(nodes)}
+            extra_data = []
+            for node in nodes:
+                _append_node(node, rows, columns, offsets, masks)
+                segment = getattr(node, "segment", None)
+                # Values stored in the columns are replaced by None here, but their
+                # keys are kept to restore the data in its original order
+                node_data = {k: None if k in ("segment", TEXT_RESULT_KEY) else v for k, v in node.data.items()}
+                extra_data.append((node_data, segment.data if segment is not None else {}))
+
+            data_start = data.tell()
+            pickle.dump(extra_data, data)
+
+            image = None
+            if images and page._image is not None:
+                image = os.path.join("images", f"{page_index}.npy")
+                os.makedirs(os.path.join(path, "images"), exist_ok=True)
+                np.save(os.path.join(path, image), page._image)
+
+            pages.append(
+                {
+                    "path": page.path,
+                    "original_shape": list(page.original_shape),
+                    "ratio": page.ratio,
+                    "rows": [start, len(columns["parent"])],
+                    "data": [data_start, data.tell()],
+                    "image": image,
+                }
+            )
+
+    for name in ("polygon", "segment_polygon"):
+        points = columns[name]
+        columns[name] = np.concatenate(points) if points else np.zeros((0, 2), dtype=np.int32)
+
+    dtypes = {
+        "parent": np.int32,
+        "bbox": np.int32,
+        "polygon": np.int32,
+        "text_score": np.float64,
+        "segment_bbox": np.int32,
+        "segment_polygon": np.int32,
+        "segment_has_polygon": bool,
+        "segment_score": np.float64,
+        "segment_class_label_type": np.uint8,
+        "segment_orig_shape": np.int32,
+        "mask_shape": np.int32,
+        "mask_value": np.uint8,
+        "mask_from_polygon": bool,
+    }
+    for name, values in columns.items():
+        array = np.asarray(values, dtype=dtypes.get(name, str))
+        if name in ("bbox", "segment_bbox"):
+            array = array.reshape(-1, 4)
+        elif name in ("segment_orig_shape", "mask_shape"):
+            array = array.reshape(-1, 2)
+        np.save(os.path.join(path, "nodes", f"{name}.npy"), array)
+    for name, values in offsets.items():
+        np.save(os.path.join(path, "nodes", f"{name}_offsets.npy"), np.asarray(values, dtype=np.int64))
+
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "label": collection.label,
+        "label_format": collection._label_format,
+        "pages": pages,
+    }
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def _append_node(
+    node: ImageNode,
+    rows: dict[ImageNode, int],
+    columns: dict[str, list],
+    offsets: dict[str, list[int]],
+    masks,
+) -> None:
+    """Append the columns of `node`"""
+    columns["parent"].append(rows[node.parent] if node.parent is not None else -1)
+    columns["bbox"].append(node.bbox.xyxy)
+    columns["local_label"].append(node._local_label or "")
+    columns["global_label"].append(node._global_label or "")
+    _append_ragged(node.polygon.as_nparray(), "polygon", columns, offsets)
+
+    text_result = node.text_result
+    columns["text"] += text_result.texts if text_result else []
+    columns["text_score"] += text_result.scores if text_result else []
+    offsets["text"].append(len(columns["text"]))
+
+    segment = getattr(node, "segment", None)
+    if segment is None:
+        packed, from_polygon = node._mask, False
+        columns["segment_bbox"].append((0, 0, 0, 0))
+        columns["segment_has_polygon"].append(False)
+        columns["segment_score"].append(np.nan)
+        columns["segment_class_label"].append("")
+        columns["segment_class_label_type"].append(_NO_CLASS_LABEL)
+        columns["segment_orig_shape"].append((-1, -1))
+        _append_ragged(None, "segment_polygon", columns, offsets)
+    else:
+        packed, from_polygon = segment._mask, segment._mask_from_polygon
+        columns["segment_bbox"].append(segment.bbox.xyxy)
+        columns["segment_has_polygon"].append(segment.polygon is not None)
+        columns["segment_score"].append(np.nan if segment.score is None else segment.score)
+        columns["segment_class_label"].append("" if segment.class_label is None else str(segment.class_label))
+        columns["segment_class_label_type"].append(_class_label_type(segment.class_label))
+        columns["segment_orig_shape"].append((-1, -1) if segment.orig_shape is None else tuple(segment.orig_shape))
+        _append_ragged(
+            None if segment.polygon is None else segment.polygon.as_nparray(), "segment_polygon", columns, offsets
+        )
+
+    columns["mask_from_polygon"].append(from_polygon)
+    if packed is None:
+        columns["mask_shape"].append((-1, -1))
+        columns["mask_value"].append(0)
+    else:
+        columns["mask_shape"].append(tuple(packed.shape))
+        columns["mask_value"].append(packed.value)
+        masks.write(packed.bits.tobytes())
+    offsets["mask"].append(masks.tell())
+
+
+def _class_label_type(class_label: Any) -> int:
+    if class_label is None:
+        return _NO_CLASS_LABEL
+    if isinstance(class_label, (int, np.integer)) and not isinstance(class_label, bool):
+        return _INT_CLASS_LABEL
+    return _STR_CLASS_LABEL
+
+
+def _restore_class_label(class_label: str, label_type: int) -> str | int | None:
+    if label_type == _NO_CLASS_LABEL:
+        return None
+    if label_type == _INT_CLASS_LABEL:
+        return int(class_label)
+    return class_label
+
+
+def _append_ragged(
+    points: npt.NDArray[np.int32] | None, name: str, columns: dict[str, list], offsets: dict[str, list[int]]
+) -> None:
+    if points is not None:
+        columns[name].append(points.reshape(-1, 2))
+    offsets[name].append(offsets[name][-1] + (0 if points is None else len(points)))
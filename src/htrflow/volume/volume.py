@@ -6,18 +6,26 @@ import logging
 import os
 import pickle
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from itertools import chain
-from typing import Generator, Iterable, Iterator, Sequence
+from typing import TYPE_CHECKING, Any, Generator, Iterable, Iterator, Sequence
 
 import numpy as np
 
 from htrflow import serialization
 from htrflow.results import TEXT_RESULT_KEY, RecognizedText, Result, Segment
 from htrflow.utils import imgproc
-from htrflow.utils.geometry import Bbox, Mask, Point, Polygon, mask2polygon
+from htrflow.utils.geometry import Bbox, Mask, PackedMask, Point, Polygon, mask2polygon
+from htrflow.volume.columnar import NodeTable
 from htrflow.volume.node import Node
 
 
+if TYPE_CHECKING:
+    from htrflow.utils.shared_memory import ImageArena
+
+
 logger = logging.getLogger(__name__)
 
 
@@ -40,7 +48,7 @@ class ImageNode(Node, ABC):
         self.width = width
         self.coord = coord
         self.bbox = Bbox(0, 0, width, height).move(coord)
-        self.mask = mask
+        self._mask = None if mask is None else PackedMask(mask)
         self.polygon = self._compute_polygon(polygon)
         self._image = None
 
@@ -65,7 +73,7 @@ class ImageNode(Node, ABC):
         return s
 
     def clear_images(self):
-        for node in self.traverse():
+        for node in self.preorder():
             del node._image
             node._image = None
 
@@ -84,13 +92,37 @@ class ImageNode(Node, ABC):
         self.coord = self.coord.rescale(ratio)
         self.bbox = self.bbox.rescale(ratio)
         self.polygon = self.polygon.rescale(ratio)
-        if self.mask is not None:
-            self.mask = imgproc.rescale_linear(self.mask, ratio)
+        self._rescale_mask(ratio)
+        self._modified()
         if self._image is not None:
-            self._image = imgproc.rescale_linear(self._image, ratio)
+            self._image = imgproc.rescale_cached(self._image, ratio)
         for node in self.children:
             node.rescale(ratio)
 
+    @property
+    def mask(self) -> Mask | None:
+        """The node's mask relative to its bounding box, if available
+
+        The mask is stored bit-packed, see `geometry.PackedMask`.
+        """
+        return None if self._mask is None else self._mask.unpack()
+
+    @mask.setter
+    def mask(self, mask: Mask | None) -> None:
+        self._mask = None if mask is None else PackedMask(mask)
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # Nodes pickled before the masks were bit-packed
+        if "mask" in state:
+            mask = state.pop("mask")
+            state["_mask"] = None if mask is None else PackedMask(mask)
+        super().__setstate__(state)
+
+    def _rescale_mask(self, ratio: float) -> None:
+        mask = self.mask
+        if mask is not None:
+            self.mask = imgproc.rescale_linear(mask, ratio)
+
     @property
     def image(self):
         """The image this node represents"""
@@ -128,14 +160,10 @@ class ImageNode(Node, ABC):
     def create_segments(self, segments: Sequence[Segment]) -> None:
         """Segment this node"""
         self.children = [SegmentNode(segment, self) for segment in segments]
-        del self._image
-        self._image = None
 
     def contains_text(self) -> bool:
         """Return True if this"""
-        if self.text is not None:
-            return True
-        return any(child.contains_text() for child in self.children)
+        return self.any(lambda node: node.text is not None)
 
     def has_regions(self) -> bool:
         return all(child.text is None for child in self.children)
@@ -143,29 +171,93 @@ class ImageNode(Node, ABC):
     def segments(self) -> "ImageGenerator":
         return ImageGenerator(self.leaves())
 
+    def table(self) -> NodeTable:
+        """A columnar snapshot of the tree starting at this node
+
+        See `columnar.NodeTable`. The table is cached until the tree is
+        modified (see `Node.revision`).
+        """
+        return self._cached("table", lambda: NodeTable([self]))
+
     def is_region(self) -> bool:
         return bool(self.children) and not self.text
 
 
 class SegmentNode(ImageNode):
-    """A node representing a segment of a page"""
+    """A node representing a segment of a page
+
+    The segment's image is not stored in the node. Instead, it is
+    created on demand as a view into the image of the closest ancestor
+    that holds pixel data (typically the page), which means that no
+    pixel data is copied. If the segment, or any of its ancestors
+    between it and the image source, has a mask, the mask is applied
+    when the image is requested. Masked images are copies, which are
+    cached in the node until its mask changes or `clear_images()` is
+    called.
+    """
 
     segment: Segment
     parent: ImageNode
 
     def __init__(self, segment: Segment, parent: ImageNode):
         bbox = segment.bbox.move(parent.coord)
-        super().__init__(bbox.height, bbox.width, bbox.p1, segment.polygon, segment.mask, parent)
-        self.add_data(segment=segment, **segment.data)
         self.segment = segment
-        self._image = self._generate_image()
+        super().__init__(bbox.height, bbox.width, bbox.p1, segment.polygon, None, parent)
+        self.add_data(segment=segment, **segment.data)
+
+    @property
+    def mask(self) -> Mask | None:
+        """The segment's mask relative to its bounding box, if available
+
+        The mask is shared with (and stored by) the node's segment, so
+        masks computed lazily from the segment's polygon are only
+        computed when needed.
+        """
+        return self.segment.mask
+
+    @mask.setter
+    def mask(self, mask: Mask | None) -> None:
+        self.segment.mask = mask
+        # Cached images of this node and its descendants are masked with the old mask
+        self.clear_images()
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # Nodes pickled before the masks were bit-packed held a copy of
+        # the segment's mask, which is now read from the segment
+        if "mask" in state:
+            state["mask"] = None
+        super().__setstate__(state)
+
+    def _rescale_mask(self, ratio: float) -> None:
+        # The segment's mask is rescaled by `Segment.rescale`
+        pass
+
+    @property
+    def image(self):
+        """The image this node represents"""
+        if self._image is not None:
+            return self._image
+        return self._generate_image()
 
     def _generate_image(self):
-        bbox = self.segment.bbox
-        mask = self.segment.mask
-        img = imgproc.crop(self.parent.image, bbox)
+        source = self.parent
+        while isinstance(source, SegmentNode) and source._image is None:
+            source = source.parent
+
+        img = imgproc.crop(source.image, self.bbox.move((-source.coord.x, -source.coord.y)), copy=False)
+
+        # Combine the masks of this node and of the ancestors below `source`
+        mask = None
+        node = self
+        while node is not source:
+            if node.mask is not None:
+                node_mask = imgproc.crop(node.mask, self.bbox.move((-node.coord.x, -node.coord.y)), copy=False)
+                mask = node_mask != 0 if mask is None else mask & (node_mask != 0)
+            node = node.parent
+
         if mask is not None:
             img = imgproc.mask(img, mask)
+            self._image = img
         return img
 
     def rescale(self, ratio):
@@ -179,10 +271,10 @@ class PageNode(ImageNode):
     def __init__(self, image_path: str):
         self.path = image_path
         label = os.path.splitext(os.path.basename(image_path))[0]
-        image = imgproc.read(self.path)
-        self.original_shape = image.shape[:2]
+        self.original_shape = imgproc.read_shape(self.path)
         self.ratio = 1
         height, width = self.original_shape
+        self._pyramid = None
         super().__init__(height, width, label=label)
 
         self.add_data(
@@ -214,6 +306,52 @@ class PageNode(ImageNode):
         """Restore the page's orginal size"""
         self.set_size(self.original_shape)
 
+    def share_image(self, arena: "ImageArena") -> None:
+        """Move the page image to shared memory
+
+        The image is copied to `arena` and replaces the page's private
+        copy. The segment images are views into the page image, so they
+        can then be passed to other processes without copying any pixel
+        data (see `<utils.shared_memory.ImageArena>`). The shared memory
+        is freed when the image is dropped, for example by
+        `clear_images()`.
+
+        Arguments:
+            arena: The arena to place the image in.
+        """
+        if self.image not in arena:
+            self._image = arena.share(self.image)
+            self._pyramid = None
+
+    @property
+    def pyramid(self) -> imgproc.ImagePyramid:
+        """Grayscale and downscaled versions of the page image
+
+        The pyramid is created on first access and shared by all steps
+        that need a derived version of the page image, for example the
+        layout heuristics and scaled model inference. It is dropped
+        when the page image changes.
+        """
+        if self._pyramid is None or self._pyramid.image is not self.image:
+            self._pyramid = imgproc.ImagePyramid(self.image)
+        return self._pyramid
+
+    def rescale(self, ratio: float):
+        super().rescale(ratio)
+        self._pyramid = None
+
+    def clear_images(self):
+        self._pyramid = None
+        super().clear_images()
+
+    def __getstate__(self):
+        # The pyramid is rebuilt on demand
+        return super().__getstate__() | {"_pyramid": None}
+
+    def __setstate__(self, state):
+        state.setdefault("_pyramid", None)
+        super().__setstate__(state)
+
     def _generate_image(self):
         ratio = self.width / self.original_shape[1]
         return imgproc.rescale_linear(imgproc.read(self.path), ratio)
@@ -269,8 +407,17 @@ class Collection:
         for page in self:
             page.set_size(size)
 
+    def share_images(self, arena: "ImageArena") -> None:
+        """Move the page images to shared memory, see `PageNode.share_image()`
+
+        Arguments:
+            arena: The arena to place the images in.
+        """
+        for page in self:
+            page.share_image(arena)
+
     def traverse(self, filter):
-        return chain(*[page.traverse(filter) for page in self])
+        return chain.from_iterable(page.preorder(filter) for page in self)
 
     @classmethod
     def from_directory(cls, path: str) -> "Collection":
@@ -284,6 +431,31 @@ class Collection:
         paths = [os.path.join(path, file) for file in sorted(os.listdir(path))]
         return cls(paths)
 
+    @classmethod
+    def from_pages(
+        cls,
+        pages: Sequence[PageNode],
+        label: str | None = None,
+        label_format: dict[str, str] | None = None,
+    ) -> "Collection":
+        """Initialize a collection from already existing pages
+
+        The pages are not copied, which means that any changes made to
+        the new collection's pages are reflected in the original pages.
+
+        Arguments:
+            pages: A sequence of PageNode instances.
+            label: An optional label describing the collection. Defaults
+                to "untitled_collection".
+            label_format: What label format that should be used with this
+                collection. See `Collection.__init__()` for details.
+        """
+        collection = cls.__new__(cls)
+        collection.pages = list(pages)
+        collection.label = label or Collection._DEFAULT_LABEL
+        collection._label_format = label_format or {}
+        return collection
+
     @classmethod
     def from_pickle(cls, path: str) -> "Collection":
         """Initialize a collection from a pickle file
@@ -300,6 +472,39 @@ class Collection:
         logger.info("Loaded collection '%s' from %s", collection.label, path)
         return collection
 
+    @classmethod
+    def from_snapshot(cls, path: str, pages: Sequence[int] | None = None) -> "Collection":
+        """Initialize a collection from a snapshot
+
+        See `snapshot.Snapshot` for details on the snapshot format.
+
+        Arguments:
+            path: A path to a snapshot directory written by `Collection.save_snapshot()`.
+            pages: Indices of the pages to load. Only the data of these
+                pages is read from the snapshot. Defaults to all pages.
+        """
+        from htrflow.volume.snapshot import Snapshot
+
+        return Snapshot(path).collection(pages)
+
+    def save_snapshot(self, path: str, images: bool = True) -> str:
+        """Save the collection as a snapshot
+
+        A snapshot stores the collection in a columnar, memory-mappable
+        format that is much faster to load than a pickle. See
+        `snapshot.Snapshot` for details.
+
+        Arguments:
+            path: Path of the snapshot directory.
+            images: Whether to save the pixel data of loaded page images.
+
+        Returns:
+            The path to the snapshot.
+        """
+        from htrflow.volume.snapshot import Snapshot
+
+        return Snapshot.write(self, path, images)
+
     def __str__(self):
         return f"collection label: {self.label}\ncollection tree:\n" + "\n".join(child.tree2str() for child in self)
 
@@ -311,8 +516,27 @@ class Collection:
         """Yield the active segments' images"""
         return ImageGenerator(self.active_leaves())
 
+    def table(self) -> NodeTable:
+        """A columnar snapshot of the collection's trees
+
+        See `columnar.NodeTable`. The table is cached, and is rebuilt
+        only when a page has been added, removed or modified since the
+        last call (see `Node.revision`).
+        """
+        key = [(page, page.revision) for page in self.pages]
+        cached = getattr(self, "_table", None)
+        if cached is None or cached[0] != key:
+            # Only the tables of modified pages are rebuilt
+            cached = (key, NodeTable.concatenate([page.table() for page in self.pages]))
+            self._table = cached
+        return cached[1]
+
+    def __getstate__(self):
+        # The cached table is rebuilt on demand
+        return {key: value for key, value in self.__dict__.items() if key != "_table"}
+
     def leaves(self) -> Iterator[ImageNode]:
-        yield from chain(*[page.leaves() for page in self])
+        yield from self.table().leaves()
 
     def active_leaves(self) -> Generator[ImageNode, None, None]:
         """Yield the collection's active leaves
@@ -325,11 +549,7 @@ class Collection:
         other leaves. These should typically not updated in the next
         steps.
         """
-        if self.pages:
-            max_depth = max(page.max_depth() for page in self)
-            for leaf in self.leaves():
-                if leaf.depth == max_depth:
-                    yield leaf
+        yield from self.table().active_leaves()
 
     def update(self, results: list[Result]) -> None:
         """Update the collection with model results
@@ -365,8 +585,14 @@ class Collection:
         self._label_format = kwargs
 
     def relabel(self):
+        """Relabel the collection's pages
+
+        The relabeling is lazy: a page is relabeled when one of its labels
+        is next read, and only the parts of the page that have changed
+        since its last relabeling are relabeled.
+        """
         for page in self:
-            page.relabel_levels(**self._label_format)
+            page.relabel_levels(**self._label_format, lazy=True)
 
 
 class ImageGenerator:
@@ -386,9 +612,16 @@ class ImageGenerator:
         for _node in self._nodes:
             yield _node.image
 
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self._nodes[idx].image
+
     def __len__(self) -> int:
         return len(self._nodes)
 
+    def shapes(self) -> list[tuple[int, int]]:
+        """The (height, width) shapes of the images, without loading them"""
+        return [(node.height, node.width) for node in self._nodes]
+
 
 def paths2pages(paths: Sequence[str]) -> list[PageNode]:
     """Create PageNodes
@@ -413,6 +646,87 @@ def paths2pages(paths: Sequence[str]) -> list[PageNode]:
     return pages
 
 
+def prefetch_images(
+    collections: Iterable[Collection],
+    max_workers: int = 2,
+    max_bytes: int = 2**30,
+) -> Generator[Collection, None, None]:
+    """Decode the collections' page images in the background
+
+    Wraps an iterable of collections (for example the output of
+    `steps.auto_import`) and decodes the images of upcoming pages on
+    a thread pool while the current collection is being processed.
+    Each collection is yielded once all of its images are loaded.
+
+    Arguments:
+        collections: The input collections.
+        max_workers: Number of decoding threads.
+        max_bytes: Memory budget for prefetched images, in bytes. No
+            more collections are prefetched once the estimated size of
+            the decoded, not yet yielded, images exceeds this budget.
+            At least one collection is always prefetched.
+
+    Yields:
+        The input collections, in the same order, with their page
+        images loaded.
+    """
+    collections = iter(collections)
+    pending = deque()
+    buffered = 0
+    exhausted = False
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="htrflow-prefetch") as executor:
+        while True:
+            while not exhausted and (not pending or buffered < max_bytes):
+                collection = next(collections, None)
+                if collection is None:
+                    exhausted = True
+                    break
+                n_bytes = sum(page.height * page.width * 3 for page in collection)
+                futures = [executor.submit(_load_image, page) for page in collection]
+                pending.append((collection, futures, n_bytes))
+                buffered += n_bytes
+
+            if not pending:
+                return
+
+            collection, futures, n_bytes = pending.popleft()
+            for future in futures:
+                future.result()
+            buffered -= n_bytes
+            yield collection
+
+
+@contextmanager
+def without_images(page: PageNode) -> Iterator[None]:
+    """Temporarily detach all cached images from the tree starting at `page`
+
+    Used to pickle pages without their pixel data, which can be
+    regenerated from the page's image file.
+    """
+    nodes = page.traverse()
+    images = [node._image for node in nodes]
+    for node in nodes:
+        node._image = None
+    try:
+        yield
+    finally:
+        for node, image in zip(nodes, images):
+            node._image = image
+
+
+def _load_image(page: PageNode) -> None:
+    """Load the image of `page`
+
+    Errors are only logged here. The page's image is then left unloaded,
+    which means that the error is raised again when the image is accessed
+    from the main thread.
+    """
+    try:
+        page.image
+    except Exception as e:
+        logger.warning("Could not prefetch image of page %s: %s", page.label, e)
+
+
 def _common_basename(paths: Sequence[str]):
     """Given a sequence of paths, returns the name of their first shared parent directory"""
     if len(paths) > 1:
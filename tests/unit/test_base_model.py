@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from htrflow.models.base_model import BaseModel, plan_batches
+from htrflow.models.cache import ResultCache
+from htrflow.results import Result
+
+
+class DummyModel(BaseModel):
+    """Model which returns the width of each input image as text"""
+
+    def __init__(self):
+        super().__init__(device="cpu")
+        self.batches = []
+
+    def _predict(self, images, **kwargs):
+        self.batches.append([image.shape[1] for image in images])
+        return [Result.text_recognition_result({}, [str(image.shape[1])], [1.0]) for image in images]
+
+
+class LinearModel(BaseModel):
+    """Model which returns the output dtype of a linear layer as text"""
+
+    def __init__(self, **kwargs):
+        super().__init__(device="cpu", **kwargs)
+        self.model = self._apply_precision(torch.nn.Sequential(torch.nn.Linear(3, 2)))
+
+    def _predict(self, images, **kwargs):
+        with torch.no_grad():
+            outputs = self.model(torch.ones(len(images), 3))
+        return [Result.text_recognition_result(self.metadata, [str(outputs.dtype)], [1.0]) for _ in images]
+
+
+@pytest.fixture
+def images():
+    widths = [50, 400, 60, 390, 55, 410, 70, 380]
+    return [np.zeros((20, width, 3), dtype=np.uint8) for width in widths]
+
+
+def texts(results):
+    return [result.data["text_result"].top_candidate() for result in results]
+
+
+@pytest.mark.parametrize("batch_order", ["input", "width", "aspect_ratio"])
+def test_predict_keeps_input_order(images, batch_order):
+    model = DummyModel()
+    results = model.predict(images, batch_size=3, batch_order=batch_order)
+    assert texts(results) == [str(image.shape[1]) for image in images]
+
+
+def test_predict_sorted_batches(images):
+    model = DummyModel()
+    model.predict(images, batch_size=4, batch_order="width")
+    assert model.batches == [[50, 55, 60, 70], [380, 390, 400, 410]]
+
+
+def test_predict_pixel_budget(images):
+    model = DummyModel()
+    results = model.predict(images, batch_size=8, batch_order="width", max_batch_pixels=20 * 500 * 2)
+    assert texts(results) == [str(image.shape[1]) for image in images]
+    assert all(len(batch) * 20 * max(batch) <= 20 * 500 * 2 for batch in model.batches)
+
+
+def test_plan_batches_covers_all_indices():
+    shapes = [(10, w) for w in range(100, 0, -7)]
+    batches = plan_batches(shapes, batch_size=4, batch_order="aspect_ratio", max_batch_pixels=10 * 100 * 2)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(shapes)))
+
+
+def test_plan_batches_oversized_image():
+    batches = plan_batches([(10, 10), (100, 100)], batch_size=2, max_batch_pixels=50)
+    assert batches == [[0], [1]]
+
+
+def test_plan_batches_unknown_order():
+    with pytest.raises(ValueError):
+        plan_batches([(10, 10)], batch_size=1, batch_order="height")
+
+
+def test_predict_cache(tmp_path, images):
+    model = DummyModel()
+    model.cache = ResultCache(str(tmp_path))
+    first = model.predict(images, batch_size=3)
+    assert model.cache.misses == len(images)
+
+    model.batches = []
+    second = model.predict(images[:4] + [np.ones((20, 50, 3), dtype=np.uint8)], batch_size=3)
+    assert model.cache.hits == 4
+    assert model.batches == [[50]]
+    assert texts(second[:4]) == texts(first[:4])
+
+
+def test_predict_cache_kwargs(tmp_path, images):
+    model = DummyModel()
+    model.cache = ResultCache(str(tmp_path))
+    model.predict(images, batch_size=3)
+    model.predict(images, batch_size=5, batch_order="width")
+    assert model.cache.hits == len(images)
+    model.predict(images, image_scaling_factor=0.5)
+    assert model.cache.misses == 2 * len(images)
+
+
+def test_result_cache_eviction(tmp_path, images):
+    model = DummyModel()
+    model.cache = ResultCache(str(tmp_path), max_bytes=2000)
+    model.predict(images * 10)
+    model.predict([np.full((20, 20, 3), i, dtype=np.uint8) for i in range(50)])
+    assert model.cache._size <= 2000
+    assert sum(os.path.getsize(path) for path, _ in model.cache._entries()) == model.cache._size
+
+
+def test_predict_cache_duplicates(tmp_path, images):
+    model = DummyModel()
+    model.cache = ResultCache(str(tmp_path))
+    results = model.predict(images[:2] * 3, batch_size=8)
+    assert model.batches == [[50, 400]]
+    assert texts(results) == ["50", "400"] * 3
+    assert results[0] is not results[2]
+
+
+@pytest.mark.parametrize(
+    ("precision", "dtype"),
+    [(None, "torch.float32"), ("fp32", "torch.float32"), ("bf16", "torch.bfloat16"), ("int8", "torch.float32")],
+)
+def test_precision(images, precision, dtype):
+    model = LinearModel(precision=precision)
+    results = model.predict(images[:2])
+    assert texts(results) == [dtype, dtype]
+    assert results[0].metadata.get("precision") == precision
+    assert isinstance(model.model[0], torch.nn.Linear) == (precision != "int8")
+
+
+def test_precision_unknown():
+    with pytest.raises(ValueError):
+        LinearModel(precision="fp8")
+
+
+def test_num_threads():
+    num_threads = torch.get_num_threads()
+    try:
+        LinearModel(num_threads=1)
+        assert torch.get_num_threads() == 1
+    finally:
+        torch.set_num_threads(num_threads)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from htrflow.results import RecognizedText
+from htrflow.volume.columnar import NodeTable
+
+
+def test_table_preorder(demo_collection_segmented_nested):
+    table = demo_collection_segmented_nested.table()
+    expected = [node for page in demo_collection_segmented_nested for node in page.traverse()]
+    assert table.nodes == expected
+
+
+def test_table_parent(demo_collection_segmented_nested):
+    table = demo_collection_segmented_nested.table()
+    for node, parent in zip(table.nodes, table.parent):
+        if node.parent is None:
+            assert parent == -1
+        else:
+            assert table.nodes[parent] is node.parent
+
+
+def test_table_active_leaves(demo_collection_segmented_nested):
+    collection = demo_collection_segmented_nested
+    leaves = [leaf for page in collection for leaf in page.leaves()]
+    max_depth = max(page.max_depth() for page in collection)
+    expected = [leaf for leaf in leaves if leaf.depth == max_depth]
+    assert collection.table().active_leaves() == expected
+    assert list(collection.active_leaves()) == expected
+
+
+def test_table_max_depth(demo_collection_segmented_nested):
+    table = demo_collection_segmented_nested.table()
+    assert table.max_depth().tolist() == [page.max_depth() for page in demo_collection_segmented_nested]
+
+
+def test_table_text_score(demo_collection_segmented):
+    leaf = next(iter(demo_collection_segmented.leaves()))
+    leaf.add_data(text_result=RecognizedText(["a", "b"], [0.25, 0.75]))
+    table = demo_collection_segmented.table()
+    assert table.has_text.sum() == 1
+    assert np.isclose(table.text_score[table.has_text][0], 0.75)
+    assert table.select(table.has_text) == [leaf]
+
+
+def test_table_empty():
+    table = NodeTable([])
+    assert len(table) == 0
+    assert table.active_leaves() == []
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from htrflow.models.base_model import BaseModel
+from htrflow.models.data_parallel import DataParallelModel, _split_cores
+from htrflow.results import Result
+
+
+class WidthModel(BaseModel):
+    """Model which returns the width of each input image as text"""
+
+    def _predict(self, images, **kwargs):
+        return [Result.text_recognition_result({}, [str(image.shape[1])], [1.0]) for image in images]
+
+
+class BrokenModel(WidthModel):
+    def _predict(self, images, **kwargs):
+        raise ValueError("Broken model")
+
+
+@pytest.fixture(scope="module")
+def model():
+    model = DataParallelModel(WidthModel, {}, ["cpu", "cpu"], chunk_size=3)
+    yield model
+    model.close()
+
+
+def test_data_parallel_keeps_order(model):
+    images = [np.zeros((10, width, 3), dtype=np.uint8) for width in range(10, 30)]
+    results = model(images, batch_size=2)
+    assert [result.data["text_result"].top_candidate() for result in results] == [str(w) for w in range(10, 30)]
+
+
+def test_data_parallel_metadata(model):
+    assert model.metadata["model_class"] == "WidthModel"
+    assert model.metadata["devices"] == ["cpu", "cpu"]
+
+
+def test_data_parallel_worker_error():
+    model = DataParallelModel(BrokenModel, {}, ["cpu"])
+    with pytest.raises(RuntimeError, match="Broken model"):
+        model([np.zeros((10, 10, 3), dtype=np.uint8)])
+
+
+def test_split_cores_disjoint():
+    cores = _split_cores(["cpu", "cuda:0", "cpu"])
+    assert cores[1] is None
+    if cores[0] is not None:
+        assert not cores[0] & cores[2] or len(cores[0] | cores[2]) == 1
+
+
+def test_data_parallel_shared_memory():
+    model = DataParallelModel(WidthModel, {}, ["cpu"], chunk_size=2, shared_memory=True)
+    page = model.arena.share(np.zeros((10, 40, 3), dtype=np.uint8))
+    images = [page[:, :width] for width in range(10, 15)] + [np.zeros((5, 7, 3), dtype=np.uint8)]
+    results = model(images)
+    assert [result.data["text_result"].top_candidate() for result in results] == ["10", "11", "12", "13", "14", "7"]
+    assert len(model.arena) == 1
+    model.close()
@@ -1,3 +1,5 @@
+import numpy as np
+
 from htrflow.utils import geometry
 
 
@@ -140,3 +142,34 @@ def test_polygon_array():
     points = [geometry.Point(i, i) for i in range(n_points)]
     polygon = geometry.Polygon(points)
     assert all(p1.x == p2[0] and p1.y == p2[1] for p1, p2 in zip(points, polygon.as_nparray()))
+
+
+def test_polygon_from_array():
+    polygon = geometry.Polygon(np.array([[1, 2], [3, 4]], dtype=np.int64))
+    assert polygon.as_nparray().dtype == np.int32
+    assert polygon[1] == geometry.Point(3, 4)
+    assert len(polygon) == 2
+
+
+def test_polygon_bbox():
+    polygon = geometry.Polygon([(5, 1), (2, 7), (9, 3)])
+    assert polygon.bbox() == geometry.Bbox(2, 1, 9, 7)
+
+
+def test_polygon_rescale():
+    polygon = geometry.Polygon([(3, 5), (10, 11)])
+    assert polygon.rescale(0.5).points == [geometry.Point(1, 2), geometry.Point(5, 5)]
+
+
+def test_packed_mask_roundtrip():
+    mask = np.zeros((13, 7), dtype=np.uint8)
+    mask[2:9, 1:4] = 255
+    packed = geometry.PackedMask(mask)
+    assert packed.nbytes < mask.nbytes
+    assert np.array_equal(packed.unpack(), mask)
+
+
+def test_packed_mask_keeps_foreground_value():
+    mask = np.zeros((4, 4), dtype=np.uint8)
+    mask[1:3, 1:3] = 1
+    assert np.array_equal(geometry.PackedMask(mask).unpack(), mask)
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+from htrflow.utils import imgproc
+from htrflow.utils.imgproc import ImagePyramid, rescale_cached, rescale_linear
+
+
+def make_image():
+    return np.random.default_rng(0).integers(0, 255, (120, 90, 3), dtype=np.uint8)
+
+
+def test_pyramid_levels_match_uncached():
+    image = make_image()
+    pyramid = ImagePyramid(image)
+    assert np.array_equal(pyramid.rescaled(0.5), rescale_linear(image, 0.5))
+    assert np.array_equal(pyramid.gray, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    assert np.array_equal(
+        pyramid.rescaled(0.5, gray=True), cv2.cvtColor(rescale_linear(image, 0.5), cv2.COLOR_BGR2GRAY)
+    )
+
+
+def test_pyramid_caches_levels():
+    image = make_image()
+    pyramid = ImagePyramid(image)
+    assert pyramid.rescaled(0.5) is pyramid.rescaled(0.5)
+    assert pyramid.rescaled(1) is image
+
+
+def test_pyramid_memory_cap():
+    image = make_image()
+    pyramid = ImagePyramid(image, max_bytes=image.nbytes // 2)
+    pyramid.rescaled(0.5)
+    pyramid.rescaled(0.6)
+    assert pyramid.nbytes <= image.nbytes // 2
+    assert len(pyramid._levels) == 1
+
+
+def test_rescale_cached_uses_pyramid():
+    image = make_image()
+    assert not np.shares_memory(rescale_cached(image, 0.5), rescale_cached(image, 0.5))
+    pyramid = ImagePyramid(image)
+    assert rescale_cached(image, 0.5) is pyramid.rescaled(0.5)
+    assert ImagePyramid.of(image.copy()) is None
+
+
+def test_read_shape_falls_back_to_decoding(demo_image, monkeypatch):
+    def patched_open(*args, **kwargs):
+        # ultralytics patches Image.open, and raises ImportError on some files
+        raise ImportError
+
+    shape = imgproc.read(demo_image).shape[:2]
+    monkeypatch.setattr(Image, "open", patched_open)
+    assert imgproc.read_shape(demo_image) == shape
@@ -2,8 +2,10 @@ import random
 
 import numpy as np
 import pytest
+import torch
 
-# from htrflow.postprocess.mask_nms import multiclass_mask_nms, mask_nms
+from htrflow.postprocess import torch_mask_nms
+from htrflow.postprocess.mask_nms import local_mask_nms, mask_nms, multiclass_mask_nms
 from htrflow.results import Result, Segment
 
 
@@ -55,10 +57,83 @@ def large_dataset():
 
 
 def test_multiclass_mask_nms(results_with_mask):
-    # TODO: test work for different labels
-    pass
+    # segment_c is contained in segment_a (same class), segment_b has another class
+    assert multiclass_mask_nms(results_with_mask, downscale=1) == [2]
 
 
 def test_mask_nms(results_with_mask):
-    # TODO
-    pass
+    masks = [segment.global_mask for segment in results_with_mask.segments]
+    assert mask_nms(masks) == [0, 2]
+
+
+@pytest.mark.parametrize("num_masks", [2, 30, 100])
+@pytest.mark.parametrize("tile_size", [1, 7, 256])
+def test_local_mask_nms_matches_mask_nms(num_masks, tile_size):
+    segments = generate_random_masks(num_masks, num_classes=1)
+    expected = mask_nms([segment.global_mask for segment in segments])
+    bboxes = [segment.bbox for segment in segments]
+    masks = [segment.mask for segment in segments]
+    assert local_mask_nms(bboxes, masks, tile_size=tile_size) == expected
+
+
+def test_local_mask_nms_without_masks():
+    bboxes = [(0, 0, 100, 100), (10, 10, 20, 20), (90, 90, 150, 150)]
+    assert local_mask_nms(bboxes, [None, None, None]) == [1]
+
+
+def test_multiclass_mask_nms_downscaled():
+    result = simulate_large_dataset()
+    expected = set(multiclass_mask_nms(result, downscale=1))
+    downscaled = set(multiclass_mask_nms(result, downscale=0.25))
+    assert len(expected ^ downscaled) <= 0.05 * len(result.segments)
+
+
+def test_torch_multiclass_mask_nms_matches_numpy():
+    result = simulate_large_dataset()
+    masks = torch.from_numpy(np.stack([segment.global_mask for segment in result.segments]))
+    labels = torch.tensor([int(segment.class_label.split("_")[1]) for segment in result.segments])
+    assert torch_mask_nms.multiclass_mask_nms(masks, labels) == multiclass_mask_nms(result, downscale=1)
+
+
+def test_torch_batched_mask_nms(results_with_mask):
+    segments = generate_random_masks(20, image_size=(150, 150), num_classes=2)
+    batch_masks = [
+        torch.from_numpy(np.stack([segment.global_mask for segment in results_with_mask.segments])),
+        torch.from_numpy(np.stack([segment.global_mask for segment in segments])),
+        torch.zeros((0, 50, 50), dtype=torch.uint8),
+    ]
+    batch_labels = [
+        torch.tensor([1, 2, 1]),
+        torch.tensor([int(segment.class_label.split("_")[1]) for segment in segments]),
+        torch.zeros(0),
+    ]
+    removed = torch_mask_nms.batched_multiclass_mask_nms(batch_masks, batch_labels, num_threads=2)
+    expected = [torch_mask_nms.multiclass_mask_nms(masks, labels) for masks, labels in zip(batch_masks, batch_labels)]
+    assert removed == expected
+    assert removed[0] == [2]
+    assert removed[2] == []
+
+
+@pytest.mark.parametrize("downscale", [1.0, 0.5])
+def test_torch_mask_nms_chunked(monkeypatch, downscale):
+    result = simulate_large_dataset()
+    masks = torch.from_numpy(np.stack([segment.global_mask for segment in result.segments]))
+    labels = torch.tensor([int(segment.class_label.split("_")[1]) for segment in result.segments])
+    expected = torch_mask_nms.multiclass_mask_nms(masks, labels, downscale=downscale)
+    monkeypatch.setattr(torch_mask_nms, "_MAX_CHUNK_ELEMENTS", 1000)
+    assert torch_mask_nms.multiclass_mask_nms(masks, labels, downscale=downscale) == expected
+
+
+def test_torch_mask_nms_matches_numpy_on_large_masks():
+    # Mask 0 has 2**25 pixels and shares 2**24 + 1 of them with the larger mask 1,
+    # so it is just barely more than half contained. In float32, the intersection
+    # rounds to 2**24, which is exactly half.
+    shape = (7200, 7200)
+    area, intersection = 2**25, 2**24 + 1
+    masks = np.zeros((2, *shape), dtype=np.uint8)
+    masks[0].flat[:area] = 1
+    masks[1].flat[area - intersection :] = 1
+    segments = [Segment(mask=mask, class_label="class_1", orig_shape=shape) for mask in masks]
+    expected = multiclass_mask_nms(Result(metadata={}, segments=segments), downscale=1)
+    assert expected == [0]
+    assert torch_mask_nms.multiclass_mask_nms(torch.from_numpy(masks), torch.tensor([1, 1])) == expected
@@ -0,0 +1,156 @@
+import pytest
+
+from htrflow.models.base_model import BaseModel
+from htrflow.pipeline.checkpoint import CheckpointStore
+from htrflow.pipeline.pipeline import Pipeline
+from htrflow.pipeline.steps import CascadeRecognition, Inference, PipelineStep
+from htrflow.results import Result
+from htrflow.volume import volume
+
+
+class RecordStep(PipelineStep):
+    """Test step which records the labels of the collections it sees"""
+
+    def __init__(self, name):
+        self.name = name
+        self.seen = []
+
+    def run(self, collection):
+        for page in collection:
+            page.add_data(**{self.name: True})
+        self.seen.append(collection.label)
+        return collection
+
+
+class CountingModel(BaseModel):
+    """Model which returns the index of each input image in its call as text"""
+
+    def __init__(self, low_scores=False):
+        super().__init__(device="cpu")
+        self.calls = []
+        self.low_scores = low_scores
+
+    def _predict(self, images, **kwargs):
+        offset = sum(self.calls)
+        self.calls.append(len(images))
+        scores = [0.5 if self.low_scores and (offset + i) % 2 else 1.0 for i in range(len(images))]
+        return [Result.text_recognition_result({}, [str(offset + i)], [scores[i]]) for i in range(len(images))]
+
+
+class FailingStep(PipelineStep):
+    def run(self, collection):
+        raise RuntimeError("Failing step")
+
+
+@pytest.fixture
+def collections(demo_image):
+    collections = [volume.Collection([demo_image]) for _ in range(5)]
+    for i, collection in enumerate(collections):
+        collection.label = f"collection{i}"
+    return collections
+
+
+def test_stream_keeps_order(collections):
+    steps = [RecordStep("a"), RecordStep("b"), RecordStep("c")]
+    pipe = Pipeline(steps)
+    output = list(pipe.stream(iter(collections)))
+    assert [collection.label for collection in output] == [collection.label for collection in collections]
+    for step in steps:
+        assert step.seen == [collection.label for collection in collections]
+
+
+def test_stream_runs_all_steps(collections):
+    pipe = Pipeline([RecordStep("a"), RecordStep("b")])
+    for collection in pipe.stream(collections):
+        assert all(page.get("a") and page.get("b") for page in collection)
+
+
+def test_stream_start(collections):
+    steps = [RecordStep("a"), RecordStep("b")]
+    pipe = Pipeline(steps)
+    list(pipe.stream(collections, start=1))
+    assert steps[0].seen == []
+    assert len(steps[1].seen) == len(collections)
+
+
+def test_stream_raises(collections):
+    pipe = Pipeline([RecordStep("a"), FailingStep(), RecordStep("b")])
+    with pytest.raises(RuntimeError):
+        list(pipe.stream(collections))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_run_many_pools_inference(collections, streaming):
+    inference = Inference(CountingModel, {}, {"batch_size": 8})
+    record = RecordStep("a")
+    pipe = Pipeline([inference, record])
+    pipe.pool_pages = 3
+    pipe.streaming = streaming
+    output = list(pipe.run_many(collections))
+    assert output == collections
+    assert inference.model.calls == [3, 2]
+    assert [collection[0].text for collection in output] == ["0", "1", "2", "3", "4"]
+    assert record.seen == [collection.label for collection in collections]
+
+
+def test_cascade_recognition(collections):
+    cheap = Inference(CountingModel, {"low_scores": True}, {"batch_size": 8})
+    expensive = Inference(CountingModel, {}, {"batch_size": 8})
+    pipe = Pipeline([CascadeRecognition(cheap, expensive, threshold=0.8)])
+    pipe.pool_pages = len(collections)
+    output = list(pipe.run_many(collections))
+    assert cheap.model.calls == [5]
+    assert expensive.model.calls == [2]
+    assert [collection[0].text for collection in output] == ["0", "0", "2", "1", "4"]
+
+
+def test_run_does_not_split_collection_when_streaming(demo_collection_unsegmented):
+    pages = list(demo_collection_unsegmented.pages)
+    steps = [RecordStep("a"), RecordStep("b")]
+    pipe = Pipeline(steps)
+    pipe.streaming = True
+    collection = pipe.run(demo_collection_unsegmented)
+    assert collection is demo_collection_unsegmented
+    assert collection.pages == pages
+    assert all(page.get("a") and page.get("b") for page in collection)
+    assert all(step.seen == [collection.label] for step in steps)
+
+
+def test_checkpoints_resume_skips_finished_pages(tmp_path, demo_image):
+    steps = [RecordStep("a"), RecordStep("b")]
+    pipe = Pipeline(steps)
+    pipe.checkpoints = CheckpointStore(str(tmp_path))
+    pipe.do_backup = True
+    pipe.run(volume.Collection([demo_image]))
+
+    resumed = Pipeline([RecordStep("a"), RecordStep("b")])
+    resumed.checkpoints = pipe.checkpoints
+    resumed.resume = True
+    collection = resumed.run(volume.Collection([demo_image]))
+    assert collection.pages == []
+    assert all(step.seen == [] for step in resumed.steps)
+
+
+def test_checkpoints_resume_from_step(tmp_path, demo_image):
+    pipe = Pipeline([RecordStep("a"), FailingStep()])
+    pipe.checkpoints = CheckpointStore(str(tmp_path))
+    pipe.do_backup = True
+    with pytest.raises(RuntimeError):
+        pipe.run(volume.Collection([demo_image]))
+
+    resumed = Pipeline([RecordStep("a"), RecordStep("b")])
+    resumed.checkpoints = pipe.checkpoints
+    resumed.resume = True
+    collection = resumed.run(volume.Collection([demo_image]))
+    assert resumed.steps[0].seen == []
+    assert all(page.get("a") and page.get("b") for page in collection)
+
+
+def test_checkpoints_exclude_images(tmp_path, demo_collection_segmented):
+    store = CheckpointStore(str(tmp_path))
+    store.save(demo_collection_segmented, 0)
+    page = demo_collection_segmented[0]
+    restored = store.load(page, 0)
+    assert all(node._image is None for node in restored.traverse())
+    assert page._image is not None
+    assert len(restored.children) == len(page.children)
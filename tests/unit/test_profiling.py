@@ -0,0 +1,71 @@
+import csv
+import json
+import time
+
+import numpy as np
+import pytest
+
+from htrflow.models.base_model import BaseModel
+from htrflow.pipeline.pipeline import Pipeline
+from htrflow.pipeline.steps import PipelineStep
+from htrflow.results import Result
+from htrflow.utils import profiling
+from htrflow.utils.profiling import profiler
+
+
+class SlowModel(BaseModel):
+    def _predict(self, images, **kwargs):
+        with profiling.phase("preprocess"):
+            time.sleep(0.01)
+        time.sleep(0.02)
+        return [Result.text_recognition_result({}, ["text"], [1.0]) for _ in images]
+
+
+class NoopStep(PipelineStep):
+    def run(self, collection):
+        return collection
+
+
+@pytest.fixture
+def enabled_profiler():
+    profiler.enable()
+    yield profiler
+    profiler.disable()
+
+
+def test_profiler_disabled_records_nothing():
+    profiler.disable()
+    SlowModel(device="cpu").predict([np.zeros((10, 10, 3), dtype=np.uint8)])
+    assert profiler.batches == []
+
+
+def test_profiler_batches(enabled_profiler):
+    images = [np.zeros((10, 10, 3), dtype=np.uint8)] * 5
+    SlowModel(device="cpu").predict(images, batch_size=2)
+    assert [batch["items"] for batch in profiler.batches] == [2, 2, 1]
+    for batch in profiler.batches:
+        assert batch["model"] == "SlowModel"
+        assert batch["preprocess"] >= 0.01
+        assert 0.02 <= batch["forward"] < batch["wall_time"]
+
+
+def test_profiler_steps(enabled_profiler, demo_collection_unsegmented):
+    Pipeline([NoopStep(), NoopStep()]).run(demo_collection_unsegmented)
+    assert [step["step_index"] for step in profiler.steps] == [0, 1]
+    assert all(step["pages"] == len(demo_collection_unsegmented.pages) for step in profiler.steps)
+    assert set(profiler.summary()["steps"]) == {"1: NoopStep", "2: NoopStep"}
+
+
+@pytest.mark.parametrize("extension", ["json", "csv"])
+def test_profiler_save(tmp_path, enabled_profiler, demo_collection_unsegmented, extension):
+    Pipeline([NoopStep()]).run(demo_collection_unsegmented)
+    SlowModel(device="cpu").predict([np.zeros((10, 10, 3), dtype=np.uint8)])
+    path = tmp_path / f"profile.{extension}"
+    profiler.save(str(path))
+    with open(path) as f:
+        if extension == "json":
+            report = json.load(f)
+            assert len(report["steps"]) == len(report["batches"]) == 1
+            assert "SlowModel" in report["summary"]["models"]
+        else:
+            assert [row["kind"] for row in csv.DictReader(f)] == ["step", "batch"]
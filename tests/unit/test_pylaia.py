@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+import torch
+
+
+pytestmark = pytest.mark.teklia
+
+pytest.importorskip("laia")
+
+from htrflow.models.base_model import BaseModel  # noqa: E402
+from htrflow.models.teklia import pylaia  # noqa: E402
+
+
+class StubModel(torch.nn.Module):
+    """Model which records its inputs"""
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = []
+
+    def forward(self, x):
+        self.inputs.append(x)
+        return x.data
+
+
+class GreedyDecoder:
+    """Stub with the output format of PyLaia's `CTCGreedyDecoder`"""
+
+    def __call__(self, x):
+        n = x.shape[0]
+        return {"hyp": [[1, 2, 3]] * n, "prob-htr-char": [[0.9, 0.6, 0.9]] * n, "prob-htr": [0.8] * n}
+
+
+class LanguageDecoder:
+    """Stub with the output format of PyLaia's `CTCLanguageDecoder`"""
+
+    def __call__(self, x):
+        n = x.shape[0]
+        return {"hyp": [[1, 2, 3]] * n, "prob-htr": [0.7] * n}
+
+
+@pytest.fixture
+def model():
+    model = pylaia.PyLaia.__new__(pylaia.PyLaia)
+    BaseModel.__init__(model, device="cpu")
+    model.model = StubModel()
+    model.min_width = 40
+    model.symbols = {0: "<ctc>", 1: "a", 2: "<space>", 3: "b"}
+    model.decoder = GreedyDecoder()
+    return model
+
+
+@pytest.mark.parametrize(("decoder", "score"), [(GreedyDecoder(), 0.8), (LanguageDecoder(), 0.7)])
+def test_predict(model, decoder, score):
+    model.decoder = decoder
+    images = [np.zeros((20, 60, 3), dtype=np.uint8)] * 2
+    results = model._predict(images, resize_input_height=-1)
+    assert [result.data["text_result"].texts for result in results] == [["a b"], ["a b"]]
+    assert [result.data["text_result"].scores for result in results] == [[score], [score]]
+
+
+def test_predict_rtl(model):
+    results = model._predict([np.zeros((20, 60), dtype=np.uint8)], reading_order="RTL", resize_input_height=-1)
+    assert results[0].data["text_result"].texts == ["b a"]
+
+
+def test_predict_pads_to_min_width(model):
+    images = [np.full((20, 5), 255, dtype=np.uint8), np.zeros((10, 30), dtype=np.uint8)]
+    model._predict(images, resize_input_height=-1)
+    batch = model.model.inputs[0]
+    assert batch.data.shape == (2, 1, 20, 40)
+    # The batch is sorted by decreasing width
+    assert batch.sizes.tolist() == [[10, 40], [20, 40]]
+    # The images are inverted, so only the pixels of the black image are non-zero
+    assert batch.data.sum() == 10 * 30
+    assert batch.data[0, 0, :10, :30].all()
+
+
+def test_predict_ignores_unsupported_settings(model, caplog):
+    results = model._predict([np.zeros((20, 60), dtype=np.uint8)], resize_input_height=-1, num_workers=4, beam=3)
+    assert "beam" in caplog.text
+    assert "num_workers" not in caplog.text
+    assert results[0].metadata["decode_kwargs"] == {
+        "temperature": 1.0,
+        "reading_order": "LTR",
+        "resize_input_height": -1,
+    }
+
+
+@pytest.fixture(scope="module")
+def checkpoint(tmp_path_factory):
+    """A tiny, randomly initialized PyLaia model directory"""
+    from laia.common.saver import ModelSaver
+    from laia.models.htr import LaiaCRNN
+
+    path = tmp_path_factory.mktemp("pylaia")
+    symbols = ["<ctc>", "a", "b", "c", "<space>"]
+    (path / "syms.txt").write_text("".join(f"{symbol} {i}\n" for i, symbol in enumerate(symbols)))
+    settings = {
+        "num_input_channels": 1,
+        "num_output_labels": len(symbols),
+        "cnn_num_features": [4, 8],
+        "cnn_kernel_size": [3, 3],
+        "cnn_stride": [1, 1],
+        "cnn_dilation": [1, 1],
+        "cnn_activation": [torch.nn.LeakyReLU] * 2,
+        "cnn_poolsize": [2, 2],
+        "cnn_dropout": [0, 0],
+        "cnn_batchnorm": [False, False],
+        "image_sequencer": "avgpool-8",
+        "rnn_units": 8,
+        "rnn_layers": 1,
+        "rnn_dropout": 0,
+        "lin_dropout": 0,
+    }
+    ModelSaver(str(path)).save(LaiaCRNN, **settings)
+    torch.manual_seed(0)
+    torch.save(LaiaCRNN(**settings).state_dict(), path / "weights.ckpt")
+    return path
+
+
+def test_checkpoint(checkpoint):
+    model = pylaia.PyLaia(str(checkpoint), device="cpu")
+    assert model.min_width == model.model.get_min_valid_image_size(128) > 1
+
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (32, width, 3), dtype=np.uint8) for width in (1, 40, 120)]
+    results = model._predict(images, resize_input_height=-1)
+    texts = [result.data["text_result"].texts[0] for result in results]
+    scores = [result.data["text_result"].scores[0] for result in results]
+    assert all(0 < score <= 1 for score in scores)
+    # The batch is decoded sorted by width, but returned in input order
+    for image, text, score in zip(images, texts, scores):
+        (result,) = model._predict([image], resize_input_height=-1)
+        assert result.data["text_result"].texts == [text]
+        # Padding in the batch changes the scores slightly
+        assert result.data["text_result"].scores == pytest.approx([score], rel=1e-3)
+
+    rtl = model._predict(images, reading_order="RTL", resize_input_height=-1)
+    assert [result.data["text_result"].texts[0] for result in rtl] == [text[::-1] for text in texts]
+
+    hot = model._predict(images, temperature=5.0, resize_input_height=-1)
+    assert model.decoder.temperature == 5.0
+    assert [result.data["text_result"].scores[0] for result in hot] != scores
@@ -1,3 +1,5 @@
+import pickle
+
 import cv2
 import numpy as np
 import pytest
@@ -44,3 +46,34 @@ class TestSegment:
         assert segment.bbox.xyxy == given_bbox, "Provided bbox should be used"
         assert np.array_equal(segment.mask, given_mask), "Provided mask should be used"
         assert np.array_equal(segment.polygon.as_nparray(), expected_polygon), "Polygon should approximate the ellipse"
+
+
+def test_segment_mask_from_polygon_is_lazy():
+    polygon = [(10, 10), (50, 12), (40, 40), (12, 30)]
+    segment = Segment(polygon=polygon, orig_shape=(60, 60))
+    assert segment._mask is None
+
+    full_mask = np.zeros((60, 60), dtype=np.uint8)
+    cv2.fillPoly(full_mask, [np.array(polygon)], color=255)
+    x1, y1, x2, y2 = segment.bbox
+    assert np.array_equal(segment.mask, full_mask[y1:y2, x1:x2])
+    assert segment._mask is not None
+
+
+def test_segment_mask_from_polygon_clipped_to_image():
+    segment = Segment(polygon=[(10, 10), (80, 10), (80, 40), (10, 40)], orig_shape=(60, 60))
+    assert segment.mask.shape == (30, 70)
+    assert not segment.mask[:, 50:].any()
+    assert segment.mask[:, :50].all()
+
+
+def test_segment_unpickle_unpacked_mask():
+    # Segments pickled before the masks were bit-packed store the mask as is
+    mask = np.zeros((5, 5), dtype=np.uint8)
+    mask[1:4, 1:4] = 1
+    segment = Segment.__new__(Segment)
+    segment.__dict__.update(
+        bbox=Segment(bbox=(0, 0, 5, 5)).bbox, polygon=None, mask=mask, score=None, class_label=None, orig_shape=None
+    )
+    restored = pickle.loads(pickle.dumps(segment))
+    assert np.array_equal(restored.mask, mask)
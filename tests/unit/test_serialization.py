@@ -1,9 +1,16 @@
+import pickle
+import re
+
 import pytest
+import xmlschema
 
 from htrflow import serialization
 from htrflow.results import RecognizedText
 
 
+TIMESTAMP = r"\d{4}-\d{2}-\d{2}T[\d:.]+"
+
+
 @pytest.fixture
 def alto():
     return serialization.AltoXML()
@@ -60,3 +67,62 @@ def test_page_segmented_twice(demo_page_segmented_twice, page):
 def test_page_segmented_thrice(demo_page_segmented_thrice, page):
     doc = page.serialize(demo_page_segmented_thrice)
     page.validate(doc)
+
+
+def test_page_lazy_validation(demo_page_segmented_twice, page):
+    doc = page.serialize(demo_page_segmented_twice)
+    page.validate(doc, lazy=True)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_page_validation_invalid(demo_page_segmented_once, page, lazy):
+    doc = page.serialize(demo_page_segmented_once).replace("TextRegion", "TextBlob")
+    with pytest.raises(xmlschema.XMLSchemaValidationError):
+        page.validate(doc, lazy=lazy)
+
+
+def test_serializer_validation_setting(demo_page_segmented_once, monkeypatch):
+    serializer = serialization.PageXML(validation="lazy")
+    calls = []
+    monkeypatch.setattr(serialization.serialization, "validate_xml", lambda *args: calls.append(args))
+    serializer.serialize(demo_page_segmented_once)
+    assert calls and calls[0][2] is True
+
+
+def test_schema_compiled_once(page):
+    assert serialization.serialization.load_schema(page.schema) is serialization.serialization.load_schema(page.schema)
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+@pytest.mark.parametrize("format", ["page", "json", "txt"])
+def test_save_collection_parallel(tmp_path, demo_collection_segmented_nested_with_text, format, executor):
+    collection = demo_collection_segmented_nested_with_text
+    serial_dir = tmp_path / "serial"
+    parallel_dir = tmp_path / "parallel"
+    serialization.save_collection(collection, format, str(serial_dir), workers=1)
+    serialization.save_collection(collection, format, str(parallel_dir), workers=4, executor=executor)
+
+    serial_files = sorted(path.relative_to(serial_dir) for path in serial_dir.rglob("*") if path.is_file())
+    parallel_files = sorted(path.relative_to(parallel_dir) for path in parallel_dir.rglob("*") if path.is_file())
+    assert serial_files
+    assert serial_files == parallel_files
+    assert not any(path.suffix == ".tmp" for path in parallel_files)
+    for path in serial_files:
+        # The documents only differ in their timestamps
+        serial = re.sub(TIMESTAMP, "", (serial_dir / path).read_text())
+        parallel = re.sub(TIMESTAMP, "", (parallel_dir / path).read_text())
+        assert serial == parallel
+
+
+def test_serializer_pickle(demo_page_segmented_once, page):
+    serializer = pickle.loads(pickle.dumps(page))
+    expected = re.sub(TIMESTAMP, "", page.serialize(demo_page_segmented_once))
+    assert re.sub(TIMESTAMP, "", serializer.serialize(demo_page_segmented_once)) == expected
+
+
+def test_serialize_collection_order(demo_collection_with_text):
+    serializer = serialization.PlainText()
+    outputs = serializer.serialize_collection(demo_collection_with_text, workers=4)
+    assert [filename for _, filename in outputs] == [
+        f"{demo_collection_with_text.label}/{page.label}.txt" for page in demo_collection_with_text
+    ]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from htrflow.utils.shared_memory import ImageArena, attach
+
+
+@pytest.fixture
+def arena():
+    arena = ImageArena()
+    yield arena
+    arena.close()
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(0).integers(0, 255, (50, 60, 3), dtype=np.uint8)
+
+
+def test_share_copies_image(arena, image):
+    shared = arena.share(image)
+    assert np.array_equal(shared, image)
+    assert shared in arena
+    assert image not in arena
+
+
+def test_attach_view_without_copy(arena, image):
+    shared = arena.share(image)
+    view = shared[10:20, 5:15]
+    handle = arena.handle(view)
+    (attached,) = attach([handle])
+    assert np.array_equal(attached, image[10:20, 5:15])
+
+    # The attached image maps the same memory
+    attached[0, 0] = 0
+    assert not view[0, 0].any()
+    arena.release(handle)
+
+
+def test_handle_of_unshared_image(arena, image):
+    assert arena.handle(image) is None
+
+
+def test_block_freed_after_last_reference(arena, image):
+    shared = arena.share(image)
+    handle = arena.handle(shared[:10])
+    del shared
+    assert len(arena) == 1
+    arena.release(handle)
+    assert len(arena) == 0
+
+
+def test_block_freed_with_image(arena, image):
+    shared = arena.share(image)
+    view = shared[:10]
+    del shared
+    assert len(arena) == 1
+    del view
+    assert len(arena) == 0
+
+
+def test_share_page_image(arena, demo_page_segmented_once):
+    page = demo_page_segmented_once
+    page.share_image(arena)
+    assert page.image in arena
+    assert all(node.image in arena for node in page.traverse(lambda node: node.mask is None))
+    page.clear_images()
+    assert len(arena) == 0
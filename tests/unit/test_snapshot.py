@@ -0,0 +1,96 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from htrflow import serialization
+from htrflow.results import Segment
+from htrflow.volume.snapshot import Snapshot, SnapshotError
+from htrflow.volume.volume import Collection
+
+
+def test_snapshot_roundtrip(tmp_path, demo_collection_segmented_nested_with_text):
+    collection = demo_collection_segmented_nested_with_text
+    path = collection.save_snapshot(str(tmp_path / "snapshot"))
+    restored = Collection.from_snapshot(path)
+
+    original_nodes = [node for page in collection for node in page.traverse()]
+    restored_nodes = [node for page in restored for node in page.traverse()]
+    assert [node.label for node in original_nodes] == [node.label for node in restored_nodes]
+    assert [node.text for node in original_nodes] == [node.text for node in restored_nodes]
+    assert [node.depth for node in original_nodes] == [node.depth for node in restored_nodes]
+    for original, node in zip(original_nodes, restored_nodes):
+        assert original.bbox == node.bbox
+        assert np.array_equal(original.polygon.as_nparray(), node.polygon.as_nparray())
+        assert (original.mask is None) == (node.mask is None)
+        if original.mask is not None:
+            assert np.array_equal(original.mask, node.mask)
+        assert np.array_equal(original.image, node.image)
+
+    json_serializer = serialization.Json()
+    assert json_serializer.serialize(collection.pages[0]) == json_serializer.serialize(restored.pages[0])
+
+
+def test_snapshot_images_are_memory_mapped(tmp_path, demo_collection_segmented):
+    page = demo_collection_segmented.pages[0]
+    page.image  # load the image so that it is saved
+    snapshot = Snapshot(demo_collection_segmented.save_snapshot(str(tmp_path / "snapshot")))
+    restored = snapshot.page(0)
+    assert isinstance(restored._image, np.memmap)
+    assert np.array_equal(restored.image, page.image)
+
+
+def test_snapshot_without_images(tmp_path, demo_collection_segmented):
+    path = demo_collection_segmented.save_snapshot(str(tmp_path / "snapshot"), images=False)
+    assert not os.path.exists(os.path.join(path, "images"))
+    restored = Collection.from_snapshot(path)
+    assert restored.pages[0]._image is None
+    assert np.array_equal(restored.pages[0].image, demo_collection_segmented.pages[0].image)
+
+
+def test_snapshot_lazy_polygon_masks(tmp_path, demo_image):
+    collection = Collection([demo_image])
+    collection.pages[0].create_segments([Segment(polygon=[(10, 10), (80, 15), (60, 70)], orig_shape=(100, 100))])
+    restored = Collection.from_snapshot(collection.save_snapshot(str(tmp_path / "snapshot")))
+    segment = restored.pages[0][0].segment
+    assert segment._mask is None and segment._mask_from_polygon
+    assert np.array_equal(segment.mask, collection.pages[0][0].segment.mask)
+
+
+def test_snapshot_class_labels(tmp_path, demo_image):
+    collection = Collection([demo_image])
+    labels = [None, "text", 0, np.int64(3), "7"]
+    collection.pages[0].create_segments([Segment(bbox=(0, 0, 10, 10), class_label=label) for label in labels])
+    restored = Collection.from_snapshot(collection.save_snapshot(str(tmp_path / "snapshot")))
+    restored_labels = [node.segment.class_label for node in restored.pages[0]]
+    assert restored_labels == labels
+    assert [type(label) for label in restored_labels] == [type(None), str, int, int, str]
+
+
+def test_snapshot_load_single_page(tmp_path, demo_image):
+    collection = Collection([demo_image] * 3)
+    collection.pages[1].add_data(marker=True)
+    snapshot = Snapshot(collection.save_snapshot(str(tmp_path / "snapshot")))
+    assert len(snapshot) == 3
+    assert snapshot.page(1).get("marker")
+    assert len(snapshot.collection([1]).pages) == 1
+
+
+def test_snapshot_overwrite(tmp_path, demo_collection_segmented):
+    path = str(tmp_path / "snapshot")
+    demo_collection_segmented.save_snapshot(path)
+    demo_collection_segmented.save_snapshot(path)
+    assert sorted(os.listdir(tmp_path)) == ["snapshot"]
+
+
+def test_snapshot_unsupported_version(tmp_path, demo_collection_segmented):
+    path = demo_collection_segmented.save_snapshot(str(tmp_path / "snapshot"))
+    manifest_path = os.path.join(path, "manifest.json")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["version"] += 1
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+    with pytest.raises(SnapshotError):
+        Snapshot(path)
@@ -0,0 +1,183 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+from transformers import TrOCRConfig, VisionEncoderDecoderConfig, VisionEncoderDecoderModel, ViTConfig
+
+from htrflow.models.huggingface import trocr_onnx
+
+
+class TorchSession:
+    """Stand-in for an ONNX Runtime session which runs the graph's PyTorch module"""
+
+    def __init__(self, module, inputs, outputs):
+        self.module = module
+        self.inputs = inputs
+        self.outputs = outputs
+        self.ortvalue_inputs = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name=name) for name in self.inputs]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name=name) for name in self.outputs]
+
+    def io_binding(self):
+        return Binding()
+
+    def run_with_iobinding(self, binding):
+        with torch.no_grad():
+            outputs = self.module(*(torch.from_numpy(binding.inputs[name]) for name in self.inputs))
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        binding.outputs = [OrtValue(output.numpy()) for output in outputs]
+        self.ortvalue_inputs.append(binding.ortvalue_inputs)
+
+
+class OrtValue:
+    """Stand-in for a CPU `onnxruntime.OrtValue`"""
+
+    def __init__(self, array):
+        self.array = np.ascontiguousarray(array)
+
+    def numpy(self):
+        return self.array.copy()
+
+    def data_ptr(self):
+        return self.array.ctypes.data
+
+    def shape(self):
+        return list(self.array.shape)
+
+    def data_type(self):
+        return {np.float32: "tensor(float)", np.float16: "tensor(float16)"}[self.array.dtype.type]
+
+
+class Binding:
+    def __init__(self):
+        self.inputs = {}
+        self.ortvalue_inputs = []
+        self.outputs = []
+
+    def bind_cpu_input(self, name, value):
+        self.inputs[name] = value
+
+    def bind_ortvalue_input(self, name, value):
+        self.inputs[name] = value.array
+        self.ortvalue_inputs.append(name)
+
+    def bind_output(self, name, device):
+        pass
+
+    def get_outputs(self):
+        return self.outputs
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    encoder = ViTConfig(
+        hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64, image_size=32, patch_size=8
+    )
+    decoder = TrOCRConfig(
+        vocab_size=50,
+        d_model=24,
+        decoder_layers=2,
+        decoder_attention_heads=2,
+        decoder_ffn_dim=48,
+        pad_token_id=1,
+        eos_token_id=2,
+        decoder_start_token_id=2,
+    )
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder, decoder)
+    config.decoder_start_token_id = 2
+    config.pad_token_id = 1
+    model = VisionEncoderDecoderModel(config=config).eval()
+    with torch.no_grad():
+        # Make the randomly initialized decoder produce varied sequences
+        for parameter in model.decoder.parameters():
+            parameter.normal_(0, 0.5)
+        model.decoder.output_projection.weight.normal_(0, 0.15)
+    return model
+
+
+@pytest.fixture(scope="module")
+def onnx_model(model):
+    n_layers = model.decoder.config.decoder_layers
+    entries = trocr_onnx._cache_entries(n_layers)
+    past = [f"past_key_values.{i}.{attention}.{kv}" for i, attention, kv in entries]
+    present = [f"present.{i}.{attention}.{kv}" for i, attention, kv in entries]
+    attentions = [f"cross_attentions.{i}" for i in range(n_layers)]
+    self_present = [name for name in present if ".decoder." in name]
+    return trocr_onnx.OnnxTrOCR(
+        TorchSession(trocr_onnx._EncoderGraph(model), ["pixel_values"], ["last_hidden_state"]),
+        TorchSession(
+            trocr_onnx._DecoderGraph(model), ["input_ids", "encoder_hidden_states"], ["logits", *present, *attentions]
+        ),
+        TorchSession(
+            trocr_onnx._DecoderWithPastGraph(model),
+            ["input_ids", "encoder_hidden_states", *past],
+            ["logits", *self_present, *attentions],
+        ),
+    )
+
+
+@pytest.fixture
+def pixel_values():
+    return torch.randn(4, 3, 32, 32, generator=torch.Generator().manual_seed(1))
+
+
+@pytest.mark.parametrize("eos", [2, 36, 42])
+def test_greedy_search_matches_generate(model, onnx_model, pixel_values, eos):
+    expected = model.generate(
+        pixel_values, max_new_tokens=10, eos_token_id=eos, return_dict_in_generate=True, output_attentions=True
+    )
+    outputs = onnx_model.generate(
+        pixel_values.numpy(),
+        decoder_start_token_id=2,
+        eos_token_id=eos,
+        pad_token_id=1,
+        max_new_tokens=10,
+        output_attentions=True,
+    )
+    assert torch.equal(outputs.sequences, expected.sequences)
+    assert len(outputs.cross_attentions) == len(expected.cross_attentions)
+    for step, expected_step in zip(outputs.cross_attentions, expected.cross_attentions):
+        for layer, expected_layer in zip(step, expected_step):
+            assert torch.allclose(layer, expected_layer[:, :, -1:], atol=1e-6)
+
+
+@pytest.mark.parametrize("early_stopping", [False, True, "never"])
+@pytest.mark.parametrize("num_beams", [2, 4])
+@pytest.mark.parametrize("eos", [8, 28, 36, 42])
+def test_beam_search_matches_generate(model, onnx_model, pixel_values, num_beams, eos, early_stopping):
+    expected = model.generate(
+        pixel_values,
+        max_new_tokens=10,
+        eos_token_id=eos,
+        num_beams=num_beams,
+        num_return_sequences=num_beams,
+        length_penalty=1.0,
+        early_stopping=early_stopping,
+        output_scores=True,
+        return_dict_in_generate=True,
+    )
+    outputs = onnx_model.generate(
+        pixel_values.numpy(),
+        decoder_start_token_id=2,
+        eos_token_id=eos,
+        pad_token_id=1,
+        max_new_tokens=10,
+        num_beams=num_beams,
+        early_stopping=early_stopping,
+    )
+    assert torch.equal(outputs.sequences, expected.sequences)
+    assert np.allclose(outputs.sequence_scores, np.exp(expected.sequences_scores.numpy()), atol=1e-5)
+
+
+def test_cache_is_bound_as_ortvalues(onnx_model, pixel_values):
+    onnx_model.generate(
+        pixel_values.numpy(), decoder_start_token_id=2, eos_token_id=[], pad_token_id=1, max_new_tokens=3
+    )
+    past = [name for name in onnx_model.decoder_with_past.inputs if name.startswith("past_key_values.")]
+    assert onnx_model.decoder_with_past.ortvalue_inputs[-2:] == [past, past]
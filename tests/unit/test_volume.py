@@ -1,7 +1,10 @@
 import pickle
 
+import numpy as np
 import pytest
 
+from htrflow.results import Segment
+from htrflow.utils import imgproc
 from htrflow.volume import volume
 from htrflow.volume.node import Node
 
@@ -154,8 +157,246 @@ def test_pickling(demo_collection_segmented_nested):
     assert vol[0, 0, 0].label == demo_collection_segmented_nested[0, 0, 0].label
 
 
+def test_unpickle_unpacked_masks(demo_collection_segmented):
+    page = demo_collection_segmented[0]
+    page.mask = np.full((page.height, page.width), 255, dtype=np.uint8)
+    expected = [node.mask for node in page.traverse()]
+
+    # Rewrite the state to the format used before the masks were bit-packed
+    for node in page.traverse():
+        if isinstance(node, volume.SegmentNode):
+            segment = node.segment.__dict__
+            segment["mask"] = node.segment.mask
+            del segment["_mask"], segment["_mask_from_polygon"]
+            node.__dict__["mask"] = segment["mask"]
+        else:
+            node.__dict__["mask"] = node.mask
+        del node.__dict__["_mask"]
+    for node in page.traverse():
+        node.__dict__["children"] = node.__dict__.pop("_children")
+
+    restored = pickle.loads(pickle.dumps(page))
+    masks = [node.mask for node in restored.traverse()]
+    assert len(masks) == len(expected)
+    assert all(np.array_equal(a, b) for a, b in zip(masks, expected))
+    assert any(mask is not None for mask in expected[1:])
+
+
 def test_resize(demo_collection_segmented_nested_with_text):
     size = (100, 100)
     demo_collection_segmented_nested_with_text.set_size(size)
     for node in demo_collection_segmented_nested_with_text.traverse(filter=lambda _: True):
         assert node.coord.x + node.width <= size[1] and node.coord.y + node.height <= size[0]
+
+
+def test_page_shape_from_header(demo_image):
+    page = volume.PageNode(demo_image)
+    assert page.original_shape == imgproc.read(demo_image).shape[:2]
+
+
+def test_page_shape_invalid_file(tmp_path):
+    path = tmp_path / "not_an_image.jpg"
+    path.write_text("not an image")
+    assert volume.paths2pages([str(path)]) == []
+
+
+def test_prefetch_images(demo_image):
+    collections = [volume.Collection([demo_image]) for _ in range(3)]
+    prefetched = list(volume.prefetch_images(iter(collections), max_workers=2, max_bytes=1))
+    assert prefetched == collections
+    assert all(page._image is not None for collection in prefetched for page in collection)
+
+
+def test_segment_image_is_view(demo_image):
+    page = volume.PageNode(demo_image)
+    page.create_segments([Segment(bbox=(10, 20, 110, 70))])
+    segment = page[0]
+    assert segment._image is None
+    assert np.shares_memory(segment.image, page.image)
+    assert (segment.image == page.image[20:70, 10:110]).all()
+
+
+def test_segment_image_nested_masks(demo_image):
+    page = volume.PageNode(demo_image)
+    mask = np.zeros(page.image.shape[:2], dtype=np.uint8)
+    mask[20:70, 10:110] = 1
+    mask[20:70, 60:110] = 0
+    mask[20:30, 60:110] = 1
+    page.create_segments([Segment(mask=mask)])
+    region = page[0]
+    region.create_segments([Segment(bbox=(0, 0, region.width, region.height))])
+    line = region[0]
+    assert not np.shares_memory(line.image, page.image)
+    assert (line.image[:10] == page.image[20:30, 10:110]).all()
+    assert (line.image[10:, 50:] == 255).all()
+    assert (line.image[10:, :50] == page.image[30:70, 10:60]).all()
+
+
+def test_masked_segment_image_is_cached(demo_image):
+    page = volume.PageNode(demo_image)
+    mask = np.zeros(page.image.shape[:2], dtype=np.uint8)
+    mask[20:70, 10:110] = 1
+    page.create_segments([Segment(mask=mask)])
+    region = page[0]
+    region.create_segments([Segment(bbox=(0, 0, 50, 20))])
+    line = region[0]
+    assert region.image is region.image
+    assert np.shares_memory(line.image, region.image)
+
+    region.mask = np.zeros((region.height, region.width), dtype=np.uint8)
+    assert region._image is None
+    assert line._image is None
+    assert (line.image == 255).all()
+
+
+def test_node_revision_increases_on_modification():
+    root = two_layer_tree()
+    grandchild = root[0, 0]
+    revision = root.revision
+    grandchild.add_data(key="value")
+    assert root.revision > revision
+    revision = root.revision
+    grandchild.children = [Node(grandchild)]
+    assert root.revision > revision
+
+
+def test_node_cache_follows_in_place_children_changes():
+    root = one_layer_tree()
+    child = root[0]
+    assert root.max_depth() == 1
+    assert len(root.leaves()) == 3
+
+    child.children.append(Node(child))
+    assert root.max_depth() == 2
+    assert root.leaves()[0] is child[0]
+
+    child.children.pop()
+    root.children.sort(key=lambda node: node is child)
+    assert root.max_depth() == 1
+    assert root.leaves()[-1] is child
+
+
+def test_node_children_pickle():
+    root = pickle.loads(pickle.dumps(two_layer_tree()))
+    child = root[0]
+    assert type(child.children) is type(root.children)
+    child[0].children.append(Node(child[0]))
+    assert root.max_depth() == 3
+
+
+def test_cached_leaves_invalidated():
+    root = two_layer_tree(3)
+    assert len(root.leaves()) == 9
+    assert root.max_depth() == 2
+
+    root[0, 0].children = [Node(root[0, 0])]
+    assert len(root.leaves()) == 9
+    assert root.max_depth() == 3
+
+    root[0, 0, 0].detach()
+    assert root.max_depth() == 2
+
+    root.prune(lambda node: node.depth == 2)
+    assert root.leaves() == [root]
+
+
+def test_collection_active_leaves_cached(demo_collection_segmented_nested):
+    collection = demo_collection_segmented_nested
+    assert collection.table() is collection.table()
+
+    leaf = next(iter(collection.active_leaves()))
+    leaf.create_segments([Segment(bbox=(0, 0, leaf.width, leaf.height))])
+    assert list(collection.active_leaves()) == leaf.children
+
+
+def test_pickling_drops_caches(demo_collection_segmented_nested):
+    collection = demo_collection_segmented_nested
+    collection.table()
+    restored = pickle.loads(pickle.dumps(collection))
+    assert not hasattr(restored, "_table")
+    assert all(not page._cache for page in restored)
+    assert len(list(restored.active_leaves())) == len(list(collection.active_leaves()))
+
+
+def test_incremental_relabel_matches_full_relabel():
+    root = two_layer_tree(3)
+    root.relabel_levels(["region", "line"])
+    root[1].children = [Node(root[1]) for _ in range(2)] + root[1].children
+    root[2, 0].detach()
+    root.relabel_levels(["region", "line"])
+    labels = [node.label for node in root.traverse()]
+
+    for node in root.traverse():
+        node._label_state = None
+    root.relabel_levels(["region", "line"])
+    assert labels == [node.label for node in root.traverse()]
+    assert len(set(labels)) == len(labels)
+
+
+def test_incremental_relabel_skips_unchanged_subtrees(monkeypatch):
+    root = two_layer_tree(3)
+    root.relabel_levels(["region", "line"])
+    root[1, 0].add_data(key="value")
+
+    relabeled = []
+    original_relabel = Node.relabel
+    monkeypatch.setattr(
+        Node,
+        "relabel",
+        lambda self, *args, **kwargs: relabeled.append(self) or original_relabel(self, *args, **kwargs),
+    )
+    root.relabel_levels(["region", "line"])
+    assert relabeled == [root, root[1], root[1, 0]]
+
+
+def test_lazy_relabel(demo_collection_segmented_nested):
+    collection = demo_collection_segmented_nested
+    collection.set_label_format(level_labels=["region", "line"])
+    collection.relabel()
+    page = collection.pages[0]
+    assert page._pending_relabel is not None
+    assert page[0, 0].label == f"{page.label}_region0_line0"
+    assert page._pending_relabel is None
+
+
+def test_preorder_matches_recursive_order():
+    root = two_layer_tree(3)
+    expected = [root]
+    for child in root.children:
+        expected += [child, *child.children]
+    assert list(root.preorder()) == expected
+
+
+def test_postorder():
+    root = two_layer_tree(2)
+    expected = []
+    for child in root.children:
+        expected += [*child.children, child]
+    assert list(root.postorder()) == expected + [root]
+
+
+def test_levelorder():
+    root = two_layer_tree(2)
+    assert [node.depth for node in root.levelorder()] == [0, 1, 1, 2, 2, 2, 2]
+
+
+def test_first_and_any():
+    root = two_layer_tree(3)
+    root[1, 2].add_data(key="value")
+    assert root.first(lambda node: node.get("key") is not None) is root[1, 2]
+    assert root.any(lambda node: node.depth == 2)
+    assert not root.any(lambda node: node.depth == 3)
+    assert root.first(lambda node: node.depth == 3) is None
+
+
+def test_page_pyramid_follows_image(demo_page_unsegmented):
+    page = demo_page_unsegmented
+    pyramid = page.pyramid
+    assert pyramid is page.pyramid
+    assert pyramid.image is page.image
+
+    half = pyramid.rescaled(0.5)
+    page.rescale(0.5)
+    assert page.image is half
+    assert page.pyramid is not pyramid
+    assert page.pyramid.image is page.image